@@ -1,4 +1,4 @@
-from flask import jsonify, request, Response, send_from_directory, abort, current_app, send_file, redirect, render_template_string, url_for, render_template, make_response
+from flask import jsonify, request, Response, send_from_directory, abort, current_app, send_file, redirect, render_template_string, url_for, render_template, make_response, stream_with_context
 from celery_app import app as celery_app
 from api.app import app, CORS
 from podcast_processor import process_podcast_episode
@@ -17,7 +17,7 @@ from utils import (
 from rss_modifier import create_modified_rss_feed, get_modified_rss_feed
 from llm_processor import find_unwanted_content
 from audio_editor import edit_audio
-from job_manager import update_job_status, get_job_status, append_job_log, get_job_logs, get_current_jobs, delete_job, get_job_info
+from job_manager import update_job_status, get_job_status, get_job_statuses, append_job_log, get_job_logs, get_job_logs_since, get_current_jobs, delete_job, get_job_info, iter_job_events
 import json
 import logging
 import queue
@@ -33,20 +33,22 @@ import time
 import shutil
 from utils import get_episode_folder
 from firebase_admin import storage
-from prompt_loader import load_prompt
+from prompt_loader import load_prompt, save_prompt
 import feedparser
 from tasks import process_podcast_task
 from datetime import datetime, timedelta
 import pytz
 from utils import save_auto_processed_podcast, load_processed_podcasts
 from rss_modifier import get_modified_rss_feed
+from metadata_store import get_metadata_store
+from feed_cache import get_feed, get_stored_feed
+from feed_state import get_state_version
+from rendered_feed_cache import rendered_feed_key, get_rendered_feed, save_rendered_feed
+from feed_poller import remember_url_root, resolve_url_root
 
 # Update the OUTPUT_DIR definition
 OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'output'))
 
-# Update this line to use the root of the bucket
-PROCESSED_PODCASTS_FILE = 'db.json'
-
 log_queue = queue.Queue()
 
 # Add Taddy API configuration
@@ -65,84 +67,16 @@ processing_status = {}
 template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates'))
 app.template_folder = template_dir
 
-def load_processed_podcasts():
-    try:
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        if blob.exists():
-            json_data = blob.download_as_text()
-            data = json.loads(json_data)
-            return {
-                'processed_podcasts': data.get('processed_podcasts', {}),
-                'auto_processed_podcasts': data.get('auto_processed_podcasts', []),
-                'podcast_info': data.get('podcast_info', {}),  # Change this to {}
-                'prompts': data.get('prompts', {})
-            }
-        else:
-            return {'processed_podcasts': {}, 'auto_processed_podcasts': [], 'podcast_info': {}, 'prompts': {}}
-    except Exception as e:
-        logging.error(f"Error loading processed podcasts from Firebase: {str(e)}")
-        logging.error(traceback.format_exc())
-        return {'processed_podcasts': {}, 'auto_processed_podcasts': [], 'podcast_info': {}, 'prompts': {}}
-
-def save_processed_podcast(podcast_data):
-    try:
-        # Load existing data
-        data = load_processed_podcasts()
-        rss_url = podcast_data['rss_url']
-
-        if rss_url not in data['processed_podcasts']:
-            data['processed_podcasts'][rss_url] = []
-
-        # Check if the episode already exists
-        existing_episode = next((ep for ep in data['processed_podcasts'][rss_url] if ep['episode_title'] == podcast_data['episode_title']), None)
-
-        if existing_episode:
-            # Update the existing episode data
-            existing_episode.update(podcast_data)
-            logging.info(f"Updated existing episode: {podcast_data['episode_title']}")
-        else:
-            # Append new episode data
-            data['processed_podcasts'][rss_url].append(podcast_data)
-            logging.info(f"Added new episode: {podcast_data['episode_title']}")
-
-        # Convert file paths to Firebase Storage URLs
-        for key in ['edited_url', 'transcript_file', 'unwanted_content_file', 'input_file', 'output_file']:
-            if key in podcast_data and podcast_data[key]:
-                old_value = podcast_data[key]
-                podcast_data[key] = upload_to_firebase(podcast_data[key])
-                logging.info(f"Uploaded {key} to Firebase: {old_value} -> {podcast_data[key]}")
-
-        # Update podcast info
-        data['podcast_info'][rss_url] = {
-            'name': podcast_data['podcast_title'],
-            'imageUrl': podcast_data.get('image_url', '')
-        }
-
-        # Save to Firebase
-        save_processed_podcasts(data)
-
-        logging.info(f"Successfully saved processed podcast to Firebase: {podcast_data['episode_title']}")
-
-    except Exception as e:
-        logging.error(f"Error saving processed podcast to Firebase: {str(e)}")
-        logging.error(traceback.format_exc())
-
-def upload_to_firebase(file_path):
-    try:
-        blob = storage.bucket().blob(file_path)
-        logging.info(f"Uploading file to Firebase: {file_path}")
-        blob.upload_from_filename(file_path)
-        public_url = blob.public_url
-        logging.info(f"Successfully uploaded file to Firebase: {file_path} -> {public_url}")
-        return public_url
-    except Exception as e:
-        logging.error(f"Error uploading file to Firebase: {file_path}, Error: {str(e)}")
-        return None
-
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'metadata': get_metadata_store().cache_stats()
+    }), 200
+
 @app.route('/api/episodes', methods=['POST'])
 def get_episodes():
     try:
@@ -179,8 +113,10 @@ def get_processed_podcasts():
         if filtered_episodes:
             filtered_podcasts[rss_url] = filtered_episodes
 
+    # Everything the UI used to read from db.json, which the metadata store no longer writes
     response_data = {
         'processed_podcasts': filtered_podcasts,
+        'auto_processed_podcasts': processed_data.get('auto_processed_podcasts', []),
         'podcast_info': processed_data.get('podcast_info', {}),
         'prompts': processed_data.get('prompts', {})
     }
@@ -209,28 +145,47 @@ def get_modified_rss(rss_url):
     try:
         logging.info(f"Received request for modified RSS feed: {rss_url}")
 
-        # Check if this RSS URL is already set for auto-processing
-        auto_processed = load_auto_processed_podcasts()
-        existing_entry = next((item for item in auto_processed if item['rss_url'] == rss_url), None)
+        store = get_metadata_store()
 
-        if not existing_entry:
+        # Check if this RSS URL is already set for auto-processing
+        if not store.get_auto_processed(rss_url):
             logging.info(f"RSS URL {rss_url} is not set for auto-processing")
             return jsonify({"error": "RSS URL is not set for auto-processing"}), 404
 
-        # Proceed to generate the modified RSS feed
-        processed_podcasts = load_processed_podcasts()
-        logging.info(f"Loaded processed podcasts for {rss_url}")
+        # The rendered feed only changes with the upstream feed or this feed's processing state.
+        # The poller's last snapshot is used as is, so the request path never waits on the origin;
+        # only a feed that was never fetched is fetched here.
+        feed = get_stored_feed(rss_url)
+        url_root = resolve_url_root(request.url_root)
+        render_key = rendered_feed_key(rss_url, feed.validator, get_state_version(rss_url), url_root)
 
-        # Generate the modified RSS feed
-        modified_rss = get_modified_rss_feed(rss_url, processed_podcasts['processed_podcasts'])
+        # Only a rendered feed that is still within its TTL answers a conditional request, so
+        # anything that changes the output without moving render_key is seen after the TTL
+        modified_rss, etag = get_rendered_feed(render_key)
+        if modified_rss:
+            logging.info(f"Serving cached modified RSS feed for {rss_url}")
+        else:
+            # Generate the modified RSS feed from the processed episodes in the metadata store.
+            # New episodes are found and queued by the feed poller, not on the request path.
+            modified_rss = get_modified_rss_feed(rss_url, process_new=False, feed=feed, url_root=url_root)
+            remember_url_root(rss_url, url_root)
+            if modified_rss:
+                etag = save_rendered_feed(render_key, modified_rss)
+
+        if modified_rss and request.if_none_match.contains(etag):
+            logging.info(f"Modified RSS feed for {rss_url} not modified")
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
 
         if modified_rss:
             logging.info(f"Successfully generated modified RSS feed for {rss_url}")
             response = make_response(modified_rss)
             response.headers['Content-Type'] = 'application/xml; charset=utf-8'
-            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
+            # Clients may keep a copy but must revalidate it, which is cheap thanks to the ETag
+            response.headers['Cache-Control'] = 'no-cache'
+            response.set_etag(etag)
             return response
         else:
             logging.error(f"Failed to create modified RSS feed for {rss_url}")
@@ -241,9 +196,7 @@ def get_modified_rss(rss_url):
         return jsonify({"error": str(e)}), 500
 
 def fetch_rss_feed(rss_url):
-    response = requests.get(rss_url)
-    response.raise_for_status()
-    return response.content
+    return get_feed(rss_url).body
 
 def process_episode(rss_url, episode_title, episode_url):
     # Implement the logic to process a new episode
@@ -252,16 +205,6 @@ def process_episode(rss_url, episode_title, episode_url):
     logging.info(f"Would process new episode: {episode_title} from {rss_url}")
     # In a real implementation, you would call your podcast processing function here
 
-def save_processed_podcasts(data):
-    try:
-        json_data = json.dumps(data, indent=2)
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        blob.upload_from_string(json_data, content_type='application/json')
-        logging.info(f"Successfully saved processed podcasts data to Firebase")
-    except Exception as e:
-        logging.error(f"Error saving processed podcasts data to Firebase: {str(e)}")
-        logging.error(traceback.format_exc())
-
 @app.route('/api/process', methods=['POST'])
 def process_podcast():
     data = request.json
@@ -290,9 +233,10 @@ def process_podcast():
 @app.route('/api/process_status/<job_id>', methods=['GET'])
 def get_process_status(job_id):
     status = get_job_status(job_id)
-    logs = get_job_logs(job_id)
+    # Pass back log_cursor as ?since= to only get the entries logged after it
+    logs, log_cursor = get_job_logs_since(job_id, request.args.get('since'))
     if status:
-        return jsonify({"status": status, "logs": logs})
+        return jsonify({"status": status, "logs": logs, "log_cursor": log_cursor})
     else:
         # If the job is not found, check if it's in the queue
         task = celery_app.AsyncResult(job_id)
@@ -302,6 +246,28 @@ def get_process_status(job_id):
             status = {'status': 'not_found', 'progress': 0, 'stage': 'UNKNOWN', 'message': 'Job not found'}
         return jsonify({"status": status, "logs": []})
 
+@app.route('/api/job_events/<job_id>', methods=['GET'])
+def job_events(job_id):
+    # Server-Sent Events: the status, then each log entry and status change as it happens
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    def generate():
+        try:
+            for event_id, event in iter_job_events(job_id, last_event_id):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logging.error(f"Error streaming events for job {job_id}: {str(e)}")
+            logging.error(traceback.format_exc())
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/search', methods=['POST'])
 def search():
     query = request.json.get('query')
@@ -357,15 +323,10 @@ def search_podcasts(query):
 
 @app.route('/api/current_jobs', methods=['GET'])
 def get_current_jobs_route():
+    # Each job already carries its job info
     jobs = get_current_jobs()
-    detailed_jobs = []
-    for job in jobs:
-        job_info = get_job_info(job['job_id'])
-        if job_info:
-            job.update(job_info)
-        detailed_jobs.append(job)
-    logging.info(f"Returning current jobs: {detailed_jobs}")
-    return jsonify(detailed_jobs), 200
+    logging.info(f"Returning current jobs: {jobs}")
+    return jsonify(jobs), 200
 
 @app.route('/api/delete_job/<job_id>', methods=['DELETE', 'OPTIONS'])
 def delete_job_route(job_id):
@@ -391,13 +352,21 @@ def batch_process_status():
         if not job_ids:
             return jsonify({"error": "No job IDs provided"}), 400
 
-        statuses = {}
-        for job_id in job_ids:
-            status = get_job_status(job_id)
-            if status:
-                statuses[job_id] = status
-
-        return jsonify(statuses), 200
+        jobs, version = get_job_statuses(job_ids)
+        # Unchanged since the caller's last poll: nothing to send. This is a POST, so
+        # a 304 would be wrong; callers that sent a version check for the flag instead.
+        if request.if_none_match.contains(version) or data.get('version') == version:
+            body = {"unchanged": True}
+        else:
+            body = {}
+            for job_id, job in jobs.items():
+                body[job_id] = dict(job['status'], info=job['info'], log_count=job['log_count'])
+
+        response = make_response(jsonify(body), 200)
+        response.set_etag(version)
+        # Cross-origin callers need to read it to send it back
+        response.headers['Access-Control-Expose-Headers'] = 'ETag'
+        return response
     except Exception as e:
         logging.error(f"Error in batch_process_status: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -412,26 +381,22 @@ def delete_processed_podcast():
         if not podcast_title or not episode_title:
             return jsonify({"error": "Missing podcast title or episode title"}), 400
 
-        # Load existing processed podcasts
-        processed_data = load_processed_podcasts()
-        processed_podcasts = processed_data.get('processed_podcasts', {})
+        store = get_metadata_store()
 
-        if not isinstance(processed_podcasts, dict):
-            logging.error(f"Expected processed_podcasts to be a dict, got {type(processed_podcasts)}")
-            return jsonify({"error": "Internal server error"}), 500
+        # Look the episode up directly when the caller knows the feed, otherwise across every feed's
+        # episodes, since not every feed with processed episodes has a podcast record
+        if data.get('rss_url'):
+            candidates = [store.get_episode(data['rss_url'], episode_title)]
+        else:
+            candidates = store.find_episodes(episode_title)
+        episode = next((ep for ep in candidates if ep and ep.get('podcast_title') == podcast_title), None)
+        if episode is None:
+            logging.error(f"Processed episode not found: {podcast_title} - {episode_title}")
+            return jsonify({"error": "Episode not found"}), 404
 
         # Mark the episode as 'deleted' and set 'show_in_ui' to False
-        for rss_url, episodes in processed_podcasts.items():
-            for ep in episodes:
-                if ep['podcast_title'] == podcast_title and ep['episode_title'] == episode_title:
-                    ep['status'] = 'deleted'
-                    ep['show_in_ui'] = False
-                    logging.info(f"Set status to 'deleted' and 'show_in_ui' to False for episode: {episode_title}")
-                    break  # Assuming episode titles are unique per RSS URL
-
-        # Save the updated data
-        processed_data['processed_podcasts'] = processed_podcasts
-        save_processed_podcasts(processed_data)
+        store.update_episode(episode['rss_url'], episode_title, {'status': 'deleted', 'show_in_ui': False})
+        logging.info(f"Set status to 'deleted' and 'show_in_ui' to False for episode: {episode_title}")
 
         # Hard delete files from Firebase Storage
         episode_folder = get_episode_folder(podcast_title, episode_title)
@@ -454,25 +419,6 @@ def delete_processed_podcast():
         logging.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
-def save_prompt(model, prompt):
-    try:
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        if blob.exists():
-            json_data = blob.download_as_text()
-            data = json.loads(json_data)
-        else:
-            data = {'processed_podcasts': []}
-
-        if 'prompts' not in data:
-            data['prompts'] = {}
-
-        data['prompts'][model] = prompt
-        json_data = json.dumps(data, indent=2)
-        blob.upload_from_string(json_data, content_type='application/json')
-        logging.info(f"Successfully saved {model} prompt to Firebase")
-    except Exception as e:
-        logging.error(f"Error saving {model} prompt to Firebase: {str(e)}")
-
 @app.route('/api/prompts', methods=['GET'])
 def get_prompts():
     logging.info("Received request for /api/prompts")
@@ -492,14 +438,12 @@ def get_prompts():
 def update_prompts():
     data = request.json
     try:
-        processed_data = load_processed_podcasts()
-        processed_data['prompts'] = processed_data.get('prompts', {})
+        versions = {}
         if 'openai' in data:
-            processed_data['prompts']['openai'] = data['openai']
+            versions['openai'] = save_prompt('openai', data['openai'])['version']
         if 'gemini' in data:
-            processed_data['prompts']['gemini'] = data['gemini']
-        save_processed_podcasts(processed_data)
-        return jsonify({"message": "Prompts updated successfully"}), 200
+            versions['gemini'] = save_prompt('gemini', data['gemini'])['version']
+        return jsonify({"message": "Prompts updated successfully", "versions": versions}), 200
     except Exception as e:
         logging.error(f"Error updating prompts: {str(e)}")
         return jsonify({"error": "Failed to update prompts"}), 500
@@ -578,14 +522,13 @@ def get_podcast_info():
         return jsonify({"error": "No RSS URL provided"}), 400
 
     try:
-        processed_data = load_processed_podcasts()
-        podcast_info = processed_data['podcast_info'].get(rss_url)
+        podcast_info = get_metadata_store().get_podcast_info(rss_url)
 
         if podcast_info:
             return jsonify(podcast_info), 200
         else:
             # If not found, fetch from RSS feed
-            feed = feedparser.parse(rss_url)
+            feed = get_feed(rss_url).parsed
             podcast_info = {
                 "name": feed.feed.title,
                 "imageUrl": feed.feed.image.href if hasattr(feed.feed, 'image') else None
@@ -606,17 +549,15 @@ def save_podcast_info():
         return jsonify({"error": "Missing required information"}), 400
 
     try:
-        # Load existing data
-        processed_data = load_processed_podcasts()
-
         # Update or add podcast info
-        processed_data['podcast_info'][rss_url] = {
-            "name": name,
-            "imageUrl": image_url
-        }
+        def apply(record):
+            record['podcast_info'] = {
+                "name": name,
+                "imageUrl": image_url
+            }
+            return record
 
-        # Save updated data
-        save_processed_podcasts(processed_data)
+        get_metadata_store().update_podcast(rss_url, apply)
 
         return jsonify({"message": "Podcast info saved successfully"}), 200
     except Exception as e:
@@ -645,17 +586,13 @@ def delete_auto_processed_podcast():
             logging.error("No RSS URL provided in the request")
             return jsonify({'error': 'RSS URL is required'}), 400
 
-        processed_data = load_processed_podcasts()
+        store = get_metadata_store()
 
         # Remove from auto-processed list
-        auto_processed = processed_data.get('auto_processed_podcasts', [])
-        auto_processed = [podcast for podcast in auto_processed if podcast['rss_url'] != rss_url]
-        processed_data['auto_processed_podcasts'] = auto_processed
+        store.remove_auto_processed(rss_url)
 
         # Remove all processed episodes for this RSS URL
-        if 'processed_podcasts' in processed_data:
-            if rss_url in processed_data['processed_podcasts']:
-                del processed_data['processed_podcasts'][rss_url]
+        store.delete_episodes(rss_url)
 
         # Clear any processing locks in Redis for this RSS URL
         db = get_db()
@@ -675,9 +612,6 @@ def delete_auto_processed_podcast():
             blob.delete()
             logging.info(f"Deleted file from Firebase Storage: {blob.name}")
 
-        # Save the updated data
-        save_processed_podcasts(processed_data)
-
         logging.info(f"Auto-processed podcast and all related data deleted successfully: {rss_url}")
         return jsonify({'message': 'Auto-processed podcast deleted successfully'}), 200
 
@@ -1,30 +1,161 @@
 import logging
-from pydub import AudioSegment
+import os
+import shutil
+import subprocess
+from mutagen.mp3 import MP3
 from utils import parse_duration  # Changed from time_utils import parse_duration
+from mp3_frames import cut_frames, Mp3FormatError
 
-def edit_audio(input_file, output_file, unwanted_content):
-    logging.info(f"Editing audio file: {input_file}")
+# 'reencode' decodes and re-encodes the kept audio; 'frame_copy' copies whole MP3 frames losslessly
+AUDIO_EDIT_MODE = os.getenv("AUDIO_EDIT_MODE", "reencode")
+
+# Merge cuts separated by less than this many seconds instead of keeping a sliver of audio
+MIN_KEEP_SECONDS = 0.25
+
+
+def get_keep_intervals(unwanted_content, duration):
+    """
+    Turn a list of unwanted segments into the sorted, non-overlapping
+    [(start, end), ...] intervals of audio to keep, clamped to [0, duration].
+    """
+    cuts = []
+    for segment in unwanted_content:
+        start = max(0.0, parse_duration(segment['start_time']))
+        end = min(duration, parse_duration(segment['end_time']))
+        if end > start:
+            cuts.append((start, end))
+        else:
+            logging.warning(f"Ignoring empty or inverted cut: {segment}")
+    cuts.sort()
+
+    merged = []
+    for start, end in cuts:
+        if merged and start - merged[-1][1] < MIN_KEEP_SECONDS:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    keep = []
+    position = 0.0
+    for start, end in merged:
+        if start - position >= MIN_KEEP_SECONDS:
+            keep.append((position, start))
+        position = end
+    if duration - position >= MIN_KEEP_SECONDS:
+        keep.append((position, duration))
+    return keep
+
+
+def build_select_filter(keep_intervals):
+    """The ffmpeg audio filter that keeps only keep_intervals and closes the gaps between them."""
+    selection = '+'.join(f"between(t,{start:.3f},{end:.3f})" for start, end in keep_intervals)
+    return f"aselect='{selection}',asetpts=N/SR/TB"
+
+
+def _edit_with_ffmpeg(input_file, output_file, keep_intervals, bitrate):
+    # aselect drops the unwanted audio frames as they stream through, so the
+    # decoded episode is never held in memory and every sample is copied once
+    command = [
+        'ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+        '-i', input_file,
+        '-map', '0:a', '-map_metadata', '0',
+        '-af', build_select_filter(keep_intervals),
+        '-c:a', 'libmp3lame'
+    ]
+    if bitrate:
+        command += ['-b:a', str(bitrate)]
+    command.append(output_file)
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()}")
+
+
+def _edit_in_memory(input_file, output_file, keep_intervals, bitrate):
+    from pydub import AudioSegment
+    audio = AudioSegment.from_mp3(input_file)
+    # Join the kept slices' raw data in one pass instead of re-concatenating per cut
+    raw_data = b''.join(audio[start * 1000:end * 1000].raw_data for start, end in keep_intervals)
+    edited_audio = audio._spawn(raw_data)
+    edited_audio.export(output_file, format="mp3", bitrate=f"{bitrate // 1000}k" if bitrate else None)
+
+
+def edit_audio(input_file, output_file, unwanted_content, mode=None):
+    mode = mode or AUDIO_EDIT_MODE
+    logging.info(f"Editing audio file: {input_file} (mode: {mode})")
     try:
         if not unwanted_content:
             logging.info("No unwanted content to remove. Copying original file.")
-            AudioSegment.from_mp3(input_file).export(output_file, format="mp3")
+            shutil.copyfile(input_file, output_file)
             return
 
-        audio = AudioSegment.from_mp3(input_file)
-        edited_audio = audio
+        info = MP3(input_file).info
+        keep_intervals = get_keep_intervals(unwanted_content, info.length)
+        if not keep_intervals:
+            raise ValueError("Unwanted content covers the whole episode, refusing to produce empty audio")
+        removed = info.length - sum(end - start for start, end in keep_intervals)
+        logging.info(f"Keeping {len(keep_intervals)} intervals, removing {removed:.2f} seconds of audio")
 
-        # Sort unwanted content by start time
-        unwanted_content.sort(key=lambda x: parse_duration(x['start_time']))
+        if mode == 'frame_copy':
+            try:
+                cut_frames(input_file, output_file, keep_intervals)
+                logging.info(f"Edited audio saved to: {output_file}")
+                return
+            except Mp3FormatError as e:
+                logging.warning(f"Frame copy not possible ({str(e)}), re-encoding instead")
 
-        # Remove unwanted segments
-        for segment in reversed(unwanted_content):
-            start_time = parse_duration(segment['start_time']) * 1000  # Convert to milliseconds
-            end_time = parse_duration(segment['end_time']) * 1000  # Convert to milliseconds
-            edited_audio = edited_audio[:start_time] + edited_audio[end_time:]
+        try:
+            _edit_with_ffmpeg(input_file, output_file, keep_intervals, info.bitrate)
+        except FileNotFoundError:
+            logging.warning("ffmpeg not found, editing audio in memory")
+            _edit_in_memory(input_file, output_file, keep_intervals, info.bitrate)
 
-        # Export the edited audio
-        edited_audio.export(output_file, format="mp3")
         logging.info(f"Edited audio saved to: {output_file}")
     except Exception as e:
         logging.error(f"Error editing audio: {str(e)}")
         raise
+
+
+if __name__ == '__main__':
+    # Benchmark: python audio_editor.py [--hours 1,3] [--cuts 5,50] [--legacy] [--mode frame_copy]
+    import argparse
+    import random
+    import tempfile
+    import time
+
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Time edit_audio on synthetic episodes")
+    parser.add_argument('--hours', default='1,3')
+    parser.add_argument('--cuts', default='5,50')
+    parser.add_argument('--legacy', action='store_true', help="Also time the old per-cut pydub slicing")
+    parser.add_argument('--mode', default=AUDIO_EDIT_MODE, choices=['reencode', 'frame_copy'])
+    args = parser.parse_args()
+
+    def legacy_edit(input_file, output_file, unwanted_content):
+        from pydub import AudioSegment
+        edited_audio = AudioSegment.from_mp3(input_file)
+        for segment in sorted(unwanted_content, key=lambda s: s['start_time'], reverse=True):
+            edited_audio = edited_audio[:segment['start_time'] * 1000] + edited_audio[segment['end_time'] * 1000:]
+        edited_audio.export(output_file, format="mp3")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for hours in [float(h) for h in args.hours.split(',')]:
+            duration = hours * 3600
+            episode = os.path.join(tmp_dir, f"episode_{hours}h.mp3")
+            subprocess.run([
+                'ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-f', 'lavfi',
+                '-i', f"sine=frequency=440:duration={duration}", '-ac', '2', '-b:a', '128k', episode
+            ], check=True)
+
+            for n_cuts in [int(c) for c in args.cuts.split(',')]:
+                random.seed(n_cuts)
+                starts = sorted(random.uniform(0, duration - 120) for _ in range(n_cuts))
+                cuts = [{'start_time': s, 'end_time': s + random.uniform(10, 90)} for s in starts]
+                output = os.path.join(tmp_dir, 'edited.mp3')
+
+                start = time.time()
+                edit_audio(episode, output, cuts, mode=args.mode)
+                print(f"{hours}h, {n_cuts} cuts: {args.mode} {time.time() - start:.1f}s")
+                if args.legacy:
+                    start = time.time()
+                    legacy_edit(episode, output, cuts)
+                    print(f"{hours}h, {n_cuts} cuts: legacy {time.time() - start:.1f}s")
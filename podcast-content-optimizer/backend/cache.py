@@ -9,3 +9,8 @@ def cache_set(key, value, expiration=3600):
 def cache_get(key):
     value = redis_client.get(key)
     return json.loads(value) if value else None
+
+def cache_get_many(keys):
+    if not keys:
+        return []
+    return [json.loads(value) if value else None for value in redis_client.mget(keys)]
@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_init, task_postrun
 import os
 import sys
 
@@ -19,13 +20,37 @@ app.config_from_object('celeryconfig')
 # Auto-discover tasks in the 'tasks.py' file
 app.autodiscover_tasks(['tasks'])
 
+@worker_process_init.connect
+def preload_whisper_model_in_child(**kwargs):
+    # prefork: each child process loads the model once, before its first task
+    import whisper_registry
+    whisper_registry.preload()
+
+@worker_init.connect
+def preload_whisper_model_in_worker(**kwargs):
+    # threads/solo pools run tasks inside the main worker process, but with more than one
+    # TRANSCRIPTION_WORKERS they transcribe in the pool's processes, which load their own copy
+    if app.conf.worker_pool != 'prefork':
+        import transcription_engine
+        import whisper_registry
+        if not transcription_engine.uses_process_pool():
+            whisper_registry.preload()
+
+@task_postrun.connect
+def recycle_whisper_model(**kwargs):
+    # prefork children are recycled by worker_max_memory_per_child instead, and
+    # transcription pool workers check their own memory after every chunk
+    if app.conf.worker_pool != 'prefork':
+        import transcription_engine
+        import whisper_registry
+        if not transcription_engine.uses_process_pool():
+            whisper_registry.recycle_if_needed()
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    sender.add_periodic_task(10.0, test_task.s(), name='add every 10')
-
-@app.task
-def test_task():
-    print("Test task running")
+    # Each tick only polls the feeds that are due; see feed_poller
+    tick_seconds = float(os.getenv("FEED_POLL_TICK_SECONDS", "60"))
+    sender.add_periodic_task(tick_seconds, sender.signature('poll_auto_processed_feeds'), name='poll auto-processed feeds')
 
 @app.task(bind=True)
 def debug_task(self):
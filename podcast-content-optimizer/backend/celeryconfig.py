@@ -21,9 +21,14 @@ worker_concurrency = 2
 
 # Add these lines to improve task execution
 worker_prefetch_multiplier = 1
-worker_max_tasks_per_child = 1
+
+# Keep worker processes (and the Whisper model they preload) alive across tasks.
+# Set WORKER_MAX_MEMORY_PER_CHILD (KiB) to recycle a prefork child once its memory grows past the limit.
+worker_max_tasks_per_child = None
+if os.getenv('WORKER_MAX_MEMORY_PER_CHILD'):
+    worker_max_memory_per_child = int(os.getenv('WORKER_MAX_MEMORY_PER_CHILD'))
 
 # Change the worker pool from 'prefork' to 'threads'
-worker_pool = 'threads'
+worker_pool = os.getenv('CELERY_WORKER_POOL', 'threads')
 # Remove or comment out the prefork-specific settings
 # worker_pool_restarts = True
@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+from utils import save_processed_podcast
+
+# 'debounce' coalesces updates that arrive within CHECKPOINT_DEBOUNCE_SECONDS of each other,
+# 'stage' writes at every stage boundary
+CHECKPOINT_MODE = os.getenv("CHECKPOINT_MODE", "debounce")
+CHECKPOINT_DEBOUNCE_SECONDS = float(os.getenv("CHECKPOINT_DEBOUNCE_SECONDS", "5"))
+# Attempts at the final write when the job finishes, since nothing flushes after it
+CHECKPOINT_CLOSE_ATTEMPTS = 3
+
+
+class CheckpointWriter:
+    """
+    Buffers stage updates for one episode's processing record and writes them
+    as a single merged save_processed_podcast call.
+
+    Call close() (or use the writer as a context manager) when the job
+    finishes, whether it succeeded or failed, so no buffered state is lost.
+    A write that fails leaves the updates buffered for the next flush.
+    """
+
+    def __init__(self, podcast_data, mode=CHECKPOINT_MODE, debounce_seconds=CHECKPOINT_DEBOUNCE_SECONDS):
+        self.podcast_data = podcast_data
+        self.mode = mode
+        self.debounce_seconds = debounce_seconds
+        self.lock = threading.RLock()
+        self.timer = None
+        self.dirty = False
+        self.pending_stages = []
+        self.writes = 0
+
+    def update(self, fields=None, stage=None, durable=False):
+        """
+        Merge fields into the episode record. The write happens immediately for
+        durable updates (or in 'stage' mode), otherwise after the debounce delay.
+        """
+        with self.lock:
+            if fields:
+                changed = {k: v for k, v in fields.items() if self.podcast_data.get(k) != v}
+                if changed:
+                    self.podcast_data.update(changed)
+                    self.dirty = True
+            if stage:
+                self.pending_stages.append(stage)
+
+            if not self.dirty:
+                return
+
+            if durable or self.mode == 'stage' or self.debounce_seconds <= 0:
+                self.flush()
+            else:
+                self._schedule()
+
+    def _schedule(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(self.debounce_seconds, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        """Write any buffered updates. Returns False if they are still unwritten."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return True
+            stages = ', '.join(self.pending_stages) or 'no stage'
+            if not save_processed_podcast(self.podcast_data):
+                logging.warning(f"Checkpoint for '{self.podcast_data.get('episode_title')}' ({stages}) not written, keeping it for the next flush")
+                return False
+            self.writes += 1
+            self.dirty = False
+            self.pending_stages = []
+            logging.info(f"Checkpoint written for '{self.podcast_data.get('episode_title')}' ({stages}), {self.writes} write(s) so far")
+            return True
+
+    def close(self, attempts=CHECKPOINT_CLOSE_ATTEMPTS):
+        """The final flush, retried a few times. Returns False if the updates were lost."""
+        for attempt in range(attempts):
+            if self.flush():
+                return True
+            if attempt + 1 < attempts:
+                time.sleep(attempt + 1)
+        logging.error(f"Giving up on the checkpoint for '{self.podcast_data.get('episode_title')}' after {attempts} attempts")
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
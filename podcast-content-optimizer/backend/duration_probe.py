@@ -0,0 +1,161 @@
+"""
+Episode duration probing with HTTP range requests.
+
+Instead of downloading an enclosure to measure it, only the first few KB are
+fetched: the ID3v2 header, followed by the first MPEG frame. A Xing/Info or
+VBRI header gives the exact frame count. Without one, the stream is taken to
+be CBR, and the duration is the audio byte count (from Content-Range or
+Content-Length) divided by the bitrate. Results are cached per enclosure URL.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import cache_get, cache_get_many, cache_set
+from mp3_frames import FrameHeader, Mp3FormatError, id3v2_size
+
+DURATION_PROBE_WORKERS = int(os.getenv("DURATION_PROBE_WORKERS", "8"))
+DURATION_PROBE_TIMEOUT = float(os.getenv("DURATION_PROBE_TIMEOUT", "10"))
+PROBE_BYTES = 16 * 1024
+# Servers that ignore Range make us read up to the audio; give up on huge tags
+MAX_TAG_BYTES = 2 * 1024 * 1024
+DURATION_CACHE_TTL = 30 * 24 * 3600
+# Retry failed probes sooner; the host may just have been down
+FAILED_PROBE_TTL = 24 * 3600
+
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_maxsize=DURATION_PROBE_WORKERS))
+_session.mount('https://', HTTPAdapter(pool_maxsize=DURATION_PROBE_WORKERS))
+
+
+def _cache_key(url):
+    return f"duration:{url}"
+
+
+def _fetch_range(url, start, length):
+    """Return (data, total_size) for length bytes at start; total_size is None if the server doesn't say."""
+    headers = {'Range': f"bytes={start}-{start + length - 1}"}
+    with _session.get(url, headers=headers, stream=True, timeout=DURATION_PROBE_TIMEOUT) as response:
+        response.raise_for_status()
+        total_size = None
+        skip = 0
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            if '/' in content_range and not content_range.endswith('/*'):
+                total_size = int(content_range.rsplit('/', 1)[1])
+        else:
+            # Range was ignored and the whole file is coming; read past what we don't need
+            if response.headers.get('Content-Length'):
+                total_size = int(response.headers['Content-Length'])
+            if start > MAX_TAG_BYTES:
+                raise ValueError(f"Server ignores range requests and the audio starts {start} bytes in")
+            skip = start
+
+        data = bytearray()
+        for block in response.iter_content(chunk_size=8192):
+            data += block
+            if len(data) >= skip + length:
+                break
+        return bytes(data[skip:skip + length]), total_size
+
+
+def _first_frame(data):
+    """Return (offset, header) of the first plausible MPEG frame in data."""
+    position = data.find(b'\xff')
+    while 0 <= position <= len(data) - 4:
+        try:
+            header = FrameHeader(data[position:position + 4])
+            next_position = position + header.length
+            # Require a second frame right behind it, unless it's past what we fetched
+            if next_position + 4 > len(data) or FrameHeader(data[next_position:next_position + 4]).sample_rate == header.sample_rate:
+                return position, header
+        except Mp3FormatError:
+            pass
+        position = data.find(b'\xff', position + 1)
+    raise Mp3FormatError("No MPEG frame found in the probed bytes")
+
+
+def duration_from_header(data, audio_size):
+    """
+    Duration in seconds from the bytes at the start of the audio (after any ID3v2 tag),
+    or None. audio_size is the number of audio bytes, used for the CBR estimate.
+    """
+    offset, header = _first_frame(data)
+    frame = data[offset:offset + header.length]
+
+    xing_offset = 4 + (2 if header.protected else 0) + header.side_info_size
+    if frame[xing_offset:xing_offset + 4] in (b'Xing', b'Info') and len(frame) >= xing_offset + 12:
+        flags = int.from_bytes(frame[xing_offset + 4:xing_offset + 8], 'big')
+        if flags & 0x0001:
+            frames = int.from_bytes(frame[xing_offset + 8:xing_offset + 12], 'big')
+            return frames * header.samples / header.sample_rate
+
+    if frame[36:40] == b'VBRI' and len(frame) >= 54:
+        frames = int.from_bytes(frame[50:54], 'big')
+        return frames * header.samples / header.sample_rate
+
+    if audio_size:
+        return (audio_size - offset) * 8 / header.bitrate
+    return None
+
+
+def probe_duration(url, content_length=None):
+    """
+    Estimate the duration of the MP3 at url from its first few KB. content_length,
+    e.g. from the feed's enclosure length, is used if the server doesn't report one.
+    """
+    data, total_size = _fetch_range(url, 0, PROBE_BYTES)
+    total_size = total_size or content_length
+    audio_start = id3v2_size(data[:10])
+    if audio_start:
+        # The tag (often with cover art) can be much larger than the first request
+        data, _ = _fetch_range(url, audio_start, PROBE_BYTES)
+    audio_size = total_size - audio_start if total_size else None
+    return duration_from_header(data, audio_size)
+
+
+def _probe_and_cache(url, content_length=None):
+    try:
+        duration = probe_duration(url, content_length)
+    except Exception as e:
+        logging.warning(f"Could not probe duration of {url}: {str(e)}")
+        duration = None
+    try:
+        cache_set(_cache_key(url), {'duration': duration}, DURATION_CACHE_TTL if duration is not None else FAILED_PROBE_TTL)
+    except Exception as e:
+        logging.error(f"Error caching duration of {url}: {str(e)}")
+    return duration
+
+
+def get_duration(url, content_length=None):
+    try:
+        cached = cache_get(_cache_key(url))
+    except Exception as e:
+        logging.error(f"Error reading cached duration of {url}: {str(e)}")
+        cached = None
+    if cached is not None:
+        return cached['duration']
+    return _probe_and_cache(url, content_length)
+
+
+def get_durations(urls, content_lengths=None):
+    """Durations for many enclosure URLs ({url: seconds or None}); uncached ones are probed concurrently."""
+    content_lengths = content_lengths or {}
+    urls = list(dict.fromkeys(urls))
+    try:
+        cached = cache_get_many([_cache_key(url) for url in urls])
+    except Exception as e:
+        logging.error(f"Error reading cached durations: {str(e)}")
+        cached = [None] * len(urls)
+
+    durations = {url: entry['duration'] for url, entry in zip(urls, cached) if entry is not None}
+    missing = [url for url in urls if url not in durations]
+    if missing:
+        logging.info(f"Probing durations of {len(missing)} episodes ({len(durations)} cached)")
+        with ThreadPoolExecutor(max_workers=min(DURATION_PROBE_WORKERS, len(missing)), thread_name_prefix='duration-probe') as executor:
+            for url, duration in zip(missing, executor.map(lambda u: _probe_and_cache(u, content_lengths.get(u)), missing)):
+                durations[url] = duration
+    return durations
@@ -0,0 +1,118 @@
+"""
+Index of a feed's processed episodes, for matching them to feed items.
+
+Each processed episode record is indexed by its GUID, its enclosure URL and
+its normalized title, so every item of the upstream feed is matched with a few
+dict lookups instead of a scan over the records. GUIDs and enclosure URLs are
+tried before titles, which keeps a record attached to its item when the
+publisher edits the episode title.
+
+Indexes are built from the metadata store once per processing state version
+(see feed_state) and reused until the version moves.
+"""
+import logging
+import re
+import threading
+import unicodedata
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from feed_state import get_state_version
+from metadata_store import get_metadata_store
+
+_indexes = {}
+
+# Query parameters that track the listener rather than identify the file
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'awcollectionid', 'awepisodeid'}
+_indexes_lock = threading.Lock()
+
+
+def normalize_title(title):
+    """Case, accents, punctuation and spacing don't change which episode a title refers to."""
+    if not title:
+        return None
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(c for c in title if not unicodedata.combining(c)).casefold()
+    return re.sub(r'[\W_]+', ' ', title).strip() or None
+
+
+def _is_tracking_param(name):
+    name = name.lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+
+def normalize_enclosure_url(url):
+    """
+    Host, path and the query without tracking parameters. Hosts switch schemes
+    and add tracking parameters between fetches, but the rest of the query can
+    name the file (e.g. download.aspx?id=N).
+    """
+    if not url or not url.strip():
+        return None
+    parts = urlsplit(url.strip())
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking_param(name))
+    normalized = f"{parts.netloc.lower()}{parts.path}"
+    if query:
+        normalized += f"?{urlencode(query)}"
+    return normalized or None
+
+
+class ProcessedEpisodeIndex:
+    def __init__(self, episodes):
+        self.by_guid = {}
+        self.by_enclosure_url = {}
+        self.by_title = {}
+        # The first record wins on a collision, as with a scan in list order
+        for episode in episodes:
+            guid = (episode.get('episode_guid') or '').strip()
+            if guid:
+                self.by_guid.setdefault(guid, episode)
+            enclosure_url = normalize_enclosure_url(episode.get('enclosure_url'))
+            if enclosure_url:
+                self.by_enclosure_url.setdefault(enclosure_url, episode)
+            title = normalize_title(episode.get('episode_title'))
+            if title:
+                self.by_title.setdefault(title, episode)
+        self.size = len(episodes)
+        # Records whose items may be hidden while a job runs; the others never need a lock check
+        self.unfinished_titles = [
+            episode['episode_title'] for episode in episodes
+            if episode.get('episode_title') and episode.get('status') not in ['completed', 'deleted']
+        ]
+
+    def find(self, guid=None, title=None, enclosure_url=None):
+        """The processed episode record for a feed item, or None."""
+        if guid and guid in self.by_guid:
+            return self.by_guid[guid]
+        enclosure_url = normalize_enclosure_url(enclosure_url)
+        if enclosure_url and enclosure_url in self.by_enclosure_url:
+            return self.by_enclosure_url[enclosure_url]
+        title = normalize_title(title)
+        if title:
+            return self.by_title.get(title)
+        return None
+
+
+def get_episode_index(rss_url):
+    """The index of rss_url's processed episodes, rebuilt only when its state version has moved."""
+    try:
+        version = get_state_version(rss_url)
+    except Exception as e:
+        logging.error(f"Error reading feed state version for {rss_url}: {str(e)}")
+        version = None
+
+    if version is not None:
+        with _indexes_lock:
+            cached = _indexes.get(rss_url)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    # Read the version first: a change during the load moves it again, so the index is rebuilt on the
+    # next call. The listing is revalidated against the backend, since the version may have been
+    # bumped by another process whose write this process' metadata cache hasn't seen yet.
+    episodes = get_metadata_store().list_episodes(rss_url, revalidate=True)
+    index = ProcessedEpisodeIndex(episodes)
+    logging.info(f"Indexed {index.size} processed episodes for {rss_url} (state version {version})")
+    if version is not None:
+        with _indexes_lock:
+            _indexes[rss_url] = (version, index)
+    return index
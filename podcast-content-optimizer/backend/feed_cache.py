@@ -0,0 +1,214 @@
+"""
+Shared RSS fetch cache.
+
+Every feed is fetched through get_feed(). The raw body is kept in Redis with
+the origin's ETag and Last-Modified. Within FEED_CACHE_TTL seconds of the last
+fetch it is served without contacting the origin at all. After that, a
+conditional request is sent, and a 304 response just refreshes the entry. If
+the origin fails, the stored body keeps being served and the origin is tried
+again after FEED_ERROR_RETRY_SECONDS.
+
+Each process also keeps the latest FeedSnapshot per URL and only replaces it
+when the body changes. Episode listings, the modified feed and podcast info
+therefore all share one parsed copy instead of each parsing the feed again.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import feedparser
+import requests
+
+from cache import redis_client
+
+# Serve a fetched feed without revalidating it for this many seconds
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "60"))
+# Keep bodies in Redis this long so conditional requests have something to validate
+FEED_CACHE_RETENTION = int(os.getenv("FEED_CACHE_RETENTION", str(7 * 24 * 3600)))
+FEED_FETCH_TIMEOUT = float(os.getenv("FEED_FETCH_TIMEOUT", "30"))
+# After a failed fetch, serve the stored copy for this many seconds before trying the origin again
+FEED_ERROR_RETRY_SECONDS = float(os.getenv("FEED_ERROR_RETRY_SECONDS", "30"))
+FALLBACK_ENCODINGS = ['utf-8', 'ascii', 'iso-8859-1']
+
+_snapshots = {}
+_fetch_locks = {}
+_locks_lock = threading.Lock()
+_session = requests.Session()
+
+
+class FeedSnapshot:
+    """One version of a feed. The body never changes, so the parsed feed is computed once and shared."""
+
+    def __init__(self, url, body, etag=None, last_modified=None, encoding=None, fetched_at=None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.encoding = encoding
+        self.fetched_at = fetched_at or time.time()
+        # Identifies this version of the feed, e.g. to key caches of anything derived from it
+        self.validator = hashlib.sha256(body).hexdigest()
+        self._parsed = None
+        self._parse_lock = threading.Lock()
+
+    @property
+    def text(self):
+        return self.body.decode(self.encoding or 'utf-8', errors='replace')
+
+    @property
+    def parsed(self):
+        """The feedparser result. Treat it as read-only, since every caller shares it."""
+        if self._parsed is None:
+            with self._parse_lock:
+                if self._parsed is None:
+                    self._parsed = self._parse()
+        return self._parsed
+
+    def _parse(self):
+        feed = feedparser.parse(self.body)
+        # If there's an encoding error, try parsing with explicit encodings
+        if feed.bozo and isinstance(feed.bozo_exception, feedparser.CharacterEncodingOverride):
+            logging.warning(f"Encoding mismatch detected. Attempting to parse with different encodings: {self.url}")
+            for encoding in FALLBACK_ENCODINGS:
+                try:
+                    candidate = feedparser.parse(self.body.decode(encoding))
+                    if not candidate.bozo:
+                        logging.info(f"Successfully parsed feed with {encoding} encoding")
+                        return candidate
+                except Exception as e:
+                    logging.warning(f"Failed to parse with {encoding} encoding: {str(e)}")
+        return feed
+
+
+def _redis_key(url):
+    return f"feed:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+def _fetch_lock(url):
+    with _locks_lock:
+        return _fetch_locks.setdefault(url, threading.Lock())
+
+
+def _load_stored(url):
+    try:
+        stored = redis_client.hgetall(_redis_key(url))
+    except Exception as e:
+        logging.error(f"Error reading feed cache for {url}: {str(e)}")
+        return None
+    if not stored or b'body' not in stored:
+        return None
+    decode = lambda field: stored[field].decode('utf-8') if stored.get(field) else None
+    return {
+        'body': stored[b'body'],
+        'etag': decode(b'etag'),
+        'last_modified': decode(b'last_modified'),
+        'encoding': decode(b'encoding'),
+        'fetched_at': float(stored.get(b'fetched_at', 0))
+    }
+
+
+def _store(url, snapshot):
+    try:
+        key = _redis_key(url)
+        pipe = redis_client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            'body': snapshot.body,
+            'etag': snapshot.etag or '',
+            'last_modified': snapshot.last_modified or '',
+            'encoding': snapshot.encoding or '',
+            'fetched_at': snapshot.fetched_at
+        })
+        pipe.expire(key, FEED_CACHE_RETENTION)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"Error writing feed cache for {url}: {str(e)}")
+
+
+def _touch(url, fetched_at):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(_redis_key(url), 'fetched_at', fetched_at)
+        pipe.expire(_redis_key(url), FEED_CACHE_RETENTION)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"Error refreshing feed cache for {url}: {str(e)}")
+
+
+def _snapshot_for(url, stored):
+    """Reuse the process' snapshot when the body is unchanged, so its parsed feed is reused too."""
+    current = _snapshots.get(url)
+    if current is not None and current.body == stored['body']:
+        current.fetched_at = max(current.fetched_at, stored['fetched_at'])
+        return current
+    snapshot = FeedSnapshot(url, stored['body'], stored['etag'], stored['last_modified'], stored['encoding'], stored['fetched_at'])
+    _snapshots[url] = snapshot
+    return snapshot
+
+
+def get_feed(url, max_age=FEED_CACHE_TTL):
+    """Return the FeedSnapshot for url, fetching or revalidating it if it is older than max_age seconds."""
+    current = _snapshots.get(url)
+    if current is not None and time.time() - current.fetched_at < max_age:
+        return current
+
+    # One fetch per feed at a time in this process; concurrent callers wait and share its result
+    with _fetch_lock(url):
+        stored = _load_stored(url)
+        if stored is not None and time.time() - stored['fetched_at'] < max_age:
+            return _snapshot_for(url, stored)
+
+        headers = {}
+        if stored is not None:
+            if stored['etag']:
+                headers['If-None-Match'] = stored['etag']
+            if stored['last_modified']:
+                headers['If-Modified-Since'] = stored['last_modified']
+
+        start_time = time.time()
+        try:
+            response = _session.get(url, headers=headers, timeout=FEED_FETCH_TIMEOUT)
+            if response.status_code == 304 and stored is not None:
+                logging.info(f"Feed not modified, serving cached copy: {url}")
+                stored['fetched_at'] = time.time()
+                _touch(url, stored['fetched_at'])
+                return _snapshot_for(url, stored)
+            response.raise_for_status()
+        except Exception as e:
+            if stored is None:
+                raise
+            # A stale feed is better than none while the origin is having trouble. Date the copy
+            # so it is revalidated in FEED_ERROR_RETRY_SECONDS, not on every request until then.
+            logging.warning(f"Error fetching feed {url}, serving cached copy: {str(e)}")
+            stored['fetched_at'] = time.time() - FEED_CACHE_TTL + FEED_ERROR_RETRY_SECONDS
+            _touch(url, stored['fetched_at'])
+            return _snapshot_for(url, stored)
+
+        logging.info(f"Fetched feed {url} ({len(response.content)} bytes) in {time.time() - start_time:.2f} seconds")
+        stored = {
+            'body': response.content,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'encoding': response.encoding,
+            'fetched_at': time.time()
+        }
+        snapshot = _snapshot_for(url, stored)
+        _store(url, snapshot)
+        return snapshot
+
+
+def get_stored_feed(url):
+    """
+    Return the last fetched FeedSnapshot for url, however old, without contacting
+    the origin. Only a feed that was never fetched is fetched here. For request
+    paths that must not wait on the origin; the feed poller keeps the copy fresh.
+    """
+    return get_feed(url, max_age=float('inf'))
+
+
+def invalidate_feed(url):
+    """Make the next get_feed(url) revalidate with the origin."""
+    _snapshots.pop(url, None)
+    _touch(url, 0)
@@ -0,0 +1,123 @@
+"""
+Background polling of auto-processed feeds.
+
+Celery beat runs poll_auto_processed_feeds every FEED_POLL_TICK_SECONDS. It
+hands every feed whose next poll is due to a poll_feed task, and reschedules
+it FEED_POLL_INTERVAL seconds later, give or take FEED_POLL_JITTER so feeds
+don't all hit their origins together. An auto-processed entry can set its own
+'poll_interval'. Polling a feed revalidates it with the origin, queues its new
+episodes for processing and renders the modified feed into the rendered-feed
+cache, so /api/modified_rss only has to read.
+"""
+import hashlib
+import logging
+import os
+import random
+import time
+import traceback
+
+from cache import redis_client
+from feed_cache import get_feed
+from feed_state import get_state_version
+from metadata_store import get_metadata_store
+from rendered_feed_cache import rendered_feed_key, save_rendered_feed
+from rss_modifier import create_modified_rss_feed
+
+FEED_POLL_TICK_SECONDS = float(os.getenv("FEED_POLL_TICK_SECONDS", "60"))
+FEED_POLL_INTERVAL = float(os.getenv("FEED_POLL_INTERVAL", "900"))
+# Fraction of the interval each poll is moved by, at random
+FEED_POLL_JITTER = float(os.getenv("FEED_POLL_JITTER", "0.1"))
+# URL root the modified feed links back to; defaults to the one it was last requested through
+PUBLIC_URL_ROOT = os.getenv("PUBLIC_URL_ROOT")
+
+DUE_KEY = 'feed_poll:due'
+
+
+def _feed_id(rss_url):
+    return hashlib.sha1(rss_url.encode('utf-8')).hexdigest()
+
+
+def _url_root_key(rss_url):
+    return f"feed_poll:url_root:{_feed_id(rss_url)}"
+
+
+def resolve_url_root(request_url_root=None):
+    """
+    The URL root a modified feed links back to: PUBLIC_URL_ROOT if set, otherwise
+    the one it was requested through, without a trailing slash. The route and
+    the poller both use it, so the poller warms the entry the route reads.
+    """
+    url_root = PUBLIC_URL_ROOT or request_url_root
+    return url_root.rstrip('/') if url_root else None
+
+
+def remember_url_root(rss_url, url_root):
+    """Record the URL root a modified feed was requested through, so the poller can warm it."""
+    try:
+        redis_client.set(_url_root_key(rss_url), url_root)
+    except Exception as e:
+        logging.error(f"Error saving URL root for {rss_url}: {str(e)}")
+
+
+def get_url_root(rss_url):
+    if PUBLIC_URL_ROOT:
+        return resolve_url_root()
+    url_root = redis_client.get(_url_root_key(rss_url))
+    return resolve_url_root(url_root.decode('utf-8')) if url_root else None
+
+
+def next_poll_delay(entry):
+    interval = float(entry.get('poll_interval') or FEED_POLL_INTERVAL)
+    return interval * (1 + random.uniform(-FEED_POLL_JITTER, FEED_POLL_JITTER))
+
+
+def due_feeds(now=None):
+    """Claim the auto-processed feeds that are due for a poll and schedule their next one."""
+    now = now or time.time()
+    entries = {entry['rss_url']: entry for entry in get_metadata_store().list_auto_processed()}
+
+    pipe = redis_client.pipeline(transaction=False)
+    for rss_url in entries:
+        pipe.zscore(DUE_KEY, rss_url)
+    due_times = pipe.execute()
+
+    due = []
+    for rss_url, due_at in zip(entries, due_times):
+        # New feeds are polled straight away
+        if due_at is not None and due_at > now:
+            continue
+        # Overlapping ticks (e.g. two beat schedulers) must not both claim the feed
+        if not redis_client.set(f"feed_poll:claim:{_feed_id(rss_url)}", 1, nx=True, ex=max(1, int(FEED_POLL_TICK_SECONDS))):
+            continue
+        redis_client.zadd(DUE_KEY, {rss_url: now + next_poll_delay(entries[rss_url])})
+        due.append(rss_url)
+
+    # Forget feeds that are no longer auto-processed
+    stale = [member.decode('utf-8') for member in redis_client.zrange(DUE_KEY, 0, -1) if member.decode('utf-8') not in entries]
+    if stale:
+        redis_client.zrem(DUE_KEY, *stale)
+    return due
+
+
+def poll_feed(rss_url):
+    """Revalidate rss_url, queue its new episodes and warm its rendered modified feed."""
+    try:
+        if not get_metadata_store().get_auto_processed(rss_url):
+            logging.info(f"RSS URL {rss_url} is no longer auto-processed, skipping poll")
+            return False
+
+        start_time = time.time()
+        # Always ask the origin; it's a conditional request, so an unchanged feed is cheap
+        feed = get_feed(rss_url, max_age=0)
+        state_version = get_state_version(rss_url)
+        url_root = get_url_root(rss_url)
+
+        modified_rss = create_modified_rss_feed(rss_url, url_root=url_root or '', process_new=True, feed=feed)
+        if modified_rss and url_root:
+            save_rendered_feed(rendered_feed_key(rss_url, feed.validator, state_version, url_root), modified_rss)
+        logging.info(f"Polled {rss_url} in {time.time() - start_time:.2f} seconds")
+        return bool(modified_rss)
+    except Exception as e:
+        logging.error(f"Error polling {rss_url}: {str(e)}")
+        logging.error(traceback.format_exc())
+        return False
@@ -0,0 +1,30 @@
+"""
+Per-feed processing state version.
+
+A counter in Redis that is bumped whenever something a modified feed is built
+from changes: one of its episode records, its podcast record (auto-processing
+settings), or a processing lock on one of its episodes. Anything rendered from
+that state can be cached under the version and is stale once it moves.
+"""
+import hashlib
+import logging
+
+from cache import redis_client
+
+
+def state_version_key(rss_url):
+    return f"feed_state:{hashlib.sha1(rss_url.encode('utf-8')).hexdigest()}"
+
+
+def get_state_version(rss_url):
+    value = redis_client.get(state_version_key(rss_url))
+    return int(value) if value else 0
+
+
+def bump_state_version(rss_url):
+    try:
+        return redis_client.incr(state_version_key(rss_url))
+    except Exception as e:
+        # Readers fall back to the cache TTL, so don't fail the write that triggered this
+        logging.error(f"Error bumping feed state version for {rss_url}: {str(e)}")
+        return None
@@ -1,10 +1,39 @@
 import redis
+import hashlib
 import json
+import os
+import re
 import time
 import logging
 
 redis_client = redis.Redis(host='localhost', port=6379, db=0)
 
+# How often an idle event stream sends a keep-alive, in seconds
+JOB_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("JOB_EVENTS_HEARTBEAT_SECONDS", "15"))
+# Streams are closed after this long; EventSource reconnects with its Last-Event-ID
+JOB_EVENTS_MAX_SECONDS = float(os.getenv("JOB_EVENTS_MAX_SECONDS", "300"))
+TERMINAL_STATUSES = ['completed', 'failed']
+ACTIVE_STATUSES = ['queued', 'in_progress']
+
+# Sorted set of the jobs that are queued or in progress, scored by when they started
+ACTIVE_JOBS_KEY = 'active_jobs'
+ACTIVE_JOBS_INDEXED_KEY = 'active_jobs:indexed'
+
+# Each job's log is a stream capped at about this many entries
+JOB_LOG_MAX_ENTRIES = int(os.getenv("JOB_LOG_MAX_ENTRIES", "1000"))
+# How long a finished job's status, info and log are kept, in seconds
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+def job_events_channel(job_id):
+    return f"job_events:{job_id}"
+
+def publish_job_event(job_id, event):
+    try:
+        redis_client.publish(job_events_channel(job_id), json.dumps(event))
+    except Exception as e:
+        # Subscribers catch up from the stored status and logs, so don't fail the update
+        logging.error(f"Error publishing event for job {job_id}: {str(e)}")
+
 def update_job_status(job_id, status, current_stage, progress, message):
     job_status = {
         'status': status,
@@ -13,20 +42,149 @@ def update_job_status(job_id, status, current_stage, progress, message):
         'message': message,
         'timestamp': time.time()
     }
-    redis_client.set(f"job_status:{job_id}", json.dumps(job_status))
+    pipe = redis_client.pipeline()
+    pipe.set(f"job_status:{job_id}", json.dumps(job_status))
+    # Keep the active-job index in step with the status
+    if status in ACTIVE_STATUSES:
+        pipe.zadd(ACTIVE_JOBS_KEY, {job_id: job_status['timestamp']}, nx=True)
+    else:
+        pipe.zrem(ACTIVE_JOBS_KEY, job_id)
+    pipe.execute()
+    publish_job_event(job_id, {'type': 'status', 'status': job_status})
 
 def get_job_status(job_id):
     status = redis_client.get(f"job_status:{job_id}")
     return json.loads(status) if status else None
 
+def get_job_statuses(job_ids):
+    """
+    Status, info and log length of many jobs in one pipelined round trip, as
+    ({job_id: {'status', 'info', 'log_count'}}, version). Jobs without a status
+    are left out. version changes whenever any of it does, so a caller that
+    already has it can skip sending the batch again.
+    """
+    job_ids = list(dict.fromkeys(job_ids))
+    pipe = redis_client.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.get(f"job_status:{job_id}")
+        pipe.hgetall(f"job_info:{job_id}")
+        pipe.xlen(f"job_log:{job_id}")
+        # A capped log stops growing, but its last ID still moves
+        pipe.xrevrange(f"job_log:{job_id}", count=1)
+    replies = pipe.execute(raise_on_error=False)
+
+    jobs = {}
+    digest = hashlib.sha1()
+    for i, job_id in enumerate(job_ids):
+        status, info, log_count, last_entry = replies[4 * i:4 * i + 4]
+        if isinstance(log_count, redis.ResponseError):
+            # Lists from before logs moved to streams
+            log_count = redis_client.llen(f"job_log:{job_id}")
+            last_entry = []
+        if isinstance(status, Exception) or isinstance(info, Exception):
+            raise status if isinstance(status, Exception) else info
+        if not status:
+            continue
+        jobs[job_id] = {
+            'status': json.loads(status),
+            'info': {k.decode('utf-8'): v.decode('utf-8') for k, v in info.items()},
+            'log_count': log_count
+        }
+        digest.update(job_id.encode('utf-8') + b'\0' + status + b'\0')
+        digest.update(json.dumps(jobs[job_id]['info'], sort_keys=True).encode('utf-8') + b'\0' + str(log_count).encode('utf-8') + b'\0')
+        digest.update((last_entry[0][0] if last_entry else b'') + b'\0')
+    return jobs, digest.hexdigest()
+
+def _stream_id(value):
+    return tuple(int(part) for part in value.split('-'))
+
+def _next_stream_id(stream_id):
+    # XRANGE's start is inclusive; the smallest ID after stream_id
+    ms, seq = _stream_id(stream_id)
+    return f"{ms}-{seq + 1}"
+
+def is_log_cursor(value):
+    return bool(value) and bool(re.fullmatch(r'\d+-\d+', str(value)))
+
 def append_job_log(job_id, log_entry):
     key = f"job_log:{job_id}"
-    redis_client.rpush(key, json.dumps(log_entry))
+    try:
+        # Capped: only the newest JOB_LOG_MAX_ENTRIES (or a few more) are kept
+        entry_id = redis_client.xadd(key, {'entry': json.dumps(log_entry)}, maxlen=JOB_LOG_MAX_ENTRIES, approximate=True).decode('utf-8')
+    except redis.ResponseError:
+        # A job that started before logs moved to streams keeps its list
+        redis_client.rpush(key, json.dumps(log_entry))
+        entry_id = f"0-{redis_client.llen(key)}"
+    # The entry's stream ID doubles as its event ID and log cursor
+    publish_job_event(job_id, {'type': 'log', 'id': entry_id, 'entry': log_entry})
 
-def get_job_logs(job_id):
+def _job_log_entries(job_id, cursor, count=None):
+    """[(entry_id, entry)] for the job's log entries after cursor, oldest first."""
     key = f"job_log:{job_id}"
-    logs = redis_client.lrange(key, 0, -1)
-    return [json.loads(log) for log in logs]
+    try:
+        entries = redis_client.xrange(key, min=_next_stream_id(cursor), max='+', count=count)
+    except redis.ResponseError:
+        # Lists from before logs moved to streams: entry i has the ID 0-(i+1)
+        start = _stream_id(cursor)[1]
+        end = -1 if count is None else start + count - 1
+        logs = redis_client.lrange(key, start, end)
+        return [(f"0-{start + i + 1}", json.loads(log)) for i, log in enumerate(logs)]
+    return [(entry_id.decode('utf-8'), json.loads(fields[b'entry'])) for entry_id, fields in entries]
+
+def get_job_logs_since(job_id, cursor=None, count=None):
+    """
+    The job's log entries after cursor (all of them if it's None), oldest first, and
+    the cursor to pass next time, as (entries, cursor).
+    """
+    cursor = cursor if is_log_cursor(cursor) else '0-0'
+    entries = _job_log_entries(job_id, cursor, count)
+    if not entries:
+        return [], cursor
+    return [entry for _, entry in entries], entries[-1][0]
+
+def get_job_logs(job_id):
+    return get_job_logs_since(job_id)[0]
+
+def iter_job_events(job_id, last_event_id=None, heartbeat=JOB_EVENTS_HEARTBEAT_SECONDS, max_seconds=JOB_EVENTS_MAX_SECONDS):
+    """
+    Yield a job's events as (event_id, event) until it completes or fails, or for
+    at most max_seconds; event is None for a keep-alive. An event's ID is the log
+    cursor of the last entry sent, so a client resuming with its Last-Event-ID
+    only gets the entries it missed. Every stream starts with the current status.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before reading the snapshot, so nothing falls between the two
+        pubsub.subscribe(job_events_channel(job_id))
+        cursor = last_event_id if is_log_cursor(last_event_id) else '0-0'
+
+        status = get_job_status(job_id)
+        yield cursor, {'type': 'status', 'status': status}
+        for cursor, log_entry in _job_log_entries(job_id, cursor):
+            yield cursor, {'type': 'log', 'entry': log_entry}
+        if status is not None and status['status'] in TERMINAL_STATUSES:
+            return
+
+        deadline = time.time() + max_seconds
+        while time.time() < deadline:
+            message = pubsub.get_message(timeout=min(heartbeat, max(0, deadline - time.time())))
+            if message is None:
+                yield cursor, None
+                continue
+            event = json.loads(message['data'])
+            if event['type'] == 'log':
+                if _stream_id(event['id']) <= _stream_id(cursor):
+                    # Already sent with the snapshot
+                    continue
+                # Read from the stored log rather than the message, which fills any gap left by a dropped one
+                for cursor, log_entry in _job_log_entries(job_id, cursor):
+                    yield cursor, {'type': 'log', 'entry': log_entry}
+            else:
+                yield cursor, event
+                if event['status']['status'] in TERMINAL_STATUSES:
+                    return
+    finally:
+        pubsub.close()
 
 def update_job_info(job_id, job_info):
     key = f"job_info:{job_id}"
@@ -42,36 +200,74 @@ def get_job_info(job_id):
         return {k.decode('utf-8'): v.decode('utf-8') for k, v in info.items()}
     return None
 
-def get_current_jobs():
-    jobs = []
+def index_active_jobs():
+    """Add jobs that went active before the index existed; scans the keyspace once per Redis database."""
+    if not redis_client.set(ACTIVE_JOBS_INDEXED_KEY, int(time.time()), nx=True):
+        return
     for key in redis_client.scan_iter("job_status:*"):
         job_id = key.decode('utf-8').split(':')[1]
         status = get_job_status(job_id)
-        job_info = get_job_info(job_id)
-        if status and status['status'] in ['queued', 'in_progress']:
-            job = {'job_id': job_id, 'status': status}
-            if job_info:
-                job.update(job_info)
-            jobs.append(job)
+        if status and status['status'] in ACTIVE_STATUSES:
+            redis_client.zadd(ACTIVE_JOBS_KEY, {job_id: status.get('timestamp', 0)}, nx=True)
+    logging.info(f"Indexed active jobs: {redis_client.zcard(ACTIVE_JOBS_KEY)}")
+
+def get_current_jobs():
+    index_active_jobs()
+    job_ids = [job_id.decode('utf-8') for job_id in redis_client.zrange(ACTIVE_JOBS_KEY, 0, -1)]
+    if not job_ids:
+        return []
+
+    # Status and info for every active job in one round trip
+    pipe = redis_client.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.get(f"job_status:{job_id}")
+        pipe.hgetall(f"job_info:{job_id}")
+    replies = pipe.execute()
+
+    jobs = []
+    finished = []
+    for i, job_id in enumerate(job_ids):
+        status, info = replies[2 * i], replies[2 * i + 1]
+        status = json.loads(status) if status else None
+        if not status or status['status'] not in ACTIVE_STATUSES:
+            # Deleted or finished without the index hearing about it
+            finished.append(job_id)
+            continue
+        job = {'job_id': job_id, 'status': status}
+        job.update({k.decode('utf-8'): v.decode('utf-8') for k, v in info.items()})
+        jobs.append(job)
+
+    if finished:
+        redis_client.zrem(ACTIVE_JOBS_KEY, *finished)
     logging.info(f"Current jobs: {jobs}")
     return jobs
 
+def expire_job_data(job_id, seconds=JOB_RETENTION_SECONDS):
+    pipe = redis_client.pipeline()
+    pipe.expire(f"job_status:{job_id}", seconds)
+    pipe.expire(f"job_log:{job_id}", seconds)
+    pipe.expire(f"job_info:{job_id}", seconds)
+    pipe.execute()
+
 def mark_job_completed(job_id):
     update_job_status(job_id, 'completed', 'COMPLETION', 100, 'Podcast processing completed')
     # We're not deleting the job data immediately after completion
-    # This allows the frontend to fetch the final status
+    # This allows the frontend to fetch the final status, until it expires
+    expire_job_data(job_id)
     logging.info(f"Marked job {job_id} as completed")
 
 def mark_job_failed(job_id, error_message):
     update_job_status(job_id, 'failed', 'ERROR', 0, f'Error: {error_message}')
     # We're not deleting the job data immediately after failure
-    # This allows the frontend to fetch the error status
+    # This allows the frontend to fetch the error status, until it expires
+    expire_job_data(job_id)
     logging.info(f"Marked job {job_id} as failed")
 
 def delete_job_data(job_id):
     redis_client.delete(f"job_status:{job_id}")
     redis_client.delete(f"job_log:{job_id}")
     redis_client.delete(f"job_info:{job_id}")
+    redis_client.zrem(ACTIVE_JOBS_KEY, job_id)
     logging.info(f"Deleted all Redis keys for job {job_id}")
 
 def delete_job(job_id):
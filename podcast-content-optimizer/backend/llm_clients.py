@@ -0,0 +1,145 @@
+"""
+Long-lived LLM provider clients and a rate limiter shared by every worker.
+
+Each process builds one OpenAI client and configures Gemini once, instead of
+once per request. Before every request, acquire() takes one request and the
+estimated tokens from two Redis token buckets per provider (requests per
+minute and tokens per minute), so all Celery workers together stay under the
+provider limits. A throttled call sleeps until the buckets refill instead of
+failing with a 429.
+"""
+import logging
+import os
+import threading
+import time
+
+from cache import redis_client
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+# Per-minute limits shared by all workers; 0 disables that bucket
+RATE_LIMITS = {
+    'openai': {
+        'rpm': int(os.getenv("OPENAI_RPM", "500")),
+        'tpm': int(os.getenv("OPENAI_TPM", "200000"))
+    },
+    'gemini': {
+        'rpm': int(os.getenv("GEMINI_RPM", "360")),
+        'tpm': int(os.getenv("GEMINI_TPM", "4000000"))
+    }
+}
+# Tokens reserved for the response on top of the prompt estimate
+LLM_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKEN_ESTIMATE", "1000"))
+# Never sleep longer than this between attempts, so waiters notice refills promptly
+MAX_WAIT_STEP_SECONDS = 5.0
+
+# Refills and takes from a requests bucket and a tokens bucket atomically.
+# Returns 0 when both had enough, otherwise the milliseconds to wait before
+# trying again; nothing is taken unless both buckets can pay.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local wait = 0
+local state = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[(i - 1) * 2 + 1])
+    local cost = tonumber(ARGV[(i - 1) * 2 + 2])
+    if capacity > 0 then
+        local bucket = redis.call('HMGET', KEYS[i], 'level', 'updated')
+        local level = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        local rate = capacity / 60000
+        level = math.min(capacity, level + math.max(0, now - updated) * rate)
+        cost = math.min(cost, capacity)
+        if level < cost then
+            wait = math.max(wait, math.ceil((cost - level) / rate))
+        end
+        state[i] = {capacity, level, cost}
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, 2 do
+    if state[i] then
+        redis.call('HSET', KEYS[i], 'level', state[i][2] - state[i][3], 'updated', now)
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+return 0
+"""
+
+_token_bucket = None
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def _get_client(name, factory):
+    global _clients_pid
+    with _clients_lock:
+        # Connections must not be shared with a forked parent (Celery prefork)
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(name)
+        if client is None:
+            client = factory()
+            _clients[name] = client
+            logging.info(f"Created LLM client '{name}' in process {os.getpid()}")
+        return client
+
+
+def get_openai_client():
+    from openai import OpenAI
+    return _get_client('openai', lambda: OpenAI(api_key=OPENAI_API_KEY))
+
+
+def get_gemini_model(model_name):
+    import google.generativeai as genai
+
+    def create_model():
+        # configure() sets module-wide state; it only runs when a model is first created
+        genai.configure(api_key=GOOGLE_API_KEY)
+        return genai.GenerativeModel(model_name)
+
+    return _get_client(f"gemini:{model_name}", create_model)
+
+
+def estimate_prompt_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4
+
+
+def estimate_tokens(text):
+    return estimate_prompt_tokens(text) + LLM_OUTPUT_TOKEN_ESTIMATE
+
+
+def acquire(provider, tokens):
+    """Block until provider's shared buckets allow one more request of about this many tokens."""
+    global _token_bucket
+    limits = RATE_LIMITS.get(provider)
+    if not limits or (limits['rpm'] <= 0 and limits['tpm'] <= 0):
+        return
+
+    start_time = time.time()
+    while True:
+        try:
+            if _token_bucket is None:
+                _token_bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+            wait_ms = _token_bucket(
+                keys=[f"llm_rate:{provider}:requests", f"llm_rate:{provider}:tokens"],
+                args=[limits['rpm'], 1, limits['tpm'], tokens]
+            )
+        except Exception as e:
+            # Don't stop detection because the limiter is unreachable
+            logging.error(f"Error checking LLM rate limit for {provider}: {str(e)}")
+            return
+        if not wait_ms:
+            break
+        time.sleep(min(wait_ms / 1000, MAX_WAIT_STEP_SECONDS))
+
+    waited = time.time() - start_time
+    if waited >= 1:
+        logging.info(f"Waited {waited:.2f} seconds for the {provider} rate limit ({tokens} tokens)")
@@ -1,52 +1,317 @@
 import os
+import re
 import json
+import hashlib
 import logging
 import time
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import google.generativeai as genai
-from openai import OpenAI
 from utils import parse_duration, format_duration  # Changed from utils.time_utils
-from prompt_loader import load_prompt  # Update this import
+from prompt_loader import load_prompt, load_prompt_record  # Update this import
+from job_manager import append_job_log
+from cache import cache_get, cache_set
+from transcript_artifact import load_transcript, is_transcript_artifact
+from llm_clients import get_openai_client, get_gemini_model, estimate_tokens, estimate_prompt_tokens, acquire
 import traceback
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME")
+OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo-16k")
+# The model's context window, shared by the prompt and the response
+OPENAI_CONTEXT_TOKENS = int(os.getenv("OPENAI_CONTEXT_TOKENS", "16385"))
+# The detection output is a short JSON list, so the response never needs more than this
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "4096"))
+# Headroom for message framing and for the prompt estimate running low
+OPENAI_CONTEXT_MARGIN_TOKENS = 512
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+# How long detection results stay cached; 0 disables the cache
+DETECTION_CACHE_TTL = int(os.getenv("DETECTION_CACHE_TTL", str(30 * 24 * 3600)))
 
-def find_unwanted_content(transcript_file_path):
-    logging.info(f"Starting unwanted content detection for file: {transcript_file_path}")
-    with open(transcript_file_path, "r") as file:
-        transcript = file.read()
+# 'windowed' sends overlapping time windows of the transcript concurrently; 'single' sends it in one prompt
+LLM_DETECTION_MODE = os.getenv("LLM_DETECTION_MODE", "windowed")
+DETECTION_WINDOW_SECONDS = float(os.getenv("DETECTION_WINDOW_SECONDS", "1200"))
+# Long enough that a typical ad read near a window edge is seen whole by at least one window
+DETECTION_WINDOW_OVERLAP_SECONDS = float(os.getenv("DETECTION_WINDOW_OVERLAP_SECONDS", "120"))
+LLM_DETECTION_WORKERS = int(os.getenv("LLM_DETECTION_WORKERS", "4"))
 
-    logging.info(f"Transcript length: {len(transcript)} characters")
+# Matches the "start - end: text" lines written by the transcription stage
+TRANSCRIPT_LINE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?):')
+
+def find_unwanted_content(transcript_file_path, job_id=None):
+    """
+    transcript_file_path is either a transcript artifact (see transcript_artifact),
+    which is only decompressed window by window, or a "start - end: text" file.
+    """
+    logging.info(f"Starting unwanted content detection for file: {transcript_file_path}")
+    if is_transcript_artifact(transcript_file_path):
+        artifact = load_transcript(transcript_file_path)
+        transcript = None
+        transcript_sha256 = artifact.text_sha256
+        logging.info(f"Transcript: {artifact.header['segment_count']} segments, {artifact.duration:.0f} seconds")
+    else:
+        artifact = None
+        with open(transcript_file_path, "r") as file:
+            transcript = file.read()
+        # Same hash as the artifact's text view of this transcript
+        transcript_sha256 = hashlib.sha256(transcript.rstrip('\n').encode('utf-8')).hexdigest()
+        logging.info(f"Transcript length: {len(transcript)} characters")
 
     try:
-        if LLM_PROVIDER == "openai":
-            llm_response = process_with_openai(transcript)
-        elif LLM_PROVIDER == "gemini":
-            llm_response = process_with_gemini(transcript)
-        else:
-            raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}")
+        # Load the prompt once, so the cache key and every window use the same text
+        prompt_record = load_prompt_record(LLM_PROVIDER)
+        prompt = prompt_record['text']
+        detection_info = {
+            'llm_provider': LLM_PROVIDER,
+            'llm_model': get_model_name(),
+            'prompt_version': prompt_record['version']
+        }
+        key = detection_cache_key(transcript_sha256, prompt)
+        cached_response = get_cached_detection(key)
+        if cached_response is not None:
+            message = f"Detection cache hit, reusing {len(cached_response['unwanted_content'])} unwanted content segments"
+            logging.info(message)
+            log_detection(job_id, {'message': message, 'cache': 'hit'})
+            # Same prompt text; report the version it currently has
+            return dict(cached_response, **detection_info)
 
-        parsed_response = parse_llm_response(llm_response)
+        if LLM_DETECTION_MODE == "windowed":
+            if artifact is not None:
+                windows = split_artifact_windows(artifact)
+            else:
+                windows = split_transcript_windows(transcript)
+            parsed_response = detect_in_windows(windows, prompt, job_id)
+        else:
+            if artifact is not None:
+                transcript = artifact.text()
+            llm_response = process_transcript(transcript, prompt)
+            parsed_response = parse_llm_response(llm_response)
+        parsed_response.update(detection_info)
         logging.info(f"Found {len(parsed_response['unwanted_content'])} unwanted content segments")
+        if not parsed_response.get('failed_windows'):
+            # Don't cache a result that is missing failed windows; the next run should retry them
+            save_cached_detection(key, parsed_response)
         return parsed_response
     except Exception as e:
         logging.error(f"Error in find_unwanted_content: {str(e)}")
         logging.error(traceback.format_exc())
         return {"unwanted_content": []}  # Return an empty list if there's an error
 
-def process_with_openai(transcript):
+def get_model_name():
+    if LLM_PROVIDER == "openai":
+        return OPENAI_MODEL_NAME
+    elif LLM_PROVIDER == "gemini":
+        return GEMINI_MODEL_NAME
+    else:
+        raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}")
+
+def detection_cache_key(transcript_sha256, prompt):
+    """
+    Everything that changes the detection output. Editing a prompt changes its
+    text and therefore the key, so stale results are never served.
+    """
+    key_data = json.dumps({
+        'provider': LLM_PROVIDER,
+        'model': get_model_name(),
+        'prompt': prompt,
+        'transcript': transcript_sha256,
+        'mode': LLM_DETECTION_MODE,
+        'window_seconds': DETECTION_WINDOW_SECONDS if LLM_DETECTION_MODE == "windowed" else None,
+        'overlap_seconds': DETECTION_WINDOW_OVERLAP_SECONDS if LLM_DETECTION_MODE == "windowed" else None
+    }, sort_keys=True)
+    return f"detection:{hashlib.sha256(key_data.encode('utf-8')).hexdigest()}"
+
+def get_cached_detection(key):
+    if DETECTION_CACHE_TTL <= 0:
+        return None
+    try:
+        return cache_get(key)
+    except Exception as e:
+        logging.error(f"Error reading detection cache: {str(e)}")
+        return None
+
+def save_cached_detection(key, parsed_response):
+    if DETECTION_CACHE_TTL <= 0:
+        return
+    try:
+        cache_set(key, parsed_response, DETECTION_CACHE_TTL)
+    except Exception as e:
+        logging.error(f"Error writing detection cache: {str(e)}")
+
+def process_transcript(transcript, prompt=None):
+    if LLM_PROVIDER == "openai":
+        return process_with_openai(transcript, prompt)
+    elif LLM_PROVIDER == "gemini":
+        return process_with_gemini(transcript, prompt)
+    else:
+        raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}")
+
+def check_window_settings(window_seconds, overlap_seconds):
+    if overlap_seconds >= window_seconds:
+        raise ValueError("DETECTION_WINDOW_OVERLAP_SECONDS must be smaller than DETECTION_WINDOW_SECONDS")
+
+def split_artifact_windows(artifact, window_seconds=DETECTION_WINDOW_SECONDS, overlap_seconds=DETECTION_WINDOW_OVERLAP_SECONDS):
+    """Same windows as split_transcript_windows, reading only the artifact blocks each window needs."""
+    check_window_settings(window_seconds, overlap_seconds)
+    blocks = artifact.header['blocks']
+    if not blocks:
+        return [(0.0, 0.0, '')]
+
+    windows = []
+    window_start = blocks[0]['start']
+    while True:
+        window_end = window_start + window_seconds
+        text = artifact.text(window_start, window_end)
+        if text:
+            windows.append((window_start, min(window_end, artifact.duration), text))
+        if window_end >= artifact.duration:
+            break
+        window_start = window_end - overlap_seconds
+    return windows
+
+def split_transcript_windows(transcript, window_seconds=DETECTION_WINDOW_SECONDS, overlap_seconds=DETECTION_WINDOW_OVERLAP_SECONDS):
+    """
+    Split a "start - end: text" transcript into overlapping [(start, end, text), ...]
+    windows. Timestamps stay absolute, so segments found in any window are already
+    on the episode timeline.
+    """
+    check_window_settings(window_seconds, overlap_seconds)
+
+    lines = []
+    for line in transcript.splitlines():
+        match = TRANSCRIPT_LINE_PATTERN.match(line)
+        if match:
+            lines.append((float(match.group(1)), float(match.group(2)), line))
+        elif lines:
+            # Continuation of the previous segment's text
+            lines[-1] = (lines[-1][0], lines[-1][1], f"{lines[-1][2]}\n{line}")
+        elif line.strip():
+            lines.append((0.0, 0.0, line))
+    if not lines:
+        return [(0.0, 0.0, transcript)]
+
+    starts = [line[0] for line in lines]
+    # Running maximum, so it stays sorted even if a segment ends after the next one
+    reach = list(accumulate((line[1] for line in lines), max))
+    transcript_end = reach[-1]
+    windows = []
+    window_start = starts[0]
+    while True:
+        window_end = window_start + window_seconds
+        # Every line that overlaps [window_start, window_end)
+        first = bisect_right(reach, window_start) if window_start > starts[0] else 0
+        last = bisect_left(starts, window_end)
+        if last > first:
+            windows.append((window_start, min(window_end, transcript_end), '\n'.join(line[2] for line in lines[first:last])))
+        if window_end >= transcript_end:
+            break
+        window_start = window_end - overlap_seconds
+    return windows
+
+def merge_segments(window_segments):
+    """
+    Merge the per-window segment lists ([[segment, ...], ...] in window order).
+    A segment straddling a window boundary comes back once from each window,
+    often clipped at the window edge, so overlapping segments from different
+    windows are merged into one spanning both that keeps the other fields of the
+    longer one. Segments from the same window, and segments that only touch, are
+    separate findings and stay separate.
+    """
+    tagged = [(segment, index) for index, segments in enumerate(window_segments) for segment in segments]
+    merged = []
+    for segment, index in sorted(tagged, key=lambda item: (item[0]['start_time'], item[0]['end_time'])):
+        if merged and segment['start_time'] < merged[-1][0]['end_time'] and index not in merged[-1][1]:
+            previous, windows = merged[-1]
+            start_time = previous['start_time']
+            end_time = max(previous['end_time'], segment['end_time'])
+            if segment['end_time'] - segment['start_time'] > previous['end_time'] - previous['start_time']:
+                previous = dict(segment)
+            previous['start_time'], previous['end_time'] = start_time, end_time
+            merged[-1] = (previous, windows | {index})
+        else:
+            merged.append((dict(segment), {index}))
+    return [segment for segment, _ in merged]
+
+def log_detection(job_id, entry):
+    if not job_id:
+        return
+    try:
+        append_job_log(job_id, dict(entry, stage='CONTENT_DETECTION', timestamp=time.time()))
+    except Exception as e:
+        logging.error(f"Error writing detection log for job {job_id}: {str(e)}")
+
+def detect_window(index, window, prompt=None, job_id=None):
+    window_start, window_end, text = window
+    start_time = time.time()
+    segments = parse_llm_response(process_transcript(text, prompt))['unwanted_content']
+    elapsed = time.time() - start_time
+    message = f"Window {index + 1} ({format_duration(window_start)}-{format_duration(window_end)}): {len(segments)} segments in {elapsed:.2f} seconds"
+    logging.info(message)
+    log_detection(job_id, {
+        'message': message,
+        'window': index,
+        'window_start': window_start,
+        'window_end': window_end,
+        'duration': elapsed,
+        'segments': len(segments)
+    })
+    return segments
+
+def detect_in_windows(windows, prompt=None, job_id=None):
+    """
+    Detect unwanted content in [(start, end, text), ...] windows. The response's
+    failed_windows counts the windows whose segments are missing from it.
+    """
+    workers = max(1, min(LLM_DETECTION_WORKERS, len(windows)))
+    logging.info(f"Detecting unwanted content in {len(windows)} windows with {workers} workers")
+
+    start_time = time.time()
+    window_segments = []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-detection') as executor:
+        futures = [executor.submit(detect_window, index, window, prompt, job_id) for index, window in enumerate(windows)]
+        for index, future in enumerate(futures):
+            try:
+                window_segments.append(future.result())
+            except Exception as e:
+                # Keep what the other windows found rather than losing the whole episode
+                failed += 1
+                logging.error(f"Error detecting unwanted content in window {index + 1}: {str(e)}")
+                logging.error(traceback.format_exc())
+                log_detection(job_id, {'message': f"Window {index + 1} failed: {str(e)}", 'window': index, 'error': str(e)})
+    if failed == len(windows):
+        raise RuntimeError(f"Unwanted content detection failed in all {failed} windows")
+
+    merged = merge_segments(window_segments)
+    segment_count = sum(len(segments) for segments in window_segments)
+    elapsed = time.time() - start_time
+    message = f"Detected {len(merged)} segments ({segment_count} before merging) in {len(windows)} windows in {elapsed:.2f} seconds"
+    logging.info(message)
+    log_detection(job_id, {'message': message, 'windows': len(windows), 'failed_windows': failed, 'duration': elapsed})
+    return {"unwanted_content": merged, "windows": len(windows), "failed_windows": failed}
+
+def get_openai_max_tokens(prompt_tokens):
+    """The response budget: OPENAI_MAX_OUTPUT_TOKENS, or whatever the prompt leaves of the context window."""
+    available = OPENAI_CONTEXT_TOKENS - prompt_tokens - OPENAI_CONTEXT_MARGIN_TOKENS
+    if available < OPENAI_MAX_OUTPUT_TOKENS:
+        logging.warning(f"Prompt of about {prompt_tokens} tokens leaves {max(available, 0)} of {OPENAI_CONTEXT_TOKENS} context tokens for the response")
+    return max(1, min(OPENAI_MAX_OUTPUT_TOKENS, available))
+
+def process_with_openai(transcript, prompt=None):
     logging.info("Processing with OpenAI")
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    prompt = load_prompt('openai')
+    client = get_openai_client()
+    if prompt is None:
+        prompt = load_prompt('openai')
 
+    prompt_tokens = estimate_prompt_tokens(f"{prompt}\n\n{transcript}")
+    max_tokens = get_openai_max_tokens(prompt_tokens)
+    acquire('openai', prompt_tokens + max_tokens)
     start_time = time.time()
     response = client.chat.completions.create(
-        model="gpt-3.5-turbo-16k",
+        model=OPENAI_MODEL_NAME,
         messages=[
             {
                 "role": "system",
@@ -57,19 +322,20 @@ def process_with_openai(transcript):
                 "content": f"{prompt}\n\n{transcript}"
             }
         ],
-        max_tokens=16000
+        max_tokens=max_tokens
     )
     end_time = time.time()
     logging.info(f"OpenAI response received in {end_time - start_time:.2f} seconds")
     return response.choices[0].message.content
 
-def process_with_gemini(transcript):
+def process_with_gemini(transcript, prompt=None):
     logging.info("Processing with Gemini")
-    genai.configure(api_key=GOOGLE_API_KEY)
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-    prompt = load_prompt('gemini')
+    model = get_gemini_model(GEMINI_MODEL_NAME)
+    if prompt is None:
+        prompt = load_prompt('gemini')
 
     full_prompt = f"{prompt}\n\n{transcript}"
+    acquire('gemini', estimate_tokens(full_prompt))
     logging.info(f"Sending prompt to Gemini (first 500 characters): {full_prompt[:500]}...")
     start_time = time.time()
     response = model.generate_content(
@@ -0,0 +1,617 @@
+"""
+Sharded metadata store for processing state.
+
+Instead of one monolithic db.json, every podcast, episode and prompt is kept
+as its own small record:
+
+- podcasts/<podcast_id>               podcast info + auto-processing settings
+- episodes/<podcast_id>/<episode_id>  one processed episode
+- prompts/<model>                     the current version of one LLM prompt
+- prompt_versions/<model>/<version>   every saved version of a prompt
+
+Point operations (get/save of an episode) touch a single record, and writes
+use a read-modify-write with an optimistic concurrency check so concurrent
+workers don't overwrite each other's changes.
+
+Reads go through an in-process cache that revalidates each record against
+the backend's generation number at most once per METADATA_CACHE_TTL seconds,
+and drops entries on local writes.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from firebase_admin import storage
+from feed_state import bump_state_version
+
+METADATA_BACKEND = os.getenv("METADATA_BACKEND", "firebase")
+METADATA_SQLITE_PATH = os.getenv("METADATA_SQLITE_PATH", "metadata.db")
+METADATA_PREFIX = os.getenv("METADATA_PREFIX", "metadata/")
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", "5"))
+
+LEGACY_DB_FILE = 'db.json'
+LEGACY_IMPORT_MARKER = 'meta/legacy_import'
+
+MAX_UPDATE_RETRIES = 10
+
+
+class ConcurrentUpdateError(Exception):
+    pass
+
+
+def podcast_id(rss_url):
+    return hashlib.sha1(rss_url.encode('utf-8')).hexdigest()
+
+
+def episode_id(episode_title):
+    return hashlib.sha1(episode_title.strip().encode('utf-8')).hexdigest()
+
+
+def podcast_path(rss_url):
+    return f"podcasts/{podcast_id(rss_url)}"
+
+
+def episode_path(rss_url, episode_title):
+    return f"episodes/{podcast_id(rss_url)}/{episode_id(episode_title)}"
+
+
+def prompt_path(model):
+    return f"prompts/{model}"
+
+
+def prompt_version_path(model, version):
+    return f"prompt_versions/{model}/{version}"
+
+
+class FirebaseBackend:
+    """Stores each record as a JSON blob in Firebase Storage."""
+
+    def __init__(self, prefix=METADATA_PREFIX, list_workers=8):
+        self.prefix = prefix
+        self.list_workers = list_workers
+
+    def _blob_name(self, path):
+        return f"{self.prefix}{path}.json"
+
+    def _bucket(self):
+        return storage.bucket()
+
+    def get(self, path):
+        return self.get_with_generation(path)[0]
+
+    def get_with_generation(self, path):
+        from google.api_core.exceptions import NotFound
+        blob = self._bucket().blob(self._blob_name(path))
+        try:
+            data = json.loads(blob.download_as_bytes())
+        except NotFound:
+            return None, None
+        # The download response headers populate the blob's generation
+        return data, blob.generation
+
+    def generation(self, path):
+        # Metadata-only request, much cheaper than downloading the record
+        blob = self._bucket().get_blob(self._blob_name(path))
+        return blob.generation if blob is not None else None
+
+    def list_generations(self, prefix):
+        return {
+            blob.name[len(self.prefix):-len('.json')]: blob.generation
+            for blob in self._bucket().list_blobs(prefix=f"{self.prefix}{prefix}")
+        }
+
+    def put(self, path, data):
+        blob = self._bucket().blob(self._blob_name(path))
+        blob.upload_from_string(json.dumps(data), content_type='application/json')
+
+    def create(self, path, data):
+        from google.api_core.exceptions import PreconditionFailed
+        blob = self._bucket().blob(self._blob_name(path))
+        try:
+            # if_generation_match=0 only succeeds when the object does not exist yet
+            blob.upload_from_string(json.dumps(data), content_type='application/json', if_generation_match=0)
+            return True
+        except PreconditionFailed:
+            return False
+
+    def update(self, path, fn):
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+        bucket = self._bucket()
+        name = self._blob_name(path)
+        for attempt in range(MAX_UPDATE_RETRIES):
+            try:
+                blob = bucket.get_blob(name)
+                if blob is None:
+                    current, generation = None, 0
+                else:
+                    try:
+                        # Fails with PreconditionFailed if the record was rewritten since get_blob
+                        current, generation = json.loads(blob.download_as_bytes(if_generation_match=blob.generation)), blob.generation
+                    except NotFound:
+                        # Deleted since get_blob, so this update creates it
+                        current, generation = None, 0
+                new_value = fn(current)
+                if new_value is None:
+                    return current
+                bucket.blob(name).upload_from_string(
+                    json.dumps(new_value), content_type='application/json', if_generation_match=generation
+                )
+                return new_value
+            except PreconditionFailed:
+                logging.info(f"Concurrent update detected for {path}, retrying (attempt {attempt + 1})")
+        raise ConcurrentUpdateError(f"Could not update {path} after {MAX_UPDATE_RETRIES} attempts")
+
+    def delete(self, path):
+        from google.api_core.exceptions import NotFound
+        try:
+            self._bucket().blob(self._blob_name(path)).delete()
+        except NotFound:
+            pass
+
+    def list(self, prefix):
+        blobs = list(self._bucket().list_blobs(prefix=f"{self.prefix}{prefix}"))
+        if not blobs:
+            return []
+
+        def load(blob):
+            path = blob.name[len(self.prefix):-len('.json')]
+            return path, json.loads(blob.download_as_bytes())
+
+        with ThreadPoolExecutor(max_workers=min(self.list_workers, len(blobs))) as executor:
+            return list(executor.map(load, blobs))
+
+
+class SQLiteBackend:
+    """Local backend storing records in a single SQLite table. Used for tests and local development."""
+
+    def __init__(self, path=METADATA_SQLITE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (path TEXT PRIMARY KEY, data TEXT NOT NULL, generation INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(records)")]
+        if 'generation' not in columns:
+            self.conn.execute("ALTER TABLE records ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+
+    def _write(self, path, data):
+        # Nanosecond timestamps keep generations unique even across delete/re-create
+        self.conn.execute(
+            "INSERT OR REPLACE INTO records (path, data, generation) VALUES (?, ?, ?)",
+            (path, json.dumps(data), time.time_ns())
+        )
+
+    def get(self, path):
+        return self.get_with_generation(path)[0]
+
+    def get_with_generation(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT data, generation FROM records WHERE path = ?", (path,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+    def generation(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT generation FROM records WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def list_generations(self, prefix):
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, generation FROM records WHERE path >= ? AND path < ?", (prefix, upper)
+            ).fetchall()
+        return dict(rows)
+
+    def put(self, path, data):
+        with self.lock:
+            self._write(path, data)
+
+    def create(self, path, data):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO records (path, data, generation) VALUES (?, ?, ?)", (path, json.dumps(data), time.time_ns())
+            )
+            return cursor.rowcount == 1
+
+    def update(self, path, fn):
+        with self.lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so other processes can't interleave
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT data FROM records WHERE path = ?", (path,)).fetchone()
+                current = json.loads(row[0]) if row else None
+                new_value = fn(current)
+                if new_value is not None:
+                    self._write(path, new_value)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return current if new_value is None else new_value
+
+    def delete(self, path):
+        with self.lock:
+            self.conn.execute("DELETE FROM records WHERE path = ?", (path,))
+
+    def list(self, prefix):
+        # All prefixes end with '/', so the next character ('0') bounds the range
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, data FROM records WHERE path >= ? AND path < ? ORDER BY path", (prefix, upper)
+            ).fetchall()
+        return [(path, json.loads(data)) for path, data in rows]
+
+
+class CachedBackend:
+    """
+    Wraps a backend with an in-process cache of parsed records.
+
+    A cached record is served without any I/O for `ttl` seconds. After that it
+    is revalidated with a cheap generation check and only re-downloaded if the
+    record changed. Listings are revalidated the same way with one listing call.
+    Local writes drop the affected entries immediately.
+    """
+
+    def __init__(self, backend, ttl=METADATA_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._records = {}  # path -> (data, generation, checked_at)
+        self._listings = {}  # prefix -> (paths, checked_at)
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'invalidations': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _store(self, path, data, generation):
+        with self.lock:
+            self._records[path] = (data, generation, time.monotonic())
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self._records.clear()
+                self._listings.clear()
+            else:
+                self._records.pop(path, None)
+                for prefix in [p for p in self._listings if path.startswith(p)]:
+                    del self._listings[prefix]
+            self.stats['invalidations'] += 1
+
+    def get(self, path):
+        return copy.deepcopy(self._get(path))
+
+    def _get(self, path):
+        entry = self._records.get(path)
+        if entry is not None:
+            data, generation, checked_at = entry
+            if time.monotonic() - checked_at < self.ttl:
+                self._count('hits')
+                return data
+            self._count('revalidations')
+            if self.backend.generation(path) == generation:
+                self._store(path, data, generation)
+                self._count('hits')
+                return data
+
+        self._count('misses')
+        data, generation = self.backend.get_with_generation(path)
+        self._store(path, data, generation)
+        return data
+
+    def list(self, prefix, revalidate=False):
+        """revalidate=True skips the TTL and checks every record against the backend now."""
+        listing = self._listings.get(prefix)
+        if not revalidate and listing is not None and time.monotonic() - listing[1] < self.ttl:
+            paths = listing[0]
+            self._count('hits')
+            return [(path, copy.deepcopy(self._get(path))) for path in paths]
+
+        self._count('revalidations')
+        generations = self.backend.list_generations(prefix)
+        now = time.monotonic()
+        results = []
+        for path in sorted(generations):
+            entry = self._records.get(path)
+            if entry is not None and entry[1] == generations[path]:
+                self._store(path, entry[0], entry[1])
+                self._count('hits')
+                data = entry[0]
+            else:
+                self._count('misses')
+                data, generation = self.backend.get_with_generation(path)
+                self._store(path, data, generation)
+            if data is not None:
+                results.append((path, copy.deepcopy(data)))
+        with self.lock:
+            self._listings[prefix] = ([path for path, _ in results], now)
+        return results
+
+    def put(self, path, data):
+        self.backend.put(path, data)
+        self.invalidate(path)
+
+    def create(self, path, data):
+        created = self.backend.create(path, data)
+        if created:
+            self.invalidate(path)
+        return created
+
+    def update(self, path, fn):
+        try:
+            return self.backend.update(path, fn)
+        finally:
+            self.invalidate(path)
+
+    def delete(self, path):
+        self.backend.delete(path)
+        self.invalidate(path)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['cached_records'] = len(self._records)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class MetadataStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def cache_stats(self):
+        if isinstance(self.backend, CachedBackend):
+            return self.backend.get_stats()
+        return None
+
+    # Episodes
+
+    def get_episode(self, rss_url, episode_title):
+        return self.backend.get(episode_path(rss_url, episode_title))
+
+    def save_episode(self, episode_data):
+        """Merge episode_data into the stored episode record and return the merged record."""
+        def merge(current):
+            merged = dict(current or {})
+            merged.update(episode_data)
+            return merged
+
+        record = self.backend.update(episode_path(episode_data['rss_url'], episode_data['episode_title']), merge)
+        bump_state_version(episode_data['rss_url'])
+        return record
+
+    def update_episode(self, rss_url, episode_title, fields):
+        def merge(current):
+            if current is None:
+                return None
+            merged = dict(current)
+            merged.update(fields)
+            return merged
+
+        record = self.backend.update(episode_path(rss_url, episode_title), merge)
+        bump_state_version(rss_url)
+        return record
+
+    def list_episodes(self, rss_url, revalidate=False):
+        """revalidate=True reads past the in-process cache, which doesn't see other processes' writes for up to its TTL."""
+        prefix = f"episodes/{podcast_id(rss_url)}/"
+        if revalidate and isinstance(self.backend, CachedBackend):
+            records = self.backend.list(prefix, revalidate=True)
+        else:
+            records = self.backend.list(prefix)
+        episodes = [data for _, data in records]
+        episodes.sort(key=lambda ep: ep.get('timestamp', ''))
+        return episodes
+
+    def delete_episodes(self, rss_url):
+        for path, _ in self.backend.list(f"episodes/{podcast_id(rss_url)}/"):
+            self.backend.delete(path)
+        bump_state_version(rss_url)
+
+    def find_episodes(self, episode_title):
+        """Every feed's record of the episode with this title, for callers that don't know its feed."""
+        suffix = f"/{episode_id(episode_title)}"
+        return [data for path, data in self.backend.list("episodes/") if path.endswith(suffix)]
+
+    def list_processed_podcasts(self):
+        processed = {}
+        for _, episode in self.backend.list("episodes/"):
+            processed.setdefault(episode['rss_url'], []).append(episode)
+        for episodes in processed.values():
+            episodes.sort(key=lambda ep: ep.get('timestamp', ''))
+        return processed
+
+    # Podcasts
+
+    def get_podcast(self, rss_url):
+        return self.backend.get(podcast_path(rss_url))
+
+    def update_podcast(self, rss_url, fn):
+        """Atomically apply fn to the podcast record; fn receives and returns the record dict."""
+        def apply(current):
+            record = dict(current or {'rss_url': rss_url})
+            return fn(record)
+
+        record = self.backend.update(podcast_path(rss_url), apply)
+        bump_state_version(rss_url)
+        return record
+
+    def list_podcasts(self):
+        return [data for _, data in self.backend.list("podcasts/")]
+
+    def get_podcast_info(self, rss_url):
+        record = self.get_podcast(rss_url)
+        return record.get('podcast_info') if record else None
+
+    def save_podcast_info(self, rss_url, podcast_info):
+        def apply(record):
+            info = dict(record.get('podcast_info') or {})
+            info.update(podcast_info)
+            record['podcast_info'] = info
+            return record
+
+        return self.update_podcast(rss_url, apply)
+
+    def list_podcast_info(self):
+        return {p['rss_url']: p['podcast_info'] for p in self.list_podcasts() if p.get('podcast_info')}
+
+    def get_auto_processed(self, rss_url):
+        record = self.get_podcast(rss_url)
+        return record.get('auto_process') if record else None
+
+    def set_auto_processed(self, rss_url, entry):
+        def apply(record):
+            record['auto_process'] = dict(entry, rss_url=rss_url)
+            return record
+
+        return self.update_podcast(rss_url, apply)
+
+    def remove_auto_processed(self, rss_url):
+        def apply(record):
+            if 'auto_process' not in record:
+                return None
+            del record['auto_process']
+            return record
+
+        return self.update_podcast(rss_url, apply)
+
+    def list_auto_processed(self):
+        entries = [p['auto_process'] for p in self.list_podcasts() if p.get('auto_process')]
+        entries.sort(key=lambda entry: entry.get('enabled_at', ''))
+        return entries
+
+    # Prompts
+
+    def get_prompt_record(self, model, revalidate=False):
+        """
+        Return {'model', 'text', 'version', 'updated_at'}; version 0 means the prompt was never saved.
+        revalidate=True reads past the in-process cache, e.g. once another process published an edit.
+        """
+        if revalidate and isinstance(self.backend, CachedBackend):
+            self.backend.invalidate(prompt_path(model))
+        record = self.backend.get(prompt_path(model))
+        if not record:
+            return {'model': model, 'text': '', 'version': 0, 'updated_at': None}
+        # Prompts imported from db.json predate versioning
+        record.setdefault('version', 1)
+        record.setdefault('updated_at', None)
+        return record
+
+    def get_prompt(self, model):
+        return self.get_prompt_record(model)['text']
+
+    def save_prompt(self, model, text):
+        """Store text as the next version of the model's prompt. Saving unchanged text keeps the current version."""
+        changed = []
+
+        def apply(record):
+            if record and record.get('text') == text:
+                return None
+            changed.append(True)
+            return {
+                'model': model,
+                'text': text,
+                'version': (record.get('version', 1) if record else 0) + 1,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+
+        record = self.backend.update(prompt_path(model), apply)
+        if changed:
+            self.backend.put(prompt_version_path(model, record['version']), record)
+            logging.info(f"Saved {model} prompt version {record['version']}")
+        record.setdefault('version', 1)
+        return record
+
+    def get_prompt_version(self, model, version):
+        return self.backend.get(prompt_version_path(model, version))
+
+    def list_prompts(self):
+        return {data['model']: data.get('text', '') for _, data in self.backend.list("prompts/")}
+
+    # Whole-document views
+
+    def load_document(self):
+        """Assemble the legacy db.json-shaped document. Cost grows with the catalog, so only use it for listings."""
+        return {
+            'processed_podcasts': self.list_processed_podcasts(),
+            'auto_processed_podcasts': self.list_auto_processed(),
+            'podcast_info': self.list_podcast_info(),
+            'prompts': self.list_prompts()
+        }
+
+    def import_document(self, data, overwrite=False):
+        """Split a db.json-shaped document into records. Existing records are kept unless overwrite is set."""
+        write = self.backend.put if overwrite else self.backend.create
+
+        podcasts = {}
+        for rss_url, info in (data.get('podcast_info') or {}).items():
+            podcasts.setdefault(rss_url, {'rss_url': rss_url})['podcast_info'] = info
+        for entry in data.get('auto_processed_podcasts') or []:
+            podcasts.setdefault(entry['rss_url'], {'rss_url': entry['rss_url']})['auto_process'] = entry
+        for rss_url, record in podcasts.items():
+            write(podcast_path(rss_url), record)
+
+        processed = data.get('processed_podcasts') or {}
+        # Some old documents stored processed_podcasts as a list
+        if isinstance(processed, dict):
+            for rss_url, episodes in processed.items():
+                for episode in episodes:
+                    if episode.get('episode_title'):
+                        write(episode_path(rss_url, episode['episode_title']), dict(episode, rss_url=rss_url))
+
+        for model, text in (data.get('prompts') or {}).items():
+            write(prompt_path(model), {'model': model, 'text': text})
+
+    def import_legacy_db(self):
+        """One-time import of the monolithic db.json into per-record storage."""
+        if self.backend.get(LEGACY_IMPORT_MARKER) is not None:
+            return
+        try:
+            blob = storage.bucket().blob(LEGACY_DB_FILE)
+            if blob.exists():
+                logging.info(f"Importing legacy {LEGACY_DB_FILE} into the metadata store")
+                self.import_document(json.loads(blob.download_as_text()))
+            self.backend.create(LEGACY_IMPORT_MARKER, {'source': LEGACY_DB_FILE})
+        except Exception as e:
+            logging.error(f"Error importing legacy {LEGACY_DB_FILE}: {str(e)}")
+            logging.error(traceback.format_exc())
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_backend(name=METADATA_BACKEND):
+    if name == 'firebase':
+        return FirebaseBackend()
+    elif name == 'sqlite':
+        return SQLiteBackend()
+    raise ValueError(f"Unsupported metadata backend: {name}")
+
+
+def get_metadata_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = create_backend()
+                if METADATA_CACHE_TTL > 0:
+                    backend = CachedBackend(backend)
+                store = MetadataStore(backend)
+                if METADATA_BACKEND == 'firebase':
+                    store.import_legacy_db()
+                _store = store
+    return _store
@@ -0,0 +1,197 @@
+"""
+Lossless MP3 editing by copying whole frames.
+
+The file is scanned frame by frame, every cut is snapped to the nearest frame
+boundary, and the kept frames are written out unchanged behind a freshly
+built Xing/Info header, so the audio is never decoded or re-encoded.
+
+The first frame after a cut may reference bit-reservoir data from a dropped
+frame, which can cause a click of at most one frame (~26 ms).
+"""
+import logging
+import mmap
+from array import array
+from mutagen.mp3 import MP3
+
+# Layer III bitrates in kbps, indexed by the header's bitrate index
+BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2 and 2.5
+}
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],  # MPEG-2.5
+}
+XING_FLAGS = 0x0001 | 0x0002 | 0x0004  # frames, bytes, TOC
+XING_BITRATE_INDEX = 9  # large enough to hold the Xing payload at every sample rate
+
+
+class Mp3FormatError(Exception):
+    pass
+
+
+class FrameHeader:
+    __slots__ = ('version', 'bitrate', 'sample_rate', 'padding', 'channel_mode', 'protected', 'length', 'samples')
+
+    def __init__(self, header_bytes):
+        b1, b2, b3, b4 = header_bytes
+        if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+            raise Mp3FormatError("No frame sync")
+        self.version = (b2 >> 3) & 0x03
+        layer = (b2 >> 1) & 0x03
+        if self.version == 1 or layer != 1:
+            raise Mp3FormatError("Not an MPEG Layer III frame")
+        bitrate_index = b3 >> 4
+        sample_rate_index = (b3 >> 2) & 0x03
+        if bitrate_index in (0, 15) or sample_rate_index == 3:
+            raise Mp3FormatError("Free-format or invalid frame header")
+
+        mpeg1 = self.version == 3
+        self.protected = not (b2 & 0x01)
+        self.bitrate = BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        self.sample_rate = SAMPLE_RATES[self.version][sample_rate_index]
+        self.padding = (b3 >> 1) & 0x01
+        self.channel_mode = b4 >> 6
+        self.samples = 1152 if mpeg1 else 576
+        self.length = (144 if mpeg1 else 72) * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_size(self):
+        mono = self.channel_mode == 3
+        if self.version == 3:
+            return 17 if mono else 32
+        return 9 if mono else 17
+
+
+def id3v2_size(data):
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def scan_frames(data, start, end):
+    """
+    Return (first_header, offsets, lengths) for the audio frames in data[start:end],
+    skipping an existing Xing/Info/VBRI frame.
+    """
+    offsets = array('Q')
+    lengths = array('I')
+    first_header = None
+    position = start
+    while position + 4 <= end:
+        try:
+            header = FrameHeader(data[position:position + 4])
+        except Mp3FormatError:
+            # Lost sync (junk or a stray tag); look for the next plausible frame
+            next_sync = data.find(b'\xff', position + 1, end)
+            if next_sync == -1:
+                break
+            position = next_sync
+            continue
+        if position + header.length > end:
+            break
+
+        if first_header is None:
+            first_header = header
+            tag_offset = position + 4 + (2 if header.protected else 0) + header.side_info_size
+            if data[tag_offset:tag_offset + 4] in (b'Xing', b'Info') or data[position + 36:position + 40] == b'VBRI':
+                position += header.length
+                continue
+        elif header.sample_rate != first_header.sample_rate or header.version != first_header.version:
+            # A header that disagrees with the stream is almost certainly a false sync
+            position += 1
+            continue
+
+        offsets.append(position)
+        lengths.append(header.length)
+        position += header.length
+
+    if first_header is None or not offsets:
+        raise Mp3FormatError("No MPEG audio frames found")
+    return first_header, offsets, lengths
+
+
+def build_xing_frame(template, frame_count, audio_bytes, toc, cbr):
+    """Build a silent frame carrying a Xing (VBR) or Info (CBR) header for the edited stream."""
+    b2 = 0xE0 | (template.version << 3) | (1 << 1) | 0x01  # Layer III, no CRC
+    sample_rate_index = SAMPLE_RATES[template.version].index(template.sample_rate)
+    b3 = (XING_BITRATE_INDEX << 4) | (sample_rate_index << 2)
+    b4 = template.channel_mode << 6
+    header = FrameHeader(bytes([0xFF, b2, b3, b4]))
+
+    frame = bytearray(header.length)
+    frame[0:4] = bytes([0xFF, b2, b3, b4])
+    offset = 4 + header.side_info_size
+    frame[offset:offset + 4] = b'Info' if cbr else b'Xing'
+    frame[offset + 4:offset + 8] = XING_FLAGS.to_bytes(4, 'big')
+    frame[offset + 8:offset + 12] = frame_count.to_bytes(4, 'big')
+    frame[offset + 12:offset + 16] = (audio_bytes + header.length).to_bytes(4, 'big')
+    frame[offset + 16:offset + 116] = bytes(toc)
+    return bytes(frame)
+
+
+def build_toc(kept_lengths):
+    """100-entry seek table: byte position (scaled to 0-255) at each percent of the duration."""
+    total = sum(kept_lengths)
+    count = len(kept_lengths)
+    toc = []
+    position = 0
+    frame_index = 0
+    for percent in range(100):
+        target = percent * count // 100
+        while frame_index < target:
+            position += kept_lengths[frame_index]
+            frame_index += 1
+        toc.append(min(255, position * 256 // total))
+    return toc
+
+
+def cut_frames(input_file, output_file, keep_intervals):
+    """
+    Write the frames of input_file that fall within keep_intervals ([(start, end), ...]
+    in seconds) to output_file without re-encoding. Raises Mp3FormatError if the
+    file can't be handled frame by frame.
+    """
+    MP3(input_file)  # let mutagen reject files that aren't MPEG audio at all
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        audio_start = id3v2_size(data[:10])
+        audio_end = size - 128 if size >= 128 and data[size - 128:size - 125] == b'TAG' else size
+
+        header, offsets, lengths = scan_frames(data, audio_start, audio_end)
+        frames_per_second = header.sample_rate / header.samples
+        frame_count = len(offsets)
+
+        # Snap each kept interval to whole frames and merge runs that touch
+        runs = []
+        for start, end in keep_intervals:
+            first = max(0, min(frame_count, round(start * frames_per_second)))
+            last = max(0, min(frame_count, round(end * frames_per_second)))
+            if last <= first:
+                continue
+            if runs and first <= runs[-1][1]:
+                runs[-1] = (runs[-1][0], max(runs[-1][1], last))
+            else:
+                runs.append((first, last))
+        if not runs:
+            raise Mp3FormatError("No frames left to keep")
+
+        kept_lengths = [length for first, last in runs for length in lengths[first:last]]
+        # CBR frame lengths differ by at most the padding byte
+        cbr = max(kept_lengths) - min(kept_lengths) <= 1
+        xing_frame = build_xing_frame(header, len(kept_lengths), sum(kept_lengths), build_toc(kept_lengths), cbr)
+
+        with open(output_file, 'wb') as out:
+            out.write(data[:audio_start])
+            out.write(xing_frame)
+            for first, last in runs:
+                # Frames in a run are contiguous in the source, so copy them as one block
+                out.write(data[offsets[first]:offsets[last - 1] + lengths[last - 1]])
+            out.write(data[audio_end:size])
+
+    logging.info(f"Frame-copied {len(kept_lengths)} of {frame_count} frames in {len(runs)} runs to {output_file}")
@@ -4,17 +4,22 @@ from utils import (
     get_podcast_episodes, download_episode, run_with_animation,
     save_processed_podcast, file_path_to_url, safe_filename,
     get_episode_folder, upload_to_firebase, PROCESSED_PODCASTS_FILE,
-    file_exists_in_firebase, download_from_firebase, load_processed_podcasts,
-    get_db
+    file_exists_in_firebase, download_from_firebase, get_db
 )
+from metadata_store import get_metadata_store
+from checkpoint import CheckpointWriter
+from feed_state import bump_state_version
 from job_manager import update_job_status, update_job_info, mark_job_completed, mark_job_failed
-import whisper
+from whisper_registry import WHISPER_MODEL
+from transcription_engine import transcribe_file, get_cache_options
+from transcript_cache import get_cached_transcript, save_cached_transcript, lookup_audio_hash, remember_audio_hash, hash_file
+from streaming_ingest import download_and_transcribe, STREAMING_INGEST
+from transcript_artifact import write_transcript, load_transcript, ARTIFACT_EXTENSION
 import os
 import shutil
 import logging
 import json
 import time
-import torch
 import traceback
 import urllib.parse
 from datetime import datetime
@@ -23,6 +28,8 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
     logging.info(f"Starting to process podcast episode from RSS: {rss_url}")
 
     db = get_db()
+    checkpoint = None
+    input_path = None
 
     try:
         # Get available episodes
@@ -55,6 +62,8 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
         try:
             # Set an expiration on the lock to prevent indefinite locking
             db.expire(lock_key, 3600)  # 1 hour expiration
+            # The modified feed hides episodes while they are locked
+            bump_state_version(rss_url)
 
             # Set job status
             db.set(job_key, 'in_progress')
@@ -64,14 +73,8 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
             os.makedirs(episode_folder, exist_ok=True)
             logging.info(f"Created episode folder: {episode_folder}")
 
-            # Load processed podcasts
-            processed_podcasts = load_processed_podcasts()
-            logging.info(f"Loaded processed podcasts. Type: {type(processed_podcasts)}")
-            logging.info(f"Processed podcasts content: {str(processed_podcasts)[:1000]}...")  # Log the first 1000 characters
-
             # Check if this episode has been processed before
-            existing_podcast = next((p for p in processed_podcasts['processed_podcasts'].get(rss_url, [])
-                                     if p.get('episode_title') == chosen_episode['title']), None)
+            existing_podcast = get_metadata_store().get_episode(rss_url, chosen_episode['title'])
 
             if existing_podcast:
                 logging.info(f"Found existing podcast: {existing_podcast}")
@@ -96,47 +99,76 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
                     "image_url": episodes[0].get('image_url', '')  # Get the image URL from the first episode
                 }
 
+            # Identify the feed item independently of its title, for the modified feed's episode index
+            podcast_data['episode_guid'] = podcast_data.get('episode_guid') or chosen_episode.get('guid')
+            podcast_data['enclosure_url'] = podcast_data.get('enclosure_url') or chosen_episode.get('enclosure_url')
+
+            # Buffers stage updates so that close-together stages are written once
+            checkpoint = CheckpointWriter(podcast_data)
+
             # Update file paths to use Firebase Storage URLs
             input_filename = safe_filename(f"original_{chosen_episode['title']}.mp3")
             transcript_filename = "transcript.txt"
+            transcript_artifact_filename = f"transcript{ARTIFACT_EXTENSION}"
             unwanted_content_filename = "unwanted_content.json"
             output_file = safe_filename(f"edited_{chosen_episode['title']}.mp3")
 
+            # Set when the transcription already happened while downloading, or was found in the cache
+            streamed_result = None
+            cached_result = None
+            input_path = os.path.join(episode_folder, input_filename)
+            transcription_options = get_cache_options()
+
             # Download the episode if it hasn't been downloaded yet
             if 'input_file' not in podcast_data:
                 # Download the episode if it doesn't exist
                 logging.info("STAGE:DOWNLOAD:Starting")
-                logging.info(f"Downloading episode to {os.path.join(episode_folder, input_filename)}")
-                update_job_status(job_id, 'in_progress', 'DOWNLOAD', 30, 'Downloading episode')
-                run_with_animation(download_episode, chosen_episode['url'], os.path.join(episode_folder, input_filename))
+                logging.info(f"Downloading episode to {input_path}")
+
+                # If this enclosure was downloaded before, its transcript may already be cached
+                known_hash = lookup_audio_hash(chosen_episode['url'])
+                if known_hash and 'transcript_file' not in podcast_data:
+                    cached_result = get_cached_transcript(known_hash, WHISPER_MODEL, transcription_options)
+
+                if STREAMING_INGEST and 'transcript_file' not in podcast_data and cached_result is None:
+                    # Decode and transcribe while the download is still running. The same audio may be
+                    # cached under another URL; that is only known once the download has been hashed,
+                    # and then the transcription stops and the cached transcript is used below.
+                    update_job_status(job_id, 'in_progress', 'DOWNLOAD', 30, 'Downloading and transcribing episode')
+                    streamed_result, audio_hash = run_with_animation(
+                        download_and_transcribe, chosen_episode['url'], input_path,
+                        skip_if=lambda audio_hash: get_cached_transcript(audio_hash, WHISPER_MODEL, transcription_options) is not None
+                    )
+                else:
+                    update_job_status(job_id, 'in_progress', 'DOWNLOAD', 30, 'Downloading episode')
+                    audio_hash = run_with_animation(download_episode, chosen_episode['url'], input_path)
+
+                if cached_result is not None and audio_hash != known_hash:
+                    logging.info("Audio behind the enclosure URL changed since it was cached, ignoring cached transcript")
+                    cached_result = None
+                remember_audio_hash(chosen_episode['url'], audio_hash)
+
                 logging.info("STAGE:DOWNLOAD:Completed")
                 update_job_status(job_id, 'in_progress', 'DOWNLOAD', 40, 'Episode downloaded')
-                podcast_data['status'] = 'downloaded'
-                podcast_data['input_file'] = upload_to_firebase(os.path.join(episode_folder, input_filename))
-                logging.info(f"Uploaded input file to Firebase: {podcast_data['input_file']}")
-
-            save_processed_podcast(podcast_data)
+                # Keep the local copy for the later stages; cleanup removes it at the end
+                input_file = upload_to_firebase(input_path, delete_local=False)
+                logging.info(f"Uploaded input file to Firebase: {input_file}")
+                checkpoint.update({'status': 'downloaded', 'input_file': input_file, 'audio_sha256': audio_hash}, stage='DOWNLOAD', durable=True)
+            else:
+                checkpoint.update(stage='DOWNLOAD')
 
             # Transcribe the audio if it hasn't been transcribed yet
             if 'transcript_file' not in podcast_data:
                 # Transcribe the audio
                 logging.info("STAGE:TRANSCRIPTION:Starting")
                 try:
-                    logging.info("Initializing Whisper model...")
-                    update_job_status(job_id, 'in_progress', 'TRANSCRIPTION', 50, 'Initializing Whisper model')
-                    model = whisper.load_model("base")
-                    logging.info("Whisper model initialized successfully")
+                    update_job_status(job_id, 'in_progress', 'TRANSCRIPTION', 50, 'Transcribing audio')
 
                     def transcribe():
                         logging.info("Transcribing audio...")
                         try:
-                            # Download the input file from Firebase if it's not local
-                            if not os.path.exists(os.path.join(episode_folder, input_filename)):
-                                success = download_from_firebase(podcast_data['input_file'], os.path.join(episode_folder, input_filename))
-                                if not success:
-                                    raise ValueError(f"Failed to download input file from Firebase: {podcast_data['input_file']}")
-
-                            result = model.transcribe(os.path.join(episode_folder, input_filename))
+                            # Splits the episode at silences and transcribes the chunks in parallel
+                            result = transcribe_file(input_path)
                             logging.info("Transcription completed successfully")
                             return result
                         except Exception as e:
@@ -144,24 +176,64 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
                             logging.error(traceback.format_exc())
                             return None
 
-                    logging.info("Starting transcription process...")
-                    result = run_with_animation(transcribe)
-                    logging.info("Transcription process finished")
+                    if streamed_result is not None:
+                        logging.info("Using transcription produced during the streaming download")
+                        result = streamed_result
+                    else:
+                        # Download the input file from Firebase if it's not local
+                        if not os.path.exists(input_path):
+                            success = download_from_firebase(podcast_data['input_file'], input_path)
+                            if not success:
+                                raise ValueError(f"Failed to download input file from Firebase: {podcast_data['input_file']}")
+
+                        if 'audio_sha256' not in podcast_data:
+                            checkpoint.update({'audio_sha256': hash_file(input_path)})
+                        if cached_result is None:
+                            cached_result = get_cached_transcript(podcast_data['audio_sha256'], WHISPER_MODEL, transcription_options)
+
+                        if cached_result is not None:
+                            logging.info("Using cached transcript, skipping transcription")
+                            result = cached_result
+                        else:
+                            logging.info("Starting transcription process...")
+                            result = run_with_animation(transcribe)
+                            logging.info("Transcription process finished")
 
                     if result is None or "segments" not in result:
                         raise ValueError("Transcription failed or returned unexpected result")
 
-                    logging.info(f"Writing transcript to {os.path.join(episode_folder, transcript_filename)}")
+                    if cached_result is not None:
+                        update_job_info(job_id, {'transcript_cache': 'hit'})
+                        update_job_status(job_id, 'in_progress', 'TRANSCRIPTION', 55, 'Transcript loaded from cache')
+                    else:
+                        save_cached_transcript(podcast_data['audio_sha256'], WHISPER_MODEL, transcription_options, result)
+
+                    artifact_path = os.path.join(episode_folder, transcript_artifact_filename)
+                    logging.info(f"Writing transcript artifact to {artifact_path}")
+                    write_transcript(artifact_path, result, {
+                        'whisper_model': WHISPER_MODEL,
+                        'transcription_options': transcription_options,
+                        'audio_sha256': podcast_data.get('audio_sha256')
+                    })
+                    # The plain text view is still published for people to read
+                    transcript_text = load_transcript(artifact_path).text()
                     with open(os.path.join(episode_folder, transcript_filename), "w") as f:
-                        for item in result["segments"]:
-                            f.write(f"{item['start']:.2f} - {item['end']:.2f}: {item['text']}\n")
+                        f.write(f"{transcript_text}\n" if transcript_text else "")
                     logging.info("Transcript file created successfully")
                     logging.info("STAGE:TRANSCRIPTION:Completed")
                     update_job_status(job_id, 'in_progress', 'TRANSCRIPTION', 60, 'Transcription completed')
-                    podcast_data['status'] = 'transcribed'
-                    podcast_data['transcript_file'] = upload_to_firebase(os.path.join(episode_folder, transcript_filename))
-                    logging.info(f"Uploaded transcript file to Firebase: {podcast_data['transcript_file']}")
-                    save_processed_podcast(podcast_data)
+                    transcript_file = upload_to_firebase(os.path.join(episode_folder, transcript_filename))
+                    logging.info(f"Uploaded transcript file to Firebase: {transcript_file}")
+                    # Keep the artifact locally; content detection reads it next
+                    transcript_artifact_file = upload_to_firebase(artifact_path, delete_local=False)
+                    # Transcription is the expensive stage, so make it durable right away for retries
+                    checkpoint.update({
+                        'status': 'transcribed',
+                        'transcript_file': transcript_file,
+                        'transcript_artifact_file': transcript_artifact_file,
+                        'whisper_model': WHISPER_MODEL,
+                        'transcript_cache_hit': cached_result is not None
+                    }, stage='TRANSCRIPTION', durable=True)
                 except Exception as e:
                     logging.error(f"Error in Whisper transcription: {str(e)}")
                     logging.error(traceback.format_exc())
@@ -174,16 +246,31 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
             update_job_status(job_id, 'in_progress', 'CONTENT_DETECTION', 70, 'Starting unwanted content detection')
             start_time = time.time()
 
+            # Prefer the structured artifact; episodes transcribed before it existed only have the text file
+            if podcast_data.get('transcript_artifact_file'):
+                detection_input = os.path.join(episode_folder, transcript_artifact_filename)
+                remote_file = podcast_data['transcript_artifact_file']
+            else:
+                detection_input = os.path.join(episode_folder, transcript_filename)
+                remote_file = podcast_data['transcript_file']
             # Download the transcript file from Firebase if it's not local
-            if not os.path.exists(os.path.join(episode_folder, transcript_filename)):
-                download_from_firebase(podcast_data['transcript_file'], os.path.join(episode_folder, transcript_filename))
+            if not os.path.exists(detection_input):
+                download_from_firebase(remote_file, detection_input)
 
-            llm_response = run_with_animation(find_unwanted_content, os.path.join(episode_folder, transcript_filename))
+            llm_response = run_with_animation(find_unwanted_content, detection_input, job_id=job_id)
             end_time = time.time()
             logging.info(f"Unwanted content detection completed in {end_time - start_time:.2f} seconds")
 
             logging.info(f"LLM response: {str(llm_response)[:500]}...")  # Log first 500 characters of the response
 
+            # Editing with windows missing would publish the episode with their ads still in it,
+            # so fail the job; the checkpoint is still at transcription, so a retry resumes here
+            if llm_response.get('failed_windows'):
+                message = f"Unwanted content detection failed in {llm_response['failed_windows']} of {llm_response['windows']} windows"
+                logging.info("STAGE:CONTENT_DETECTION:Failed")
+                update_job_status(job_id, 'in_progress', 'CONTENT_DETECTION', 70, message)
+                raise RuntimeError(message)
+
             logging.info("Parsing LLM response...")
             unwanted_content = llm_response
             logging.info(f"Found {len(unwanted_content['unwanted_content'])} segments of unwanted content")
@@ -194,10 +281,16 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
             logging.info("Unwanted content file created successfully")
             logging.info("STAGE:CONTENT_DETECTION:Completed")
             update_job_status(job_id, 'in_progress', 'CONTENT_DETECTION', 80, 'Unwanted content detection completed')
-            podcast_data['status'] = 'content_detected'
-            podcast_data['unwanted_content_file'] = upload_to_firebase(os.path.join(episode_folder, unwanted_content_filename))
-            logging.info(f"Uploaded unwanted content file to Firebase: {podcast_data['unwanted_content_file']}")
-            save_processed_podcast(podcast_data)
+            unwanted_content_file = upload_to_firebase(os.path.join(episode_folder, unwanted_content_filename))
+            logging.info(f"Uploaded unwanted content file to Firebase: {unwanted_content_file}")
+            checkpoint.update({
+                'status': 'content_detected',
+                'unwanted_content_file': unwanted_content_file,
+                # Identifies which prompt produced this detection, e.g. to match it to cached results
+                'llm_provider': unwanted_content.get('llm_provider'),
+                'llm_model': unwanted_content.get('llm_model'),
+                'prompt_version': unwanted_content.get('prompt_version')
+            }, stage='CONTENT_DETECTION')
 
             # Edit the audio file
             logging.info("STAGE:AUDIO_EDITING:Starting audio editing process...")
@@ -210,15 +303,14 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
 
                     run_with_animation(edit_audio, os.path.join(episode_folder, input_filename), os.path.join(episode_folder, output_file), unwanted_content['unwanted_content'])
                     logging.info("Audio editing completed")
-                    podcast_data['output_file'] = upload_to_firebase(os.path.join(episode_folder, output_file))
+                    edited_file = upload_to_firebase(os.path.join(episode_folder, output_file))
                 else:
                     logging.info("No unwanted content found. Skipping audio editing.")
-                    podcast_data['output_file'] = podcast_data['input_file']
-                podcast_data['status'] = 'edited'
-                save_processed_podcast(podcast_data)
+                    edited_file = podcast_data['input_file']
+                checkpoint.update({'status': 'edited', 'output_file': edited_file}, stage='AUDIO_EDITING')
             except Exception as e:
                 logging.error(f"Error during audio editing: {str(e)}")
-                podcast_data['output_file'] = podcast_data['input_file']
+                checkpoint.update({'output_file': podcast_data['input_file']}, stage='AUDIO_EDITING')
                 logging.info("Using original audio file due to editing error")
                 logging.info("STAGE:AUDIO_EDITING:Failed")
                 update_job_status(job_id, 'in_progress', 'AUDIO_EDITING', 90, f'Audio editing failed: {str(e)}')
@@ -233,14 +325,15 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
                 "edited_url": podcast_data['output_file'],
                 "transcript_file": podcast_data['transcript_file'],
                 "unwanted_content_file": podcast_data['unwanted_content_file'],
-                "image_url": podcast_data.get('image_url', '')
+                "image_url": podcast_data.get('image_url', ''),
+                "episode_guid": podcast_data.get('episode_guid'),
+                "enclosure_url": podcast_data.get('enclosure_url')
             }
 
             logging.info(f"Podcast processing completed successfully. Result: {result}")
 
             # Update and save the final processed podcast data
-            podcast_data.update(result)
-            save_processed_podcast(podcast_data)
+            checkpoint.update(result, stage='COMPLETION', durable=True)
 
             # Cleanup local files
             logging.info("STAGE:CLEANUP:Starting cleanup of local files")
@@ -249,6 +342,7 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
             files_to_delete = [
                 os.path.join(episode_folder, input_filename),
                 os.path.join(episode_folder, transcript_filename),
+                os.path.join(episode_folder, transcript_artifact_filename),
                 os.path.join(episode_folder, unwanted_content_filename),
                 os.path.join(episode_folder, output_file)
             ]
@@ -271,8 +365,17 @@ def process_podcast_episode(rss_url, episode_index=0, job_id=None):
             return result
 
         finally:
+            # Write out any buffered stage updates before releasing the lock
+            if checkpoint is not None:
+                checkpoint.close()
+            # The original is in Firebase Storage once downloaded, and a retry fetches it from there,
+            # so a failed job doesn't leave a full episode behind in the folder
+            if input_path and os.path.exists(input_path):
+                os.remove(input_path)
+                logging.info(f"Deleted local input file: {input_path}")
             # Release the lock
             db.delete(lock_key)
+            bump_state_version(rss_url)
 
     except Exception as e:
         logging.error(f"Error in podcast processing: {str(e)}")
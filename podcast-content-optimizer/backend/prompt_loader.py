@@ -1,20 +1,79 @@
-from firebase_admin import storage
-import json
+"""
+Prompts with an in-process cache.
+
+Records are cached for up to PROMPT_CACHE_TTL seconds. save_prompt() also
+publishes the new version number in Redis, and every load compares the cached
+record's version with it, so an edit made in the Flask app reaches Celery
+workers on their next load instead of when their copy expires. The TTL only
+matters while Redis can't be read.
+"""
 import logging
+import os
+import threading
+import time
+from cache import redis_client
+from metadata_store import get_metadata_store
+
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", "60"))
+
+_prompt_cache = {}
+_prompt_cache_lock = threading.Lock()
+
+
+def _version_key(model):
+    return f"prompt_version:{model}"
+
+
+def get_published_version(model):
+    """The prompt version last saved by any process, or None if unknown."""
+    try:
+        value = redis_client.get(_version_key(model))
+    except Exception as e:
+        logging.error(f"Error reading published prompt version: {str(e)}")
+        return None
+    return int(value) if value else None
+
+
+def load_prompt_record(model):
+    now = time.time()
+    published = get_published_version(model)
+    with _prompt_cache_lock:
+        cached = _prompt_cache.get(model)
+    if cached and cached[0] > now and (published is None or cached[1]['version'] == published):
+        return cached[1]
+
+    try:
+        # The metadata store's own cache may still hold the version before the published one
+        record = get_metadata_store().get_prompt_record(model, revalidate=published is not None)
+    except Exception as e:
+        logging.error(f"Error loading prompt from the metadata store: {str(e)}")
+        # A stale prompt is better than none
+        return cached[1] if cached else {'model': model, 'text': '', 'version': 0, 'updated_at': None}
+
+    with _prompt_cache_lock:
+        _prompt_cache[model] = (now + PROMPT_CACHE_TTL, record)
+    return record
 
-PROCESSED_PODCASTS_FILE = 'db.json'
 
 def load_prompt(model):
+    return load_prompt_record(model)['text']
+
+
+def save_prompt(model, text):
+    record = get_metadata_store().save_prompt(model, text)
+    with _prompt_cache_lock:
+        _prompt_cache[model] = (time.time() + PROMPT_CACHE_TTL, record)
     try:
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        if blob.exists():
-            json_data = blob.download_as_text()
-            data = json.loads(json_data)
-            prompts = data.get('prompts', {})
-            return prompts.get(model, "")
-        else:
-            logging.warning(f"Prompts file not found: {PROCESSED_PODCASTS_FILE}")
-            return ""
+        redis_client.set(_version_key(model), record['version'])
     except Exception as e:
-        logging.error(f"Error loading prompts from Firebase: {str(e)}")
-        return ""
+        # Other processes fall back to PROMPT_CACHE_TTL
+        logging.error(f"Error publishing prompt version: {str(e)}")
+    return record
+
+
+def invalidate_prompt_cache(model=None):
+    with _prompt_cache_lock:
+        if model is None:
+            _prompt_cache.clear()
+        else:
+            _prompt_cache.pop(model, None)
@@ -0,0 +1,84 @@
+"""
+Cache of rendered modified feeds.
+
+A rendered feed is keyed by everything it is built from: the upstream feed's
+validator, the feed's processing state version (see feed_state) and the URL
+root it links back to. Entries live in a small in-process LRU in front of
+Redis, so a hit never touches the upstream feed or the metadata store. Both
+expire RENDERED_FEED_TTL seconds after the feed was rendered.
+
+The response's ETag is a hash of the rendered XML rather than the key: some
+inputs, like a processing lock expiring without a release, change the output
+without moving the key, and then only a re-render after the TTL shows it.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import redis_client
+
+# Bounds how long a lock that expired without being released can hide an episode
+RENDERED_FEED_TTL = int(os.getenv("RENDERED_FEED_TTL", "600"))
+RENDERED_FEED_MEMORY_ENTRIES = int(os.getenv("RENDERED_FEED_MEMORY_ENTRIES", "64"))
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def rendered_feed_key(rss_url, feed_validator, state_version, url_root):
+    key_data = '\n'.join([rss_url, feed_validator, str(state_version), url_root])
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+def rendered_feed_etag(xml):
+    return hashlib.sha256(xml.encode('utf-8')).hexdigest()
+
+
+def _remember(key, xml, ttl=RENDERED_FEED_TTL):
+    etag = rendered_feed_etag(xml)
+    with _memory_lock:
+        _memory[key] = (xml, etag, time.monotonic() + ttl)
+        _memory.move_to_end(key)
+        while len(_memory) > RENDERED_FEED_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+    return etag
+
+
+def get_rendered_feed(key):
+    """Return (xml, etag) for a rendered feed that hasn't expired, or (None, None)."""
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            xml, etag, expires_at = entry
+            if time.monotonic() < expires_at:
+                _memory.move_to_end(key)
+                return xml, etag
+            del _memory[key]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(f"rendered_feed:{key}")
+        pipe.ttl(f"rendered_feed:{key}")
+        xml, ttl = pipe.execute()
+    except Exception as e:
+        logging.error(f"Error reading rendered feed cache: {str(e)}")
+        return None, None
+    if xml is None:
+        return None, None
+    xml = xml.decode('utf-8')
+    # Keep it in memory only for what's left of its time in Redis
+    if ttl is not None and ttl > 0:
+        return xml, _remember(key, xml, ttl)
+    return xml, rendered_feed_etag(xml)
+
+
+def save_rendered_feed(key, xml):
+    """Cache a rendered feed and return its ETag."""
+    etag = _remember(key, xml)
+    try:
+        redis_client.setex(f"rendered_feed:{key}", RENDERED_FEED_TTL, xml.encode('utf-8'))
+    except Exception as e:
+        logging.error(f"Error writing rendered feed cache: {str(e)}")
+    return etag
@@ -7,9 +7,13 @@ import traceback
 import requests
 import os
 from mutagen.mp3 import MP3
-from utils import format_duration, is_episode_processed, is_episode_being_processed, get_podcast_episodes, is_episode_new, get_auto_process_enable_date, get_db, safe_filename, load_processed_podcasts
+from utils import format_duration, is_episode_processed, get_processing_states, get_podcast_episodes, is_episode_new, get_auto_process_enable_date, get_db, safe_filename
+from metadata_store import get_metadata_store
+from feed_cache import get_feed
+from feed_transform import FeedTransformHandler, transform_feed
+from episode_index import ProcessedEpisodeIndex, get_episode_index
 from flask import request
-from io import StringIO
+from io import BytesIO, StringIO
 from utils import safe_filename
 import urllib.parse
 from firebase_admin import storage
@@ -46,254 +50,204 @@ def download_image(image_url, podcast_title):
         logging.error(f"Error downloading image: {str(e)}")
     return None
 
-def create_modified_rss_feed(original_rss_url, processed_podcasts):
+def parse_pub_date(pub_date_str):
+    try:
+        return datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S %z")
+    except ValueError:
+        try:
+            dt = datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S")
+            return dt.replace(tzinfo=timezone.utc)
+        except ValueError:
+            logging.warning(f"Could not parse pubDate: {pub_date_str}. Using current time.")
+            return datetime.now(timezone.utc)
+
+class ModifiedFeedHandler(FeedTransformHandler):
+    """
+    Rewrites the original feed as it streams through feed_transform: processed
+    episodes are updated in place, new and in-progress episodes are held back,
+    and the channel is rebranded to point at the modified feed.
+
+    Items keep the upstream feed's order. The tree-based rewrite this replaced
+    also appended every processed item again at the end of the channel, so they
+    appeared twice; its pubDate sort only ordered the processing queue, which
+    create_modified_rss_feed still sorts newest first.
+    """
+
+    def __init__(self, original_rss_url, episode_index, processing_states, enable_date, feed_url):
+        self.original_rss_url = original_rss_url
+        self.episode_index = episode_index
+        self.processing_states = processing_states
+        self.enable_date = enable_date
+        self.feed_url = feed_url
+        self.episodes_to_process = []
+        self.channel_found = False
+        # Only the first of each channel element is rewritten, like channel.find() did
+        self.seen = set()
+
+    def handle_channel_child(self, elem):
+        if elem.tag == 'item':
+            return self.handle_item(elem)
+        self.rewrite_channel_element(elem)
+        return True
+
+    def handle_item(self, item):
+        # Get the GUID
+        guid_elem = item.find('guid')
+        episode_guid = guid_elem.text.strip() if (guid_elem is not None and guid_elem.text) else None
+
+        # Get the title
+        item_title_elem = item.find('title')
+        episode_title = item_title_elem.text.strip() if (item_title_elem is not None and item_title_elem.text) else None
+
+        # Get the enclosure URL
+        enclosure_elem = item.find('enclosure')
+        enclosure_url = enclosure_elem.get('url') if enclosure_elem is not None else None
+
+        processed_episode = self.episode_index.find(episode_guid, episode_title, enclosure_url)
+
+        # Processed episodes (including deleted ones) are always published, rewritten in place
+        if processed_episode is not None and processed_episode.get('status') in ['completed', 'deleted']:
+            logging.info(f"Updating processed episode: {episode_title} (Status: {processed_episode.get('status')})")
+            update_processed_item(item, processed_episode, NAMESPACES)
+            return True
+
+        if not episode_title:
+            logging.warning("Item without a title found in RSS feed.")
+            return True
+
+        # Get publication date
+        pub_date_elem = item.find('pubDate')
+        episode_published_date = parse_pub_date(pub_date_elem.text) if (pub_date_elem is not None and pub_date_elem.text) else datetime.now(timezone.utc)
+
+        # Keep episodes older than enable date in the feed without modification
+        if self.enable_date and episode_published_date < self.enable_date:
+            logging.info(f"Episode older than enable date: {episode_title}")
+            return True
+
+        # Remove episode from feed if it's:
+        # 1. Currently being processed OR
+        # 2. Not processed yet and newer than enable date
+        # Items without a record are held back either way, so only records have had their locks checked
+        being_processed = processed_episode is not None and self.processing_states.get(processed_episode.get('episode_title'), False)
+        if being_processed or processed_episode is None:
+            logging.info(f"Removing episode from feed: {episode_title} (Being processed: {being_processed})")
+            if processed_episode is None:
+                logging.info(f"New episode detected for processing: {episode_title}, Published: {episode_published_date}")
+                self.episodes_to_process.append((episode_title, episode_published_date))
+            return False
+
+        return True
+
+    def _first(self, key):
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def rewrite_channel_element(self, elem):
+        tag = elem.tag
+        if tag == f"{{{NAMESPACES['atom']}}}link":
+            # Update <atom:link rel="self"> if it exists
+            if elem.get('rel') == 'self' and self._first('atom_self'):
+                elem.set('href', self.feed_url)
+            return
+        if not self._first(tag):
+            return
+
+        if tag == 'title':
+            # Update the channel title
+            elem.text = f"{elem.text} (Optimized)"
+        elif tag == 'description':
+            # Update the channel description
+            elem.text = f"Optimized version: {elem.text}"
+        elif tag == 'guid':
+            # Generate a new unique feed GUID
+            elem.text = f"optimized_feed_{int(time.time())}"
+            elem.set('isPermaLink', 'false')
+        elif tag in (f"{{{NAMESPACES['itunes']}}}author", f"{{{NAMESPACES['itunes']}}}title"):
+            # Update iTunes specific elements
+            elem.text = f"{elem.text} (Optimized)"
+        elif tag in ('link', f"{{{NAMESPACES['itunes']}}}new-feed-url"):
+            # Point the link and <itunes:new-feed-url> at the modified RSS feed
+            elem.text = self.feed_url
+        elif tag.startswith('{') and tag.split('}', 1)[1] in ['organizationId', 'networkId', 'programId']:
+            # Update namespace-specific identifiers
+            elem.text = f"{elem.text}_modified"
+
+    def extra_channel_children(self):
+        self.channel_found = True
+        extras = []
+        if 'atom_self' not in self.seen:
+            extras.append(ET.Element(f"{{{NAMESPACES['atom']}}}link", attrib={
+                'href': self.feed_url,
+                'rel': 'self',
+                'type': 'application/rss+xml'
+            }))
+        if 'guid' not in self.seen:
+            channel_guid = ET.Element('guid', attrib={'isPermaLink': 'false'})
+            channel_guid.text = f"optimized_feed_{int(time.time())}"
+            extras.append(channel_guid)
+        new_feed_url_tag = f"{{{NAMESPACES['itunes']}}}new-feed-url"
+        if new_feed_url_tag not in self.seen:
+            new_feed_url = ET.Element(new_feed_url_tag)
+            new_feed_url.text = self.feed_url
+            extras.append(new_feed_url)
+        return extras
+
+def create_modified_rss_feed(original_rss_url, processed_podcasts=None, url_root=None, process_new=True, feed=None):
     logging.info(f"Creating modified RSS feed for {original_rss_url}")
 
     try:
         # Check if podcast is in auto-processed list
-        processed_data = load_processed_podcasts()
-        auto_processed = processed_data.get('auto_processed_podcasts', [])
-        if not any(p['rss_url'] == original_rss_url for p in auto_processed):
+        if not get_metadata_store().get_auto_processed(original_rss_url):
             logging.info(f"RSS URL {original_rss_url} is not in auto-processed list, skipping feed creation")
             return None
 
-        # Parse the original RSS feed
-        response = requests.get(original_rss_url)
-        response.raise_for_status()
-        original_xml = response.text
-
-        # Parse the XML while preserving namespaces
-        root = ET.fromstring(original_xml)
-
-        # Collect all namespaces used in the document
-        namespaces = dict([node for _, node in ET.iterparse(StringIO(original_xml), events=['start-ns'])])
-
-        # Update our NAMESPACES dictionary with the collected namespaces
-        NAMESPACES.update(namespaces)
+        # The raw bytes let the XML declaration pick the encoding. Callers that keyed the
+        # result on a snapshot's validator pass that snapshot, so the body matches the key.
+        original_xml = (feed or get_feed(original_rss_url)).body
 
-        # Register all namespaces
-        for prefix, uri in NAMESPACES.items():
-            ET.register_namespace(prefix, uri)
-
-        # Find the channel element
-        channel = root.find('channel')
-        if channel is None:
-            logging.error("No channel element found in the RSS feed")
-            return None
-
-        # Get the current URL root from the request
-        url_root = request.url_root.rstrip('/')
+        # Get the current URL root from the request, unless rendering outside of one (e.g. the feed poller)
+        if url_root is None:
+            url_root = request.url_root
+        url_root = url_root.rstrip('/')
 
         # Properly encode the entire original RSS URL
         encoded_rss_url = quote(original_rss_url, safe='')
+        feed_url = f"{url_root}/api/modified_rss/{encoded_rss_url}"
 
         enable_date = get_auto_process_enable_date(original_rss_url)
         logging.info(f"Auto-processing enabled date for {original_rss_url}: {enable_date}")
 
-        # Build mappings from episode identifiers to items
-        guid_to_item = {}
-        title_to_item = {}
-        for item in channel.findall('item'):
-            # Get the GUID
-            guid_elem = item.find('guid')
-            if guid_elem is not None and guid_elem.text:
-                episode_guid = guid_elem.text.strip()
-                guid_to_item[episode_guid] = item
-            else:
-                episode_guid = None
+        # Index the processed episodes for the current RSS URL; the store's index is reused across requests
+        if processed_podcasts is None:
+            episode_index = get_episode_index(original_rss_url)
+        else:
+            episode_index = ProcessedEpisodeIndex(processed_podcasts.get(original_rss_url, []))
 
-            # Get the title
-            item_title_elem = item.find('title')
-            if item_title_elem is not None and item_title_elem.text:
-                episode_title = item_title_elem.text.strip()
-                title_to_item[episode_title] = item
-            else:
-                logging.warning("Item without a title found in RSS feed.")
-                continue  # Skip items without a title
-
-        # Get the list of processed episodes for the current RSS URL
-        processed_episodes_list = processed_podcasts.get(original_rss_url, [])
-
-        # Create sets of processed episode titles and GUIDs for quick lookup
-        processed_episode_titles = set()
-        processed_episode_guids = set()
-        for pe in processed_episodes_list:
-            if pe.get('status') == 'completed':
-                if 'episode_title' in pe and pe['episode_title']:
-                    processed_episode_titles.add(pe['episode_title'].strip())
-                if 'episode_guid' in pe and pe['episode_guid']:
-                    processed_episode_guids.add(pe['episode_guid'].strip())
-
-        # Sort items in reverse chronological order
-        items = channel.findall('item')
-        def parse_pub_date(pub_date_str):
-            try:
-                return datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S %z")
-            except ValueError:
-                try:
-                    dt = datetime.strptime(pub_date_str, "%a, %d %b %Y %H:%M:%S")
-                    return dt.replace(tzinfo=timezone.utc)
-                except ValueError:
-                    logging.warning(f"Could not parse pubDate: {pub_date_str}. Using current time.")
-                    return datetime.now(timezone.utc)
-
-        items_sorted = sorted(items, key=lambda x: parse_pub_date(x.find('pubDate').text if x.find('pubDate') is not None else ''), reverse=True)
-
-        episodes_to_process = []
-        items_to_remove = []
-
-        for item in items_sorted:
-            # Get the GUID
-            guid_elem = item.find('guid')
-            episode_guid = guid_elem.text.strip() if (guid_elem is not None and guid_elem.text) else None
-
-            # Get the title
-            item_title_elem = item.find('title')
-            episode_title = item_title_elem.text.strip() if (item_title_elem is not None and item_title_elem.text) else None
-
-            if not episode_title:
-                logging.warning("Item without a title found in RSS feed.")
-                continue  # Skip items without a title
-
-            # Get publication date
-            pub_date_elem = item.find('pubDate')
-            episode_published_date = parse_pub_date(pub_date_elem.text) if (pub_date_elem is not None and pub_date_elem.text) else datetime.now(timezone.utc)
-
-            # Check if episode is older than enabled date
-            is_older_than_enabled_date = enable_date and episode_published_date < enable_date
-            if is_older_than_enabled_date:
-                logging.info(f"Episode older than enable date: {episode_title}")
-                # Keep episodes older than enable date in the feed without modification
-                continue
-
-            # Check if the episode is already processed
-            is_already_processed = False
-            is_deleted = False
-            for processed_episode in processed_episodes_list:
-                if ((episode_guid and processed_episode.get('episode_guid') == episode_guid) or
-                    (episode_title and processed_episode.get('episode_title') == episode_title)):
-                    is_already_processed = True
-                    is_deleted = processed_episode.get('status') == 'deleted'
-                    break
-
-            # Remove episode from feed if it's:
-            # 1. Currently being processed OR
-            # 2. Not processed yet and newer than enable date
-            if is_episode_being_processed(original_rss_url, episode_title) or (not is_already_processed and not is_older_than_enabled_date):
-                logging.info(f"Removing episode from feed: {episode_title} (Being processed: {is_episode_being_processed(original_rss_url, episode_title)})")
-                items_to_remove.append(item)
-                if not is_already_processed:
-                    episodes_to_process.append((episode_title, episode_published_date))
-                continue
-
-            # Don't remove deleted episodes from the feed
-            if is_already_processed and is_deleted:
-                continue
-
-            # Only add to processing queue if not already processed
-            if not is_already_processed:
-                logging.info(f"New episode detected for processing: {episode_title}, Published: {episode_published_date}")
-                episodes_to_process.append((episode_title, episode_published_date))
-                items_to_remove.append(item)
+        # Check the processing locks of all unfinished episodes in one round trip
+        processing_states = get_processing_states(original_rss_url, episode_index.unfinished_titles)
+
+        # Rewrite the feed in a single streaming pass
+        handler = ModifiedFeedHandler(original_rss_url, episode_index, processing_states, enable_date, feed_url)
+        output = StringIO()
+        transform_feed(BytesIO(original_xml), output.write, handler, NAMESPACES)
 
-        # Remove items that are being processed
-        for item in items_to_remove:
-            channel.remove(item)
+        if not handler.channel_found:
+            logging.error("No channel element found in the RSS feed")
+            return None
 
-        # Process new episodes if any
-        if episodes_to_process:
+        # Process new episodes if any, newest first
+        if handler.episodes_to_process and not process_new:
+            logging.info(f"Leaving {len(handler.episodes_to_process)} new episodes for the feed poller")
+        elif handler.episodes_to_process:
+            episodes_to_process = sorted(handler.episodes_to_process, key=lambda episode: episode[1], reverse=True)
             logging.info(f"Found {len(episodes_to_process)} new episodes to process.")
             process_new_episodes(original_rss_url, episodes_to_process)
         else:
             logging.info("No new episodes found for processing")
 
-        # Add back all processed episodes (including deleted ones)
-        for processed_episode in processed_episodes_list:
-            if processed_episode.get('status') in ['completed', 'deleted']:
-                episode_title = processed_episode.get('episode_title', '').strip()
-                episode_guid = processed_episode.get('episode_guid', '').strip()
-
-                # Find the original item
-                item = None
-                if episode_guid and episode_guid in guid_to_item:
-                    item = guid_to_item[episode_guid]
-                    logging.info(f"Found item by GUID for episode: {episode_title}")
-                elif episode_title and episode_title in title_to_item:
-                    item = title_to_item[episode_title]
-                    logging.info(f"Found item by Title for episode: {episode_title}")
-
-                if item is not None:
-                    logging.info(f"Updating processed episode: {episode_title} (Status: {processed_episode.get('status')})")
-                    update_processed_item(item, processed_episode, NAMESPACES)
-                    channel.append(item)
-                else:
-                    logging.warning(f"Could not find original item for processed episode: {episode_title}")
-
-        # Perform modifications on the channel and items
-        # Update <itunes:new-feed-url> if it exists
-        new_feed_url = channel.find('itunes:new-feed-url', namespaces=NAMESPACES)
-        if new_feed_url is not None:
-            new_feed_url.text = f"{url_root}/api/modified_rss/{encoded_rss_url}"
-
-        # Update <atom:link rel="self"> if it exists
-        atom_link = channel.find('atom:link[@rel="self"]', namespaces=NAMESPACES)
-        if atom_link is not None:
-            atom_link.set('href', f"{url_root}/api/modified_rss/{encoded_rss_url}")
-        else:
-            atom_link = ET.SubElement(channel, f"{{{NAMESPACES['atom']}}}link", attrib={
-                'href': f"{url_root}/api/modified_rss/{encoded_rss_url}",
-                'rel': 'self',
-                'type': 'application/rss+xml'
-            })
-
-        # Update the channel title
-        title_elem = channel.find('title')
-        if title_elem is not None:
-            title_elem.text = f"{title_elem.text} (Optimized)"
-
-        # Update the channel description
-        description_elem = channel.find('description')
-        if description_elem is not None:
-            description_elem.text = f"Optimized version: {description_elem.text}"
-
-        # Generate a new unique feed GUID
-        channel_guid = channel.find('guid')
-        if channel_guid is not None:
-            channel_guid.text = f"optimized_feed_{int(time.time())}"
-        else:
-            channel_guid = ET.SubElement(channel, 'guid')
-            channel_guid.text = f"optimized_feed_{int(time.time())}"
-        channel_guid.set('isPermaLink', 'false')
-
-        # Update iTunes specific elements
-        itunes_author = channel.find('itunes:author', namespaces=NAMESPACES)
-        if itunes_author is not None:
-            itunes_author.text = f"{itunes_author.text} (Optimized)"
-
-        itunes_title = channel.find('itunes:title', namespaces=NAMESPACES)
-        if itunes_title is not None:
-            itunes_title.text = f"{itunes_title.text} (Optimized)"
-
-        # Update the link to point to your modified RSS feed
-        link_elem = channel.find('link')
-        if link_elem is not None:
-            link_elem.text = f"{url_root}/api/modified_rss/{encoded_rss_url}"
-
-        # Update or add a new <itunes:new-feed-url> element
-        new_feed_url = channel.find('itunes:new-feed-url', namespaces=NAMESPACES)
-        if new_feed_url is None:
-            new_feed_url = ET.SubElement(channel, f"{{{NAMESPACES['itunes']}}}new-feed-url")
-        new_feed_url.text = f"{url_root}/api/modified_rss/{encoded_rss_url}"
-
-        # Update namespace-specific identifiers
-        for prefix, uri in namespaces.items():
-            for id_type in ['organizationId', 'networkId', 'programId']:
-                id_elem = channel.find(f'{{{uri}}}{id_type}')
-                if id_elem is not None:
-                    id_elem.text = f"{id_elem.text}_modified"
-
-        # Convert the modified XML tree to a string, preserving the original structure
-        modified_rss = ET.tostring(root, encoding='unicode', method='xml')
+        modified_rss = output.getvalue()
         logging.info(f"Modified RSS feed created. Length: {len(modified_rss)}")
         return modified_rss
 
@@ -417,10 +371,14 @@ def process_new_episodes(rss_url, episodes_to_process):
         else:
             logging.error(f"Could not find episode {episode_title} in the feed")
 
-def get_modified_rss_feed(rss_url, processed_podcasts):
+def get_modified_rss_feed(rss_url, processed_podcasts=None, process_new=True, feed=None, url_root=None):
     logging.info(f"Generating modified RSS feed for {rss_url}")
 
+    if processed_podcasts is None:
+        # Matched against the metadata store's cached episode index
+        return create_modified_rss_feed(rss_url, url_root=url_root, process_new=process_new, feed=feed)
+
     rss_specific_podcasts = processed_podcasts.get(rss_url, [])
     logging.info(f"Found {len(rss_specific_podcasts)} processed episodes for {rss_url}")
 
-    return create_modified_rss_feed(rss_url, {rss_url: rss_specific_podcasts})
+    return create_modified_rss_feed(rss_url, {rss_url: rss_specific_podcasts}, url_root=url_root, process_new=process_new, feed=feed)
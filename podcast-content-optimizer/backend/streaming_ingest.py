@@ -0,0 +1,151 @@
+"""
+Streaming ingest: download, decode and transcribe an episode concurrently.
+
+The download feeds ffmpeg's stdin as bytes arrive, ffmpeg decodes to 16 kHz
+mono PCM, and every time a full chunk of audio is available it is cut at a
+quiet point and handed to the transcription pool. By the time the download
+finishes, most of the episode has already been transcribed.
+
+The audio's hash, and so its transcript cache entry, is only known once the
+download finishes. At that point the caller's skip_if check runs, and when it
+says the transcript is already cached, decoding stops and the chunks that
+haven't started yet are cancelled. Chunks transcribed while the download was
+still running are wasted work on such a hit.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from transcription_engine import (
+    SAMPLE_RATE, SILENCE_SEARCH_SECONDS, TRANSCRIPTION_CHUNK_SECONDS, TranscriptionSession,
+    find_split_point, transcribe_file
+)
+from utils import download_episode
+
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "true").lower() == "true"
+PCM_READ_SIZE = 64 * 1024
+
+
+class _DecoderFeed:
+    """Writes downloaded bytes into ffmpeg, and stops quietly if ffmpeg has gone away."""
+
+    def __init__(self, process):
+        self.process = process
+        self.broken = False
+
+    def __call__(self, data):
+        if self.broken:
+            return
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            logging.warning("Decoder stopped accepting data; continuing the download without streaming")
+            self.broken = True
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+
+def download_and_transcribe(url, filename, model_name=None, options=None, chunk_seconds=TRANSCRIPTION_CHUNK_SECONDS, skip_if=None):
+    """
+    Download url to filename while transcribing it. Returns (result, audio_hash):
+    the stitched transcription result, in the same format as
+    transcription_engine.transcribe_file(), and the SHA-256 of the audio.
+
+    skip_if(audio_hash) is called when the download finishes; if it returns True
+    the transcription is abandoned and result is None.
+    """
+    import numpy as np
+
+    start_time = time.time()
+    stderr_file = tempfile.TemporaryFile()
+    decoder = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0', '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr_file
+    )
+    feed = _DecoderFeed(decoder)
+    download_error = []
+    audio_hash = []
+    skipped = threading.Event()
+
+    def download():
+        try:
+            audio_hash.append(download_episode(url, filename, on_chunk=feed))
+            logging.info(f"Streaming download finished after {time.time() - start_time:.2f} seconds")
+            if skip_if is not None and skip_if(audio_hash[0]):
+                skipped.set()
+                # Unblocks the reader, which stops at the end of the output
+                decoder.kill()
+        except Exception as e:
+            download_error.append(e)
+        finally:
+            feed.close()
+
+    download_thread = threading.Thread(target=download, name='streaming-download', daemon=True)
+    download_thread.start()
+
+    session = TranscriptionSession(model_name, options=options)
+    chunk_samples = int(chunk_seconds * SAMPLE_RATE)
+    # Enough audio to search for silence on both sides of the chunk boundary
+    ready_samples = chunk_samples + int(SILENCE_SEARCH_SECONDS * SAMPLE_RATE)
+    pending = []
+    pending_samples = 0
+    offset_samples = 0
+    leftover = b''
+
+    try:
+        while True:
+            data = decoder.stdout.read(PCM_READ_SIZE)
+            if not data or skipped.is_set():
+                break
+            data = leftover + data
+            # s16le samples are two bytes; keep an odd trailing byte for the next read
+            usable = len(data) - len(data) % 2
+            leftover = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+            pending.append(samples)
+            pending_samples += len(samples)
+
+            if pending_samples >= ready_samples:
+                buffer = np.concatenate(pending)
+                split = find_split_point(buffer, chunk_samples)
+                if not session.futures:
+                    logging.info(f"First chunk ready for transcription after {time.time() - start_time:.2f} seconds")
+                session.submit(offset_samples / SAMPLE_RATE, buffer[:split])
+                offset_samples += split
+                pending = [buffer[split:]]
+                pending_samples = len(pending[0])
+
+        decoder.wait()
+        download_thread.join()
+        if download_error:
+            raise download_error[0]
+
+        if skipped.is_set():
+            cancelled = session.cancel()
+            logging.info(f"Audio {audio_hash[0][:12]} needs no transcription, cancelled {cancelled} of {len(session.futures)} chunks")
+            return None, audio_hash[0]
+
+        if decoder.returncode != 0 or feed.broken:
+            stderr_file.seek(0)
+            logging.warning(f"Streaming decode failed ({stderr_file.read().decode(errors='replace').strip()}); transcribing the downloaded file instead")
+            # The chunks already submitted would compete with the full-file transcription for the pool
+            session.cancel()
+            return transcribe_file(filename, model_name, options=options, chunk_seconds=chunk_seconds), audio_hash[0]
+
+        if pending_samples:
+            session.submit(offset_samples / SAMPLE_RATE, np.concatenate(pending))
+
+        result = session.finish()
+        logging.info(f"Streaming download and transcription finished in {time.time() - start_time:.2f} seconds")
+        return result, audio_hash[0]
+    finally:
+        if decoder.poll() is None:
+            decoder.kill()
+        stderr_file.close()
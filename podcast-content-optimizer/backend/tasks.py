@@ -16,3 +16,23 @@ def process_podcast_task(rss_url, episode_index, job_id):
     except Exception as e:
         logging.error(f"Error in podcast processing task: {str(e)}")
         raise
+
+@shared_task(name='poll_auto_processed_feeds')
+def poll_auto_processed_feeds_task():
+    # Imported here: feed_poller imports rss_modifier, which imports this module
+    from feed_poller import due_feeds
+    try:
+        due = due_feeds()
+        for rss_url in due:
+            poll_feed_task.delay(rss_url)
+        if due:
+            logging.info(f"Queued polls for {len(due)} auto-processed feeds")
+    except Exception as e:
+        logging.error(f"Error scheduling feed polls: {str(e)}")
+        raise
+
+@shared_task(name='poll_feed')
+def poll_feed_task(rss_url):
+    from feed_poller import poll_feed
+    initialize_firebase()
+    return poll_feed(rss_url)
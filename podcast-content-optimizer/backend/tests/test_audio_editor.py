@@ -0,0 +1,42 @@
+import pytest
+
+from audio_editor import MIN_KEEP_SECONDS, build_select_filter, get_keep_intervals
+
+
+def cut(start, end):
+    return {'start_time': start, 'end_time': end}
+
+
+def test_keeps_the_audio_between_cuts():
+    assert get_keep_intervals([cut('00:00:10', '00:00:20'), cut('40', '50')], 60.0) == [(0.0, 10.0), (20.0, 40.0), (50.0, 60.0)]
+
+
+def test_cuts_are_sorted_and_overlapping_cuts_merged():
+    assert get_keep_intervals([cut(30, 45), cut(10, 20), cut(15, 35)], 60.0) == [(0.0, 10.0), (45.0, 60.0)]
+
+
+def test_cuts_closer_than_the_minimum_keep_are_merged():
+    gap = MIN_KEEP_SECONDS / 2
+    assert get_keep_intervals([cut(10, 20), cut(20 + gap, 30)], 60.0) == [(0.0, 10.0), (30.0, 60.0)]
+
+
+def test_cuts_are_clamped_to_the_episode():
+    assert get_keep_intervals([cut(-5, 10), cut(50, 90)], 60.0) == [(10.0, 50.0)]
+
+
+def test_slivers_at_either_end_are_not_kept():
+    assert get_keep_intervals([cut(MIN_KEEP_SECONDS / 2, 30), cut(30, 60 - MIN_KEEP_SECONDS / 2)], 60.0) == []
+
+
+def test_empty_and_inverted_cuts_are_ignored():
+    assert get_keep_intervals([cut(20, 20), cut(40, 30)], 60.0) == [(0.0, 60.0)]
+    assert get_keep_intervals([], 60.0) == [(0.0, 60.0)]
+
+
+def test_select_filter_keeps_each_interval_and_closes_the_gaps():
+    assert build_select_filter([(0.0, 10.0), (20.5, 60.0)]) == "aselect='between(t,0.000,10.000)+between(t,20.500,60.000)',asetpts=N/SR/TB"
+
+
+@pytest.mark.parametrize('duration', [0.0, MIN_KEEP_SECONDS / 2])
+def test_nothing_to_keep_in_a_too_short_episode(duration):
+    assert get_keep_intervals([], duration) == []
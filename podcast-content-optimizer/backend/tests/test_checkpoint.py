@@ -0,0 +1,27 @@
+import checkpoint
+from checkpoint import CheckpointWriter
+
+
+def test_failed_write_is_kept_for_the_next_flush(monkeypatch):
+    results = [False, True]
+    saved = []
+    monkeypatch.setattr(checkpoint, 'save_processed_podcast', lambda data: saved.append(dict(data)) or results.pop(0))
+    writer = CheckpointWriter({'episode_title': 'Episode'}, mode='stage')
+
+    writer.update({'status': 'downloaded'}, stage='DOWNLOAD')
+    assert writer.dirty and writer.pending_stages == ['DOWNLOAD']
+
+    assert writer.flush()
+    assert not writer.dirty and writer.writes == 1
+    assert saved[-1]['status'] == 'downloaded'
+
+
+def test_close_retries_the_final_write(monkeypatch):
+    results = [False, False, True]
+    monkeypatch.setattr(checkpoint, 'save_processed_podcast', lambda data: results.pop(0))
+    monkeypatch.setattr(checkpoint.time, 'sleep', lambda seconds: None)
+    writer = CheckpointWriter({'episode_title': 'Episode'}, mode='debounce', debounce_seconds=60)
+    writer.update({'status': 'transcribed'}, stage='TRANSCRIPTION')
+
+    assert writer.close()
+    assert results == [] and not writer.dirty
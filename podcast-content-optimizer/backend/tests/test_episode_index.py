@@ -0,0 +1,37 @@
+import episode_index
+import metadata_store
+from metadata_store import CachedBackend, MetadataStore, SQLiteBackend
+
+RSS_URL = 'https://example.com/feed.xml'
+
+
+def make_store(path):
+    return MetadataStore(CachedBackend(SQLiteBackend(path), ttl=60))
+
+
+def test_rebuilt_index_sees_other_processes_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_store, 'bump_state_version', lambda rss_url: None)
+    path = str(tmp_path / 'metadata.db')
+    reader, writer = make_store(path), make_store(path)
+    version = {'value': '1'}
+    monkeypatch.setattr(episode_index, 'get_state_version', lambda rss_url: version['value'])
+    monkeypatch.setattr(episode_index, 'get_metadata_store', lambda: reader)
+    monkeypatch.setattr(episode_index, '_indexes', {})
+
+    writer.save_episode({'rss_url': RSS_URL, 'episode_title': 'First', 'status': 'completed'})
+    assert episode_index.get_episode_index(RSS_URL).find(title='First')
+
+    # Another process writes and bumps the version; the reader's listing is still within its TTL
+    writer.save_episode({'rss_url': RSS_URL, 'episode_title': 'Second', 'status': 'completed'})
+    version['value'] = '2'
+    index = episode_index.get_episode_index(RSS_URL)
+    assert index.find(title='Second')
+    assert index.size == 2
+
+
+
+def test_enclosure_urls_keep_identifying_query_parameters():
+    normalize = episode_index.normalize_enclosure_url
+    assert normalize('https://host.example/download.aspx?id=1') != normalize('https://host.example/download.aspx?id=2')
+    assert normalize('https://Host.example/ep.mp3?utm_source=rss&id=7') == normalize('http://host.example/ep.mp3?id=7')
+    assert normalize('https://host.example/ep.mp3?utm_medium=rss') == 'host.example/ep.mp3'
@@ -0,0 +1,67 @@
+import feed_cache
+
+
+class FakeResponse:
+    status_code = 200
+    encoding = 'utf-8'
+
+    def __init__(self, body):
+        self.content = body
+        self.headers = {'ETag': '"v1"'}
+
+    def raise_for_status(self):
+        pass
+
+
+def test_stored_feed_is_served_without_revalidating(monkeypatch):
+    url = 'https://example.com/stored.xml'
+    requests_made = []
+    monkeypatch.setattr(feed_cache._session, 'get', lambda *args, **kwargs: requests_made.append(args) or FakeResponse(b'<rss/>'), raising=False)
+    monkeypatch.setattr(feed_cache, '_store', lambda url, snapshot: None)
+    monkeypatch.setattr(feed_cache, '_snapshots', {})
+    stored = {'body': b'<rss>old</rss>', 'etag': '"v0"', 'last_modified': None, 'encoding': 'utf-8', 'fetched_at': 0}
+    monkeypatch.setattr(feed_cache, '_load_stored', lambda url: dict(stored))
+
+    assert feed_cache.get_stored_feed(url).body == b'<rss>old</rss>'
+    assert requests_made == []
+
+
+def test_stored_feed_is_fetched_when_nothing_is_stored(monkeypatch):
+    url = 'https://example.com/new.xml'
+    requests_made = []
+    monkeypatch.setattr(feed_cache._session, 'get', lambda *args, **kwargs: requests_made.append(args) or FakeResponse(b'<rss/>'), raising=False)
+    monkeypatch.setattr(feed_cache, '_store', lambda url, snapshot: None)
+    monkeypatch.setattr(feed_cache, '_snapshots', {})
+    monkeypatch.setattr(feed_cache, '_load_stored', lambda url: None)
+
+    assert feed_cache.get_stored_feed(url).body == b'<rss/>'
+    assert len(requests_made) == 1
+
+
+def test_origin_errors_are_retried_after_a_delay(monkeypatch):
+    url = 'https://example.com/down.xml'
+    requests_made = []
+
+    def get(*args, **kwargs):
+        requests_made.append(args)
+        raise feed_cache.requests.ConnectionError('origin down')
+
+    stored = {'body': b'<rss>old</rss>', 'etag': '"v0"', 'last_modified': None, 'encoding': 'utf-8', 'fetched_at': 0}
+    monkeypatch.setattr(feed_cache._session, 'get', get, raising=False)
+    monkeypatch.setattr(feed_cache, '_touch', lambda url, fetched_at: stored.update(fetched_at=fetched_at))
+    monkeypatch.setattr(feed_cache, '_snapshots', {})
+    monkeypatch.setattr(feed_cache, '_load_stored', lambda url: dict(stored))
+    monkeypatch.setattr(feed_cache, 'FEED_ERROR_RETRY_SECONDS', 30)
+    now = 1_000_000
+    monkeypatch.setattr(feed_cache.time, 'time', lambda: now)
+
+    assert feed_cache.get_feed(url).body == b'<rss>old</rss>'
+    # The next requests are served the stored copy without hitting the origin
+    feed_cache._snapshots.clear()
+    now += 29
+    assert feed_cache.get_feed(url).body == b'<rss>old</rss>'
+    assert len(requests_made) == 1
+
+    now += 2
+    assert feed_cache.get_feed(url).body == b'<rss>old</rss>'
+    assert len(requests_made) == 2
@@ -0,0 +1,13 @@
+import feed_poller
+
+
+def test_route_and_poller_resolve_the_same_url_root(monkeypatch):
+    monkeypatch.setattr(feed_poller, 'PUBLIC_URL_ROOT', 'https://feeds.example.com/')
+    # The route passes the request's root, the poller none; both get the public one
+    assert feed_poller.resolve_url_root('http://10.0.0.5:5000/') == feed_poller.get_url_root('https://example.com/rss') == 'https://feeds.example.com'
+
+
+def test_url_root_falls_back_to_the_request_root(monkeypatch):
+    monkeypatch.setattr(feed_poller, 'PUBLIC_URL_ROOT', None)
+    assert feed_poller.resolve_url_root('http://localhost:5000/') == 'http://localhost:5000'
+    assert feed_poller.resolve_url_root(None) is None
@@ -0,0 +1,50 @@
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+
+from episode_index import ProcessedEpisodeIndex
+from feed_transform import FeedTransformHandler, transform_feed
+from rss_modifier import NAMESPACES, ModifiedFeedHandler
+
+ITUNES = NAMESPACES['itunes']
+
+
+def make_feed(items):
+    parts = [f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" xmlns:itunes="{ITUNES}"><channel><title>Show</title>']
+    for guid, pub_date in items:
+        parts.append(f'<item><title>{guid}</title><guid>{guid}</guid><pubDate>{pub_date}</pubDate>'
+                     f'<itunes:duration>60</itunes:duration><enclosure url="https://example.com/{guid}.mp3" type="audio/mpeg" /></item>')
+    parts.append('</channel></rss>')
+    return ''.join(parts).encode('utf-8')
+
+
+def run(feed, handler):
+    output = StringIO()
+    transform_feed(BytesIO(feed), output.write, handler, NAMESPACES)
+    return ET.fromstring(output.getvalue())
+
+
+def test_unchanged_transform_round_trips_the_feed():
+    feed = make_feed([('b', 'Tue, 02 Jan 2024 00:00:00 +0000'), ('a', 'Mon, 01 Jan 2024 00:00:00 +0000')])
+    root = run(feed, FeedTransformHandler())
+    expected = ET.fromstring(feed)
+    assert ET.tostring(root) == ET.tostring(expected)
+
+
+def test_items_keep_upstream_order_and_processed_items_appear_once():
+    # Upstream order isn't chronological; the modified feed doesn't re-sort it by pubDate
+    feed = make_feed([
+        ('old-2', 'Mon, 01 Jan 2024 00:00:00 +0000'),
+        ('done', 'Fri, 01 Mar 2024 00:00:00 +0000'),
+        ('old-1', 'Tue, 02 Jan 2024 00:00:00 +0000'),
+        ('new', 'Sat, 02 Mar 2024 00:00:00 +0000'),
+    ])
+    index = ProcessedEpisodeIndex([{'episode_guid': 'done', 'episode_title': 'done', 'status': 'completed', 'edited_url': 'https://cdn.example.com/done.mp3'}])
+    handler = ModifiedFeedHandler('https://example.com/rss', index, {}, datetime(2024, 2, 1, tzinfo=timezone.utc), 'https://app.example.com/api/modified_rss/x')
+
+    items = run(feed, handler).find('channel').findall('item')
+
+    # Processed items are rewritten in place, not appended again at the end; new ones are held back
+    assert [item.find('guid').text for item in items] == ['old-2', 'done_optimized', 'old-1']
+    assert items[1].find('enclosure').get('url') == 'https://cdn.example.com/done.mp3'
+    assert [title for title, _ in handler.episodes_to_process] == ['new']
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import llm_processor
+from llm_processor import detect_in_windows, merge_segments, split_artifact_windows, split_transcript_windows
+from transcript_artifact import load_transcript, write_transcript
+
+# 50 minutes of 10-second segments
+SEGMENTS = [{'start': float(t), 'end': float(t + 10), 'text': f"line {t}"} for t in range(0, 3000, 10)]
+
+
+def segment(start, end, text='ad'):
+    return {'start_time': start, 'end_time': end, 'description': text}
+
+
+def test_transcript_windows_overlap_and_cover_the_episode():
+    transcript = '\n'.join(f"{s['start']:.2f} - {s['end']:.2f}: {s['text']}" for s in SEGMENTS)
+
+    windows = split_transcript_windows(transcript, window_seconds=1200, overlap_seconds=120)
+
+    assert [(start, end) for start, end, _ in windows] == [(0.0, 1200.0), (1080.0, 2280.0), (2160.0, 3000.0)]
+    # The segment at the boundary is in both windows
+    assert '1080.00 - 1090.00: line 1080' in windows[0][2]
+    assert windows[1][2].startswith('1080.00 - 1090.00: line 1080')
+    assert windows[2][2].endswith('2990.00 - 3000.00: line 2990')
+
+
+def test_text_without_timestamps_is_one_window():
+    assert split_transcript_windows('just some text', window_seconds=1200, overlap_seconds=120) == [(0.0, 0.0, 'just some text')]
+
+
+def test_artifact_windows_match_the_text_windows(tmp_path):
+    path = str(tmp_path / 'transcript.pcot')
+    write_transcript(path, {'segments': SEGMENTS, 'language': 'en'}, block_seconds=120)
+    artifact = load_transcript(path)
+
+    windows = split_artifact_windows(artifact, window_seconds=1200, overlap_seconds=120)
+
+    assert windows == split_transcript_windows(artifact.text(), window_seconds=1200, overlap_seconds=120)
+
+
+def test_overlap_must_be_smaller_than_the_window():
+    with pytest.raises(ValueError):
+        split_transcript_windows('0.00 - 1.00: hi', window_seconds=60, overlap_seconds=60)
+
+
+def test_segment_split_across_windows_is_merged():
+    # Clipped at the first window's edge, seen whole by the second
+    first = segment(1150, 1200, 'clipped')
+    second = segment(1150, 1230, 'whole')
+
+    assert merge_segments([[first], [second]]) == [segment(1150, 1230, 'whole')]
+
+
+def test_separate_segments_are_not_merged():
+    # Back-to-back ads from one window, and ones from neighbouring windows that only touch
+    back_to_back = [segment(100, 160, 'first'), segment(160.5, 220, 'second')]
+    touching = [[segment(1000, 1100)], [segment(1100, 1150)]]
+
+    assert merge_segments([back_to_back]) == back_to_back
+    assert merge_segments(touching) == [segment(1000, 1100), segment(1100, 1150)]
+
+
+def test_failed_window_is_reported(monkeypatch):
+    def process_transcript(text, prompt=None):
+        if 'line 1200' in text:
+            raise RuntimeError('rate limited')
+        return json.dumps({'unwanted_content': [segment(100, 160)]})
+
+    monkeypatch.setattr(llm_processor, 'process_transcript', process_transcript)
+    transcript = '\n'.join(f"{s['start']:.2f} - {s['end']:.2f}: {s['text']}" for s in SEGMENTS)
+    windows = split_transcript_windows(transcript, window_seconds=1200, overlap_seconds=120)
+
+    response = detect_in_windows(windows)
+
+    assert response['windows'] == 3
+    assert response['failed_windows'] == 1
+    # Both windows that succeeded reported the same segment; it is kept once
+    assert response['unwanted_content'] == [segment(100, 160)]
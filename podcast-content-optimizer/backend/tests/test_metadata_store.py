@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import metadata_store
+from metadata_store import MetadataStore, SQLiteBackend
+
+INCREMENTS = 50
+
+
+def increment(current):
+    return {'count': (current or {}).get('count', 0) + 1}
+
+
+def test_sqlite_round_trip(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'metadata.db'))
+    backend.put('episodes/a/1.json', {'title': 'One'})
+    assert backend.get('episodes/a/1.json') == {'title': 'One'}
+    assert not backend.create('episodes/a/1.json', {'title': 'Other'})
+    assert backend.create('episodes/a/2.json', {'title': 'Two'})
+    assert [path for path, _ in backend.list('episodes/a/')] == ['episodes/a/1.json', 'episodes/a/2.json']
+    backend.delete('episodes/a/1.json')
+    assert backend.get('episodes/a/1.json') is None
+
+
+def test_sqlite_update_returns_current_when_fn_declines(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'metadata.db'))
+    assert backend.update('jobs/x.json', lambda current: None) is None
+    backend.put('jobs/x.json', {'status': 'done'})
+    assert backend.update('jobs/x.json', lambda current: None) == {'status': 'done'}
+
+
+def test_sqlite_concurrent_updates_lose_no_increment(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    # Threads sharing a backend, and separate connections as separate processes would have
+    backends = [SQLiteBackend(path)] * 4 + [SQLiteBackend(path) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+        futures = [executor.submit(backend.update, 'counter.json', increment) for backend in backends for _ in range(INCREMENTS)]
+        for future in futures:
+            future.result()
+    assert SQLiteBackend(path).get('counter.json') == {'count': len(backends) * INCREMENTS}
+
+
+def test_find_episodes_without_a_podcast_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_store, 'bump_state_version', lambda rss_url: None)
+    store = MetadataStore(SQLiteBackend(str(tmp_path / 'metadata.db')))
+    store.save_episode({'rss_url': 'https://a.example/rss', 'episode_title': 'Pilot', 'podcast_title': 'A'})
+    store.save_episode({'rss_url': 'https://b.example/rss', 'episode_title': 'Pilot ', 'podcast_title': 'B'})
+    store.save_episode({'rss_url': 'https://b.example/rss', 'episode_title': 'Other', 'podcast_title': 'B'})
+
+    assert store.list_podcasts() == []
+    assert sorted(ep['podcast_title'] for ep in store.find_episodes('Pilot')) == ['A', 'B']
@@ -0,0 +1,84 @@
+import pytest
+from mutagen.mp3 import MP3
+
+import mp3_frames
+from mp3_frames import BITRATES, FrameHeader, Mp3FormatError, cut_frames, scan_frames
+
+SAMPLE_RATE = 44100
+FRAMES_PER_SECOND = SAMPLE_RATE / 1152
+
+
+def frame(bitrate_kbps, padding=0):
+    """A silent MPEG-1 Layer III stereo frame at 44.1 kHz."""
+    header = bytes([0xFF, 0xFB, (BITRATES[1].index(bitrate_kbps) << 4) | (padding << 1), 0x00])
+    return header + bytes(FrameHeader(header).length - 4)
+
+
+def write_mp3(path, bitrates):
+    frames = [frame(bitrate, padding=i % 3 == 0) for i, bitrate in enumerate(bitrates)]
+    path.write_bytes(b''.join(frames))
+    return [len(f) for f in frames]
+
+
+def read_xing(path):
+    data = path.read_bytes()
+    header = FrameHeader(data[:4])
+    offset = 4 + header.side_info_size
+    tag = data[offset:offset + 4]
+    frame_count = int.from_bytes(data[offset + 8:offset + 12], 'big')
+    byte_count = int.from_bytes(data[offset + 12:offset + 16], 'big')
+    return tag, frame_count, byte_count, header.length
+
+
+@pytest.mark.parametrize('bitrates', [[128] * 400, [128, 192, 256, 96] * 100], ids=['cbr', 'vbr'])
+def test_scan_finds_every_frame(tmp_path, bitrates):
+    path = tmp_path / 'episode.mp3'
+    lengths = write_mp3(path, bitrates)
+    data = path.read_bytes()
+
+    header, offsets, found_lengths = scan_frames(data, 0, len(data))
+
+    assert header.sample_rate == SAMPLE_RATE
+    assert list(found_lengths) == lengths
+    assert offsets[-1] + found_lengths[-1] == len(data)
+
+
+@pytest.mark.parametrize('bitrates, tag', [([128] * 400, b'Info'), ([128, 192, 256, 96] * 100, b'Xing')], ids=['cbr', 'vbr'])
+def test_cut_keeps_the_frames_in_the_intervals(tmp_path, bitrates, tag):
+    source, edited = tmp_path / 'episode.mp3', tmp_path / 'edited.mp3'
+    lengths = write_mp3(source, bitrates)
+
+    cut_frames(str(source), str(edited), [(0.0, 2.0), (4.0, 6.0)])
+
+    # Each interval is snapped to whole frames
+    kept = [(round(start * FRAMES_PER_SECOND), round(end * FRAMES_PER_SECOND)) for start, end in [(0.0, 2.0), (4.0, 6.0)]]
+    kept_lengths = [length for first, last in kept for length in lengths[first:last]]
+    xing_tag, frame_count, byte_count, xing_length = read_xing(edited)
+    assert xing_tag == tag
+    assert frame_count == len(kept_lengths)
+    assert byte_count == sum(kept_lengths) + xing_length == edited.stat().st_size
+
+    data = edited.read_bytes()
+    _, _, found_lengths = scan_frames(data, 0, len(data))
+    assert list(found_lengths) == kept_lengths
+    assert MP3(str(edited)).info.length == pytest.approx(frame_count * 1152 / SAMPLE_RATE, abs=0.03)
+
+
+def test_cut_keeps_id3_tags(tmp_path):
+    source, edited = tmp_path / 'episode.mp3', tmp_path / 'edited.mp3'
+    write_mp3(source, [128] * 100)
+    id3 = b'ID3\x04\x00\x00\x00\x00\x00\x0a' + bytes(10)
+    source.write_bytes(id3 + source.read_bytes())
+
+    cut_frames(str(source), str(edited), [(0.5, 1.5)])
+
+    data = edited.read_bytes()
+    assert data.startswith(id3)
+    assert mp3_frames.id3v2_size(data[:10]) == len(id3)
+
+
+def test_cut_with_nothing_to_keep_fails(tmp_path):
+    source = tmp_path / 'episode.mp3'
+    write_mp3(source, [128] * 100)
+    with pytest.raises(Mp3FormatError):
+        cut_frames(str(source), str(tmp_path / 'edited.mp3'), [(50.0, 60.0)])
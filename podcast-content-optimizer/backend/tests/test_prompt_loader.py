@@ -0,0 +1,36 @@
+import prompt_loader
+from metadata_store import CachedBackend, MetadataStore, SQLiteBackend
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = str(value).encode('utf-8')
+
+
+def test_edit_in_another_process_is_seen_on_the_next_load(tmp_path, monkeypatch):
+    path = str(tmp_path / 'metadata.db')
+    worker_store = MetadataStore(CachedBackend(SQLiteBackend(path), ttl=60))
+    app_store = MetadataStore(CachedBackend(SQLiteBackend(path), ttl=60))
+    monkeypatch.setattr(prompt_loader, 'redis_client', FakeRedis())
+    monkeypatch.setattr(prompt_loader, '_prompt_cache', {})
+
+    monkeypatch.setattr(prompt_loader, 'get_metadata_store', lambda: app_store)
+    prompt_loader.save_prompt('gemini', 'first')
+
+    monkeypatch.setattr(prompt_loader, 'get_metadata_store', lambda: worker_store)
+    prompt_loader.invalidate_prompt_cache()
+    assert prompt_loader.load_prompt('gemini') == 'first'
+
+    # The app saves an edit; the worker's caches both still hold the first version
+    worker_cache = dict(prompt_loader._prompt_cache)
+    monkeypatch.setattr(prompt_loader, 'get_metadata_store', lambda: app_store)
+    prompt_loader.save_prompt('gemini', 'second')
+    monkeypatch.setattr(prompt_loader, '_prompt_cache', worker_cache)
+    monkeypatch.setattr(prompt_loader, 'get_metadata_store', lambda: worker_store)
+    assert prompt_loader.load_prompt('gemini') == 'second'
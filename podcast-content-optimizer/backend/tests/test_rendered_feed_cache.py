@@ -0,0 +1,57 @@
+import rendered_feed_cache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.results = []
+
+    def get(self, key):
+        self.results.append(self.redis.values.get(key))
+
+    def ttl(self, key):
+        self.results.append(60 if key in self.redis.values else -2)
+
+    def execute(self):
+        return self.results
+
+
+def test_memory_entries_expire(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(rendered_feed_cache, 'redis_client', redis)
+    monkeypatch.setattr(rendered_feed_cache, '_memory', rendered_feed_cache.OrderedDict())
+    now = [1000.0]
+    monkeypatch.setattr(rendered_feed_cache.time, 'monotonic', lambda: now[0])
+
+    etag = rendered_feed_cache.save_rendered_feed('key', '<rss/>')
+    assert rendered_feed_cache.get_rendered_feed('key') == ('<rss/>', etag)
+
+    # Gone from Redis and past its TTL in memory: a miss, not a forever-served copy
+    redis.values.clear()
+    now[0] += rendered_feed_cache.RENDERED_FEED_TTL + 1
+    assert rendered_feed_cache.get_rendered_feed('key') == (None, None)
+    assert 'key' not in rendered_feed_cache._memory
+
+
+def test_etag_follows_the_content_not_the_key(monkeypatch):
+    monkeypatch.setattr(rendered_feed_cache, 'redis_client', FakeRedis())
+    monkeypatch.setattr(rendered_feed_cache, '_memory', rendered_feed_cache.OrderedDict())
+
+    # Same key re-rendered after a lock expired without moving the state version
+    hidden = rendered_feed_cache.save_rendered_feed('key', '<rss><channel/></rss>')
+    shown = rendered_feed_cache.save_rendered_feed('key', '<rss><channel><item/></channel></rss>')
+    assert hidden != shown
+    # Loaded back from Redis, the ETag is the same as when it was saved
+    rendered_feed_cache._memory.clear()
+    assert rendered_feed_cache.get_rendered_feed('key')[1] == shown
@@ -0,0 +1,176 @@
+import hashlib
+import shutil
+import threading
+import wave
+
+import numpy as np
+import pytest
+
+import streaming_ingest
+import transcription_engine
+import whisper_registry
+from transcription_engine import SAMPLE_RATE
+
+EPISODE_SECONDS = 11.5 * 60
+
+
+def synthetic_episode(seconds=EPISODE_SECONDS):
+    """A tone with a short pause every 7 minutes, as 16 kHz mono int16 samples."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.3 * np.sin(2 * np.pi * 440 * t)
+    for pause in range(420, int(seconds), 420):
+        audio[pause * SAMPLE_RATE:(pause + 1) * SAMPLE_RATE] = 0
+    return (audio * 32767).astype(np.int16)
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, samples, **options):
+        self.calls.append((len(samples), threading.current_thread().name))
+        duration = len(samples) / SAMPLE_RATE
+        return {'text': ' chunk', 'segments': [{'start': 0.0, 'end': duration, 'text': ' chunk'}], 'language': 'en'}
+
+
+class FakeDecoder:
+    """Stands in for ffmpeg: swallows the input and outputs the given PCM."""
+
+    def __init__(self, pcm):
+        import io
+        self.stdin = io.BytesIO()
+        self.stdout = io.BytesIO(pcm)
+        self.returncode = None
+
+    def wait(self):
+        self.returncode = 0
+        return 0
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class StalledDecoder(FakeDecoder):
+    """Outputs the given PCM, then blocks like a decoder still waiting for input until killed."""
+
+    def __init__(self, pcm):
+        super().__init__(pcm)
+        self.pcm = pcm
+        self.killed = threading.Event()
+        self.stdout = self
+
+    def read(self, size):
+        data, self.pcm = self.pcm[:size], self.pcm[size:]
+        if data:
+            return data
+        self.killed.wait(10)
+        return b''
+
+    def kill(self):
+        super().kill()
+        self.killed.set()
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(whisper_registry, 'get_model', lambda name=None: model)
+    # One worker: chunks are transcribed in this process, on the session's own thread
+    monkeypatch.setattr(transcription_engine, 'TRANSCRIPTION_WORKERS', 1)
+    return model
+
+
+def fake_download(source):
+    def download_episode(url, filename, on_chunk=None):
+        sha256 = hashlib.sha256()
+        with open(source, 'rb') as f, open(filename, 'wb') as out:
+            for block in iter(lambda: f.read(8192), b''):
+                sha256.update(block)
+                out.write(block)
+                if on_chunk is not None:
+                    on_chunk(block)
+        return sha256.hexdigest()
+    return download_episode
+
+
+def check_result(result, model):
+    # 11.5 minutes is one 10-minute chunk cut near its boundary plus the rest
+    assert len(model.calls) == 2
+    assert sum(n for n, _ in model.calls) == int(EPISODE_SECONDS * SAMPLE_RATE)
+    first, second = result['segments']
+    assert abs(first['end'] - 600) <= transcription_engine.SILENCE_SEARCH_SECONDS
+    assert second['start'] == pytest.approx(first['end'])
+    assert second['end'] == pytest.approx(EPISODE_SECONDS)
+
+
+def test_streams_episode_longer_than_one_chunk(tmp_path, monkeypatch, model):
+    pcm = synthetic_episode()
+    source = tmp_path / 'source.raw'
+    source.write_bytes(pcm.tobytes())
+    monkeypatch.setattr(streaming_ingest, 'download_episode', fake_download(source))
+    monkeypatch.setattr(streaming_ingest.subprocess, 'Popen', lambda *args, **kwargs: FakeDecoder(pcm.tobytes()))
+
+    result, audio_hash = streaming_ingest.download_and_transcribe('http://example.com/episode.mp3', str(tmp_path / 'episode.mp3'))
+
+    check_result(result, model)
+    assert audio_hash == hashlib.sha256(pcm.tobytes()).hexdigest()
+    # Transcription never runs on the thread that reads the decoder's output
+    assert all(name != threading.current_thread().name for _, name in model.calls)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_streams_wav_through_ffmpeg(tmp_path, monkeypatch, model):
+    source = tmp_path / 'source.wav'
+    with wave.open(str(source), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(synthetic_episode().tobytes())
+    monkeypatch.setattr(streaming_ingest, 'download_episode', fake_download(source))
+
+    result, _ = streaming_ingest.download_and_transcribe('http://example.com/episode.wav', str(tmp_path / 'episode.wav'))
+
+    check_result(result, model)
+
+
+def test_stops_transcribing_when_the_audio_is_already_cached(tmp_path, monkeypatch, model):
+    pcm = synthetic_episode()
+    source = tmp_path / 'source.raw'
+    source.write_bytes(pcm.tobytes())
+    checked = []
+    monkeypatch.setattr(streaming_ingest, 'download_episode', fake_download(source))
+    # The decoder has produced less than a chunk when the download finishes
+    monkeypatch.setattr(streaming_ingest.subprocess, 'Popen', lambda *args, **kwargs: StalledDecoder(pcm[:SAMPLE_RATE * 60].tobytes()))
+
+    result, audio_hash = streaming_ingest.download_and_transcribe(
+        'http://example.com/episode.mp3', str(tmp_path / 'episode.mp3'), skip_if=lambda audio_hash: checked.append(audio_hash) or True
+    )
+
+    assert result is None
+    assert audio_hash == checked[0] == hashlib.sha256(pcm.tobytes()).hexdigest()
+    assert model.calls == []
+
+
+class FailingDecoder(FakeDecoder):
+    def wait(self):
+        self.returncode = 1
+        return 1
+
+
+def test_cancels_submitted_chunks_before_falling_back_to_the_file(tmp_path, monkeypatch, model):
+    pcm = synthetic_episode()
+    source = tmp_path / 'source.raw'
+    source.write_bytes(pcm.tobytes())
+    cancelled = []
+    monkeypatch.setattr(streaming_ingest, 'download_episode', fake_download(source))
+    monkeypatch.setattr(streaming_ingest.subprocess, 'Popen', lambda *args, **kwargs: FailingDecoder(pcm.tobytes()))
+    monkeypatch.setattr(transcription_engine.TranscriptionSession, 'cancel', lambda session: cancelled.append(session) or 0)
+    monkeypatch.setattr(streaming_ingest, 'transcribe_file', lambda *args, **kwargs: (cancelled and {'segments': []}))
+
+    result, _ = streaming_ingest.download_and_transcribe('http://example.com/episode.mp3', str(tmp_path / 'episode.mp3'))
+
+    # The session was cancelled before the file transcription started
+    assert result == {'segments': []}
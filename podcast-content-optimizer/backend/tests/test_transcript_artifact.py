@@ -0,0 +1,64 @@
+import hashlib
+
+import pytest
+
+from transcript_artifact import MAGIC, format_segment_line, is_transcript_artifact, load_transcript, write_transcript
+
+RESULT = {
+    'language': 'en',
+    'segments': [
+        {'start': 0.0, 'end': 4.5, 'text': ' Welcome back.', 'words': [
+            {'start': 0.0, 'end': 1.2, 'word': ' Welcome', 'probability': 0.98},
+            {'start': 1.2, 'end': 4.5, 'word': ' back.', 'probability': 0.91},
+        ]},
+        {'start': 118.0, 'end': 125.25, 'text': ' A segment running past its block.'},
+        {'start': 130.0, 'end': 131.0, 'text': ''},
+        {'start': 250.125, 'end': 260.0, 'text': ' Last one.'},
+    ]
+}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'transcript.pcot')
+    header = write_transcript(path, RESULT, {'model': 'base'}, block_seconds=120)
+    artifact = load_transcript(path)
+
+    assert is_transcript_artifact(path)
+    assert open(path, 'rb').read(4) == MAGIC
+    assert artifact.header == header
+    assert artifact.metadata == {'model': 'base', 'language': 'en'}
+    assert artifact.duration == 260.0
+    assert [block['segments'] for block in header['blocks']] == [2, 1, 1]
+    assert artifact.segments() == RESULT['segments']
+    assert artifact.text_sha256 == hashlib.sha256(artifact.text().encode('utf-8')).hexdigest()
+
+
+def test_time_range_reads(tmp_path):
+    path = str(tmp_path / 'transcript.pcot')
+    write_transcript(path, RESULT, block_seconds=120)
+    artifact = load_transcript(path)
+
+    # The second segment starts in the first block but overlaps the range
+    assert [s['start'] for s in artifact.segments(121, 200)] == [118.0, 130.0]
+    assert artifact.text(250, None) == format_segment_line(RESULT['segments'][3])
+    assert artifact.segments(300, 400) == []
+
+
+def test_empty_transcript(tmp_path):
+    path = str(tmp_path / 'transcript.pcot')
+    header = write_transcript(path, {'segments': [], 'language': None})
+    artifact = load_transcript(path)
+
+    assert header['segment_count'] == 0
+    assert header['blocks'] == []
+    assert artifact.duration == 0.0
+    assert artifact.segments() == []
+    assert artifact.text() == ''
+    assert artifact.text_sha256 == hashlib.sha256(b'').hexdigest()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'transcript.pcot'
+    path.write_bytes(b'RIFF' + bytes(16))
+    with pytest.raises(ValueError):
+        load_transcript(str(path))
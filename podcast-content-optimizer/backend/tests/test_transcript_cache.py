@@ -0,0 +1,19 @@
+import os
+
+import transcript_cache
+
+
+def test_local_cache_keeps_the_most_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_cache, 'TRANSCRIPT_CACHE_DIR', str(tmp_path))
+    paths = []
+    for i, key in enumerate(['aa1', 'bb2', 'cc3']):
+        transcript_cache._write_local(key, b'x' * 1024)
+        path = transcript_cache._local_path(key)
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(path)
+    # The oldest entry was used since, so the second one is the least recently used
+    os.utime(paths[0], (2000, 2000))
+
+    transcript_cache.prune_local_cache(max_mb=2.5 / 1024)
+
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
@@ -0,0 +1,22 @@
+import transcription_engine
+import whisper_registry
+
+
+class FakeModel:
+    def transcribe(self, samples, **options):
+        return {'text': ' chunk', 'segments': [{'start': 0.0, 'end': 1.0, 'text': ' chunk'}], 'language': 'en'}
+
+
+def test_pool_worker_recycles_its_own_model_past_the_memory_limit(monkeypatch):
+    loads = []
+    monkeypatch.setattr(transcription_engine, '_worker_model_name', 'tiny')
+    monkeypatch.setattr(whisper_registry, '_models', {'tiny': FakeModel()})
+    monkeypatch.setattr(whisper_registry, 'get_model', lambda name=None: whisper_registry._models.get(name) or loads.append(name) or FakeModel())
+    monkeypatch.setattr(whisper_registry, 'WHISPER_RECYCLE_MEMORY_MB', 100)
+    monkeypatch.setattr(whisper_registry, 'get_resident_memory_mb', lambda: 150)
+
+    result = transcription_engine._transcribe_chunk(30.0, [0.0] * 16000, {})
+
+    assert result['segments'][0]['start'] == 30.0
+    # The worker's model was dropped and loaded again, not the default one
+    assert loads == ['tiny']
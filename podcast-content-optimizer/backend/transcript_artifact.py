@@ -0,0 +1,158 @@
+"""
+Structured transcript artifact.
+
+Stores the transcription's segments with float timestamps, optional word
+timings and metadata about how it was produced. The layout is built so that
+one time range can be read without touching the rest of the file:
+
+    b'PCOT' | format version (1 byte) | header length (4 bytes, big-endian)
+    | JSON header | zlib-compressed blocks
+
+The header holds the metadata and an index of the blocks. Each block holds
+BLOCK_SECONDS of segments as zlib-compressed JSON. Reading a time range only
+decompresses the blocks that overlap it, and the "start - end: text" view the
+pipeline used to write to transcript.txt is generated from the segments.
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+MAGIC = b'PCOT'
+FORMAT_VERSION = 1
+ARTIFACT_EXTENSION = '.pcot'
+BLOCK_SECONDS = float(os.getenv("TRANSCRIPT_BLOCK_SECONDS", "120"))
+_PREAMBLE = struct.Struct('>4sBI')
+
+
+def format_segment_line(segment):
+    return f"{segment['start']:.2f} - {segment['end']:.2f}: {segment['text']}"
+
+
+def _compact_segment(segment):
+    compact = {
+        'start': round(float(segment['start']), 3),
+        'end': round(float(segment['end']), 3),
+        'text': segment['text']
+    }
+    if segment.get('words'):
+        # [start, end, word, probability] is much smaller than a dict per word
+        compact['words'] = [
+            [round(float(w['start']), 3), round(float(w['end']), 3), w['word'], round(float(w.get('probability', 0)), 3)]
+            for w in segment['words']
+        ]
+    return compact
+
+
+def _expand_segment(compact):
+    segment = dict(compact)
+    if 'words' in segment:
+        segment['words'] = [{'start': s, 'end': e, 'word': w, 'probability': p} for s, e, w, p in segment['words']]
+    return segment
+
+
+def write_transcript(path, result, metadata=None, block_seconds=BLOCK_SECONDS):
+    """Write a model.transcribe()-style result to path. Returns the header."""
+    segments = [_compact_segment(s) for s in result.get('segments', [])]
+
+    blocks = []
+    for segment in segments:
+        block_index = int(segment['start'] // block_seconds)
+        if not blocks or blocks[-1][0] != block_index:
+            blocks.append((block_index, []))
+        blocks[-1][1].append(segment)
+
+    index = []
+    payloads = []
+    offset = 0
+    for _, block_segments in blocks:
+        payload = zlib.compress(json.dumps(block_segments, separators=(',', ':')).encode('utf-8'), 9)
+        index.append({
+            'start': block_segments[0]['start'],
+            # A segment may run past its block's nominal end, so record the real extent
+            'end': max(s['end'] for s in block_segments),
+            'offset': offset,
+            'length': len(payload),
+            'segments': len(block_segments)
+        })
+        payloads.append(payload)
+        offset += len(payload)
+
+    text = '\n'.join(format_segment_line(s) for s in segments)
+    header = {
+        'metadata': dict(metadata or {}, language=result.get('language')),
+        'duration': max((s['end'] for s in segments), default=0.0),
+        'segment_count': len(segments),
+        'has_words': any('words' in s for s in segments),
+        # Lets callers key caches on the transcript without decompressing it
+        'text_sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'block_seconds': block_seconds,
+        'blocks': index
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, path)
+    return header
+
+
+class TranscriptArtifact:
+    """Read access to a transcript artifact; only the blocks a call needs are read and decompressed."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not a transcript artifact: {path}")
+            if version > FORMAT_VERSION:
+                raise ValueError(f"Unsupported transcript artifact version {version}: {path}")
+            self.header = json.loads(f.read(header_length))
+        self.data_offset = _PREAMBLE.size + header_length
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    @property
+    def duration(self):
+        return self.header['duration']
+
+    @property
+    def text_sha256(self):
+        return self.header['text_sha256']
+
+    def segments(self, start=None, end=None):
+        """Segments overlapping [start, end), in order; None means the start or end of the episode."""
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        selected = []
+        with open(self.path, 'rb') as f:
+            for block in self.header['blocks']:
+                if block['end'] <= start or block['start'] >= end:
+                    continue
+                f.seek(self.data_offset + block['offset'])
+                for segment in json.loads(zlib.decompress(f.read(block['length']))):
+                    if segment['end'] > start and segment['start'] < end:
+                        selected.append(_expand_segment(segment))
+        return selected
+
+    def text(self, start=None, end=None):
+        """The "start - end: text" view of the segments overlapping [start, end)."""
+        return '\n'.join(format_segment_line(s) for s in self.segments(start, end))
+
+
+def load_transcript(path):
+    return TranscriptArtifact(path)
+
+
+def is_transcript_artifact(path):
+    return path.endswith(ARTIFACT_EXTENSION)
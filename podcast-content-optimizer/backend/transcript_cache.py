@@ -0,0 +1,130 @@
+"""
+Content-addressed transcript cache.
+
+Transcripts are keyed by the SHA-256 of the downloaded audio plus the model
+name and transcription options, so the same audio is never transcribed twice
+with the same settings: not after a retry, not when an episode is re-run, and
+not when it shows up in a second feed. Entries live on local disk and in
+Firebase Storage; a small Redis index remembers which hash an enclosure URL
+produced so the pipeline can check the cache before downloading.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from firebase_admin import storage
+from cache import cache_get, cache_set
+
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join('cache', 'transcripts'))
+TRANSCRIPT_CACHE_PREFIX = 'transcript_cache/'
+# Least recently used local entries are removed past this size; Firebase Storage keeps them all
+TRANSCRIPT_CACHE_MAX_MB = float(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "512"))
+URL_INDEX_TTL = 30 * 24 * 3600
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def cache_key(audio_hash, model_name, options=None):
+    key_data = json.dumps({'audio': audio_hash, 'model': model_name, 'options': options or {}}, sort_keys=True)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+def _local_path(key):
+    return os.path.join(TRANSCRIPT_CACHE_DIR, key[:2], f"{key}.json.gz")
+
+
+def _write_local(key, payload):
+    path = _local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so a crash never leaves a truncated entry behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    prune_local_cache()
+
+
+def prune_local_cache(max_mb=None):
+    """Remove the least recently used local entries until the cache fits in max_mb."""
+    max_bytes = (TRANSCRIPT_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    entries = []
+    for root, _, files in os.walk(TRANSCRIPT_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def get_cached_transcript(audio_hash, model_name, options=None):
+    """Return the cached transcription result, or None on a miss."""
+    key = cache_key(audio_hash, model_name, options)
+    path = _local_path(key)
+    try:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                result = json.loads(gzip.decompress(f.read()))
+            # Hits count as use, so pruning removes the entries that haven't been needed longest
+            os.utime(path)
+            logging.info(f"Transcript cache hit (local) for audio {audio_hash[:12]}")
+            return result
+
+        blob = storage.bucket().blob(f"{TRANSCRIPT_CACHE_PREFIX}{key}.json.gz")
+        if blob.exists():
+            payload = blob.download_as_bytes()
+            result = json.loads(gzip.decompress(payload))
+            _write_local(key, payload)
+            logging.info(f"Transcript cache hit (storage) for audio {audio_hash[:12]}")
+            return result
+    except Exception as e:
+        logging.error(f"Error reading transcript cache: {str(e)}")
+
+    logging.info(f"Transcript cache miss for audio {audio_hash[:12]}")
+    return None
+
+
+def save_cached_transcript(audio_hash, model_name, options, result):
+    key = cache_key(audio_hash, model_name, options)
+    payload = gzip.compress(json.dumps(result).encode('utf-8'))
+    try:
+        _write_local(key, payload)
+        blob = storage.bucket().blob(f"{TRANSCRIPT_CACHE_PREFIX}{key}.json.gz")
+        blob.upload_from_string(payload, content_type='application/gzip')
+        logging.info(f"Saved transcript to cache for audio {audio_hash[:12]}")
+    except Exception as e:
+        logging.error(f"Error writing transcript cache: {str(e)}")
+
+
+def remember_audio_hash(url, audio_hash):
+    try:
+        cache_set(f"audio_hash:{url}", audio_hash, URL_INDEX_TTL)
+    except Exception as e:
+        logging.error(f"Error saving audio hash for {url}: {str(e)}")
+
+
+def lookup_audio_hash(url):
+    try:
+        return cache_get(f"audio_hash:{url}")
+    except Exception as e:
+        logging.error(f"Error looking up audio hash for {url}: {str(e)}")
+        return None
@@ -0,0 +1,274 @@
+"""
+Chunked, multi-process Whisper transcription.
+
+The decoded episode is split into chunks at quiet points near every
+TRANSCRIPTION_CHUNK_SECONDS, the chunks are transcribed in a process pool,
+and the segments are stitched back together with global start/end times, in
+the same format model.transcribe() returns.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import whisper_registry
+
+SAMPLE_RATE = 16000  # whisper.audio.SAMPLE_RATE
+TRANSCRIPTION_CHUNK_SECONDS = float(os.getenv("TRANSCRIPTION_CHUNK_SECONDS", "600"))
+# How far around each target boundary to look for silence
+SILENCE_SEARCH_SECONDS = float(os.getenv("SILENCE_SEARCH_SECONDS", "30"))
+SILENCE_FRAME_SECONDS = 0.1
+
+
+def default_worker_count():
+    configured = int(os.getenv("TRANSCRIPTION_WORKERS", "0"))
+    if configured > 0:
+        return configured
+    if (whisper_registry.WHISPER_DEVICE or '').startswith('cuda'):
+        # Several processes on one GPU just fight over it
+        return 1
+    # Each worker runs torch with at least two threads
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+TRANSCRIPTION_WORKERS = default_worker_count()
+
+
+def get_cache_options(options=None):
+    """Everything besides the audio and model name that changes the transcription output."""
+    return dict(options or {}, chunk_seconds=TRANSCRIPTION_CHUNK_SECONDS)
+
+
+def find_split_point(audio, target, search_seconds=SILENCE_SEARCH_SECONDS, previous=0):
+    """Return the sample offset of the quietest frame within search_seconds of target (and after previous)."""
+    import numpy as np
+
+    frame = int(SILENCE_FRAME_SECONDS * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+    window_start = max(target - search, previous + frame)
+    window_end = min(target + search, len(audio))
+    n_frames = (window_end - window_start) // frame
+    if n_frames <= 0:
+        return target
+    window = audio[window_start:window_start + n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(np.square(window), axis=1))
+    return window_start + int(np.argmin(energy)) * frame + frame // 2
+
+
+def find_split_points(audio, chunk_seconds=TRANSCRIPTION_CHUNK_SECONDS, search_seconds=SILENCE_SEARCH_SECONDS):
+    """Return sample offsets to split at: the quietest frame within search_seconds of each chunk boundary."""
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+
+    split_points = []
+    target = chunk
+    while target < len(audio) - chunk // 4:
+        split = find_split_point(audio, target, search_seconds, split_points[-1] if split_points else 0)
+        split_points.append(split)
+        target = split + chunk
+    return split_points
+
+
+def split_audio(audio, chunk_seconds=TRANSCRIPTION_CHUNK_SECONDS):
+    """Split decoded audio into [(offset_seconds, samples), ...] at silence boundaries."""
+    bounds = [0] + find_split_points(audio, chunk_seconds) + [len(audio)]
+    return [(start / SAMPLE_RATE, audio[start:end]) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def shift_result(result, offset_seconds):
+    """Move a chunk's segment (and word) timestamps onto the episode timeline."""
+    for segment in result.get('segments', []):
+        segment['start'] += offset_seconds
+        segment['end'] += offset_seconds
+        if 'seek' in segment:
+            segment['seek'] += int(offset_seconds * 100)
+        for word in segment.get('words', []):
+            word['start'] += offset_seconds
+            word['end'] += offset_seconds
+    return result
+
+
+def stitch_results(results):
+    """Merge chunk results, already ordered by offset, into one model.transcribe()-style result."""
+    segments = []
+    for result in results:
+        for segment in result.get('segments', []):
+            segment['id'] = len(segments)
+            segments.append(segment)
+    return {
+        'text': ''.join(result.get('text', '') for result in results),
+        'segments': segments,
+        'language': next((r['language'] for r in results if r.get('language')), None)
+    }
+
+
+# Pool worker side
+
+_worker_model_name = None
+
+
+def _init_worker(model_name, torch_threads):
+    global _worker_model_name
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_model_name = model_name
+    whisper_registry.preload(model_name)
+
+
+def _transcribe_chunk(offset_seconds, samples, options):
+    model = whisper_registry.get_model(_worker_model_name)
+    start_time = time.time()
+    result = model.transcribe(samples, **options)
+    logging.info(f"Transcribed chunk at {offset_seconds:.2f}s ({len(samples) / SAMPLE_RATE:.0f}s of audio) in {time.time() - start_time:.2f} seconds")
+    # Memory grows in the workers, which outlive any one task, so each checks its own
+    whisper_registry.recycle_if_needed(_worker_model_name)
+    return shift_result(result, offset_seconds)
+
+
+# Caller side
+
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(model_name, workers):
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is None or _pool_key != (model_name, workers):
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            torch_threads = max(1, (os.cpu_count() or 1) // workers)
+            # spawn: forking a process that already imported torch is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(model_name, torch_threads)
+            )
+            _pool_key = (model_name, workers)
+            logging.info(f"Started transcription pool with {workers} workers ({torch_threads} torch threads each)")
+        return _pool
+
+
+def _reset_pool():
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool, _pool_key = None, None
+
+
+atexit.register(_reset_pool)
+
+
+def can_use_process_pool():
+    # Daemonic processes (e.g. Celery prefork children) may not start children
+    return not multiprocessing.current_process().daemon
+
+
+def uses_process_pool(workers=None):
+    """Whether transcriptions started in this process run in the pool rather than in this process' model."""
+    return (workers or TRANSCRIPTION_WORKERS) > 1 and can_use_process_pool()
+
+
+class TranscriptionSession:
+    """
+    Collects chunks as they become available and transcribes them in the
+    shared process pool. Call submit() for each chunk in order, then finish().
+    """
+
+    def __init__(self, model_name=None, workers=None, options=None):
+        self.model_name = model_name or whisper_registry.WHISPER_MODEL
+        self.workers = workers or TRANSCRIPTION_WORKERS
+        self.options = options or {}
+        self.futures = []
+        self.parallel = uses_process_pool(self.workers)
+        if self.workers > 1 and not self.parallel:
+            logging.warning("Running in a daemonic process, transcribing chunks sequentially")
+        # Sequential chunks still run off the caller's thread, so submit() never blocks
+        # a caller that is reading a stream (e.g. ffmpeg's output during streaming ingest)
+        self._sequential = None if self.parallel else ThreadPoolExecutor(max_workers=1, thread_name_prefix='transcription')
+
+    def submit(self, offset_seconds, samples):
+        if self.parallel:
+            pool = _get_pool(self.model_name, self.workers)
+            self.futures.append(pool.submit(_transcribe_chunk, offset_seconds, samples, self.options))
+        else:
+            self.futures.append(self._sequential.submit(self._transcribe_here, offset_seconds, samples))
+
+    def _transcribe_here(self, offset_seconds, samples):
+        model = whisper_registry.get_model(self.model_name)
+        with whisper_registry.get_model_lock(self.model_name):
+            result = model.transcribe(samples, **self.options)
+        return shift_result(result, offset_seconds)
+
+    def cancel(self):
+        """Drop the chunks that haven't started. Returns how many were cancelled."""
+        cancelled = sum(1 for f in self.futures if f.cancel())
+        if self._sequential is not None:
+            self._sequential.shutdown(wait=False, cancel_futures=True)
+        return cancelled
+
+    def finish(self):
+        try:
+            results = [f.result() for f in self.futures]
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); start a fresh pool next time
+            _reset_pool()
+            raise
+        finally:
+            if self._sequential is not None:
+                self._sequential.shutdown(wait=False, cancel_futures=True)
+        return stitch_results(results)
+
+
+def transcribe_file(audio_path, model_name=None, workers=None, chunk_seconds=TRANSCRIPTION_CHUNK_SECONDS, options=None):
+    import whisper
+
+    start_time = time.time()
+    audio = whisper.load_audio(audio_path)
+    duration = len(audio) / SAMPLE_RATE
+    chunks = split_audio(audio, chunk_seconds)
+    del audio
+
+    session = TranscriptionSession(model_name, workers, options)
+    logging.info(f"Transcribing {duration:.0f}s of audio in {len(chunks)} chunks ({'parallel' if session.parallel else 'sequential'})")
+    for offset_seconds, samples in chunks:
+        session.submit(offset_seconds, samples)
+    result = session.finish()
+    logging.info(f"Transcription of {duration:.0f}s of audio finished in {time.time() - start_time:.2f} seconds")
+    return result
+
+
+if __name__ == '__main__':
+    # Benchmark: python transcription_engine.py episode.mp3 --workers 1,2,4
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Compare transcription wall-clock time across worker counts")
+    parser.add_argument('audio_path')
+    parser.add_argument('--workers', default=f"1,{TRANSCRIPTION_WORKERS}")
+    parser.add_argument('--model', default=whisper_registry.WHISPER_MODEL)
+    parser.add_argument('--chunk-seconds', type=float, default=TRANSCRIPTION_CHUNK_SECONDS)
+    args = parser.parse_args()
+
+    timings = {}
+    for workers in sorted({int(w) for w in args.workers.split(',')}):
+        # Warm the pool first so model loading isn't part of the measurement
+        if workers > 1:
+            _get_pool(args.model, workers).submit(whisper_registry.preload, args.model).result()
+        else:
+            whisper_registry.preload(args.model)
+        start = time.time()
+        result = transcribe_file(args.audio_path, args.model, workers, args.chunk_seconds)
+        timings[workers] = time.time() - start
+        print(f"workers={workers}: {timings[workers]:.1f}s, {len(result['segments'])} segments")
+
+    baseline = timings[min(timings)]
+    print(f"cpu_count={os.cpu_count()}")
+    for workers, elapsed in timings.items():
+        print(f"workers={workers}: speedup {baseline / elapsed:.2f}x")
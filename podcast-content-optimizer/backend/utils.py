@@ -7,6 +7,7 @@ import time
 import sys
 from mutagen.mp3 import MP3
 import json
+import hashlib
 import os
 import urllib.parse
 import re
@@ -15,6 +16,9 @@ from firebase_admin import credentials, storage
 import redis
 from datetime import datetime, timezone, timedelta
 import threading
+from metadata_store import get_metadata_store
+from feed_cache import get_feed
+from duration_probe import get_duration, get_durations
 
 # Global variable to hold the Firebase app
 firebase_app = None
@@ -51,23 +55,8 @@ def get_podcast_episodes(rss_url):
     try:
         logging.info(f"Parsing RSS feed: {rss_url}")
 
-        # First attempt: Parse the feed normally
-        feed = feedparser.parse(rss_url)
-
-        # If there's an encoding error, try parsing with explicit encodings
-        if feed.bozo and isinstance(feed.bozo_exception, feedparser.CharacterEncodingOverride):
-            logging.warning(f"Encoding mismatch detected. Attempting to parse with different encodings: {rss_url}")
-
-            for encoding in ['utf-8', 'ascii', 'iso-8859-1']:
-                try:
-                    response = requests.get(rss_url)
-                    response.encoding = encoding
-                    feed = feedparser.parse(response.text)
-                    if not feed.bozo:
-                        logging.info(f"Successfully parsed feed with {encoding} encoding")
-                        break
-                except Exception as e:
-                    logging.warning(f"Failed to parse with {encoding} encoding: {str(e)}")
+        # Shared, conditionally fetched copy; encoding mismatches are handled while parsing it
+        feed = get_feed(rss_url).parsed
 
         if feed.bozo and not isinstance(feed.bozo_exception, feedparser.CharacterEncodingOverride):
             logging.error(f"Error parsing RSS feed: {feed.bozo_exception}")
@@ -79,18 +68,32 @@ def get_podcast_episodes(rss_url):
 
         podcast_title = feed.feed.get('title', 'Unknown Podcast')
         episodes = []
+        to_probe = {}
         for i, entry in enumerate(feed.entries):
+            audio_url = entry.get('enclosures', [{}])[0].get('href')
             episode = {
                 'number': i + 1,
                 'title': entry.get('title', 'Untitled'),
                 'published': entry.get('published', 'Unknown date'),
                 'podcast_title': podcast_title,
-                'url': entry.get('enclosures', [{}])[0].get('href') or entry.get('link', ''),
-                'duration': get_episode_duration(entry)
+                'url': audio_url or entry.get('link', ''),
+                'duration': get_feed_duration(entry),
+                # Identify the item in the feed for the modified feed's episode index
+                'guid': entry.get('id'),
+                'enclosure_url': audio_url
             }
             if not episode['url']:
                 logging.warning(f"No URL found for episode: {episode['title']}")
             episodes.append(episode)
+            if episode['duration'] is None and audio_url:
+                to_probe[audio_url] = get_enclosure_length(entry)
+
+        # Items without itunes:duration are measured from their headers, all at once
+        if to_probe:
+            durations = get_durations(list(to_probe), to_probe)
+            for episode in episodes:
+                if episode['duration'] is None:
+                    episode['duration'] = durations.get(episode['url'])
 
         logging.info(f"Successfully parsed {len(episodes)} episodes")
         return episodes
@@ -99,25 +102,38 @@ def get_podcast_episodes(rss_url):
         logging.error(traceback.format_exc())
         raise ValueError(f"Failed to parse podcast episodes: {str(e)}")
 
-def get_episode_duration(entry):
-    # Try to get duration from the RSS feed
+def get_feed_duration(entry):
     duration = entry.get('itunes_duration')
     if duration:
-        return parse_duration(duration)
+        try:
+            return parse_duration(duration)
+        except ValueError:
+            logging.warning(f"Ignoring unparseable itunes:duration: {duration}")
+    return None
 
-    # If not available, try to get it from the audio file (if accessible)
+def get_enclosure_length(entry):
+    try:
+        return int(entry.get('enclosures', [{}])[0].get('length') or 0) or None
+    except ValueError:
+        return None
+
+def get_episode_duration(entry):
+    # Try to get duration from the RSS feed
+    duration = get_feed_duration(entry)
+    if duration is not None:
+        return duration
+
+    # If not available, estimate it from the audio file's headers (if accessible)
     audio_url = entry.get('enclosures', [{}])[0].get('href')
     if audio_url:
-        try:
-            audio = MP3(audio_url)
-            return audio.info.length
-        except:
-            pass
+        return get_duration(audio_url, get_enclosure_length(entry))
 
     # If all else fails, return None
     return None
 
-def download_episode(url, filename):
+def download_episode(url, filename, on_chunk=None):
+    # on_chunk, if given, receives every downloaded block as it arrives (used for streaming ingest).
+    # Returns the SHA-256 of the downloaded audio, computed while streaming.
     try:
         logging.info(f"Starting download from URL: {url}")
         response = requests.get(url, stream=True, timeout=30)
@@ -136,10 +152,14 @@ def download_episode(url, filename):
             unit_divisor=1024,
         ) as progress_bar:
             downloaded = 0
+            sha256 = hashlib.sha256()
             for data in response.iter_content(block_size):
+                sha256.update(data)
                 size = file.write(data)
                 downloaded += size
                 progress_bar.update(size)
+                if on_chunk is not None:
+                    on_chunk(data)
 
                 # Log progress every 10%
                 if total_size > 0 and downloaded % (total_size // 10) < block_size:
@@ -151,6 +171,8 @@ def download_episode(url, filename):
         else:
             logging.info("Download completed successfully.")
 
+        return sha256.hexdigest()
+
     except requests.exceptions.RequestException as e:
         logging.error(f"Error downloading episode: {str(e)}")
         raise
@@ -170,39 +192,35 @@ def run_with_animation(func, *args, **kwargs):
 
 def load_processed_podcasts():
     try:
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        if blob.exists():
-            json_data = blob.download_as_text()
-            data = json.loads(json_data)
-            logging.debug(f"Loaded processed podcasts data: {json.dumps(data, indent=2)}")
-            return data
-        else:
-            logging.warning(f"File {PROCESSED_PODCASTS_FILE} does not exist in Firebase Storage")
-            return {'processed_podcasts': {}, 'auto_processed_podcasts': [], 'podcast_info': {}, 'prompts': {}}
+        data = get_metadata_store().load_document()
+        logging.debug(f"Loaded processed podcasts data: {json.dumps(data, indent=2)}")
+        return data
     except Exception as e:
-        logging.error(f"Error loading processed podcasts from Firebase: {str(e)}")
+        logging.error(f"Error loading processed podcasts from the metadata store: {str(e)}")
         logging.error(traceback.format_exc())
         return {'processed_podcasts': {}, 'auto_processed_podcasts': [], 'podcast_info': {}, 'prompts': {}}
 
 def save_processed_podcasts(data):
+    # Bulk write of a whole db.json-shaped document. Prefer the point operations below.
     try:
-        json_data = json.dumps(data, indent=2)
-        blob = storage.bucket().blob(PROCESSED_PODCASTS_FILE)
-        blob.upload_from_string(json_data, content_type='application/json')
-        logging.info(f"[save_processed_podcasts] Successfully saved processed podcasts data to Firebase")
-        logging.debug(f"[save_processed_podcasts] Saved data: {json_data}")
+        get_metadata_store().import_document(data, overwrite=True)
+        logging.info(f"[save_processed_podcasts] Successfully saved processed podcasts data to the metadata store")
     except Exception as e:
-        logging.error(f"[save_processed_podcasts] Error saving processed podcasts data to Firebase: {str(e)}")
+        logging.error(f"[save_processed_podcasts] Error saving processed podcasts data to the metadata store: {str(e)}")
         logging.error(traceback.format_exc())
 
 def save_auto_processed_podcasts(auto_processed_podcasts):
     try:
-        data = load_processed_podcasts()
-        data['auto_processed_podcasts'] = auto_processed_podcasts
-        save_processed_podcasts(data)
-        logging.info(f"Successfully saved auto-processed podcasts to Firebase")
+        store = get_metadata_store()
+        keep = {entry['rss_url'] for entry in auto_processed_podcasts}
+        for entry in store.list_auto_processed():
+            if entry['rss_url'] not in keep:
+                store.remove_auto_processed(entry['rss_url'])
+        for entry in auto_processed_podcasts:
+            store.set_auto_processed(entry['rss_url'], entry)
+        logging.info(f"Successfully saved auto-processed podcasts to the metadata store")
     except Exception as e:
-        logging.error(f"Error saving auto-processed podcasts to Firebase: {str(e)}")
+        logging.error(f"Error saving auto-processed podcasts to the metadata store: {str(e)}")
         logging.error(traceback.format_exc())
         raise
 
@@ -354,61 +372,46 @@ def download_from_firebase(firebase_url, local_path):
         return False
 
 def load_auto_processed_podcasts():
-    data = load_processed_podcasts()
-    return data.get('auto_processed_podcasts', [])
+    return get_metadata_store().list_auto_processed()
 
 def save_auto_processed_podcast(rss_url):
     try:
         logging.info(f"[save_auto_processed_podcast] Starting for RSS URL: {rss_url}")
-        data = load_processed_podcasts()
-        logging.debug(f"[save_auto_processed_podcast] Loaded data: {json.dumps(data, indent=2)}")
-
-        auto_processed = data.get('auto_processed_podcasts', [])
-        logging.debug(f"[save_auto_processed_podcast] Current auto_processed_podcasts: {auto_processed}")
-
+        store = get_metadata_store()
         current_time = datetime.now(timezone.utc).isoformat()
 
-        # Check if the RSS URL is already in the list
-        existing_entry = next((item for item in auto_processed if item['rss_url'] == rss_url), None)
-
+        existing_entry = store.get_auto_processed(rss_url)
         if existing_entry:
             logging.info(f"[save_auto_processed_podcast] Updating existing entry for {rss_url}")
-            existing_entry['enabled_at'] = current_time
-            existing_entry['last_checked_at'] = current_time
-            logging.debug(f"[save_auto_processed_podcast] Updated existing entry: {existing_entry}")
         else:
             logging.info(f"[save_auto_processed_podcast] Adding new entry for {rss_url}")
-            new_entry = {
-                'rss_url': rss_url,
-                'enabled_at': current_time,
-                'last_checked_at': current_time
-            }
-            auto_processed.append(new_entry)
-            logging.debug(f"[save_auto_processed_podcast] Added new entry: {new_entry}")
+
+        entry = {
+            'rss_url': rss_url,
+            'enabled_at': current_time,
+            'last_checked_at': current_time
+        }
 
         # Always fetch and update podcast information
+        podcast_info = None
         try:
-            feed = feedparser.parse(rss_url)
-            podcast_title = feed.feed.get('title', 'Unknown Podcast')
-            podcast_image = feed.feed.get('image', {}).get('href', '')
-
-            if 'podcast_info' not in data:
-                data['podcast_info'] = {}
-
-            data['podcast_info'][rss_url] = {
-                'name': podcast_title,
-                'imageUrl': podcast_image
+            feed = get_feed(rss_url).parsed
+            podcast_info = {
+                'name': feed.feed.get('title', 'Unknown Podcast'),
+                'imageUrl': feed.feed.get('image', {}).get('href', '')
             }
-            logging.info(f"[save_auto_processed_podcast] Updated podcast info for {rss_url}")
-            logging.debug(f"[save_auto_processed_podcast] New podcast info: {data['podcast_info'][rss_url]}")
+            logging.debug(f"[save_auto_processed_podcast] New podcast info: {podcast_info}")
         except Exception as e:
             logging.error(f"[save_auto_processed_podcast] Error fetching podcast info: {str(e)}")
             logging.error(traceback.format_exc())
 
-        data['auto_processed_podcasts'] = auto_processed
-        logging.debug(f"[save_auto_processed_podcast] Data after modification: {json.dumps(data, indent=2)}")
+        def apply(record):
+            record['auto_process'] = dict(record.get('auto_process') or {}, **entry)
+            if podcast_info is not None:
+                record['podcast_info'] = podcast_info
+            return record
 
-        save_processed_podcasts(data)
+        store.update_podcast(rss_url, apply)
         logging.info(f"[save_auto_processed_podcast] Auto-processed podcast saved successfully: {rss_url}")
     except Exception as e:
         logging.error(f"[save_auto_processed_podcast] Error saving auto-processed podcast: {str(e)}")
@@ -416,13 +419,9 @@ def save_auto_processed_podcast(rss_url):
         raise
 
 def get_auto_process_enable_date(rss_url):
-    data = load_processed_podcasts()
-    auto_processed = data.get('auto_processed_podcasts', [])
-
     logging.info(f"Checking auto-process enable date for RSS URL: {rss_url}")
-    logging.info(f"Auto-processed podcasts: {json.dumps(auto_processed, indent=2)}")
 
-    entry = next((item for item in auto_processed if item['rss_url'] == rss_url), None)
+    entry = get_metadata_store().get_auto_processed(rss_url)
 
     if entry and 'enabled_at' in entry:
         enable_date = datetime.fromisoformat(entry['enabled_at'])
@@ -444,77 +443,84 @@ def is_episode_new(original_rss_url, episode_published_date):
     return episode_published_date >= enable_date
 
 def save_processed_podcast(podcast_data):
+    """Save an episode's processing record. Returns False if the write failed."""
     try:
-        data = load_processed_podcasts()
+        store = get_metadata_store()
         rss_url = podcast_data['rss_url']
 
-        if rss_url not in data['processed_podcasts']:
-            data['processed_podcasts'][rss_url] = []
-
-        # Check if the episode already exists
-        existing_episode = next((ep for ep in data['processed_podcasts'][rss_url] if ep['episode_title'] == podcast_data['episode_title']), None)
-
-        if existing_episode:
-            existing_episode.update(podcast_data)
-        else:
-            data['processed_podcasts'][rss_url].append(podcast_data)
+        store.save_episode(podcast_data)
 
         # Update podcast info, preserving the existing image URL if not provided in podcast_data
-        if rss_url not in data['podcast_info']:
-            data['podcast_info'] = {}
-
-        data['podcast_info'][rss_url]['name'] = podcast_data['podcast_title']
-        if 'image_url' in podcast_data and podcast_data['image_url']:
-            data['podcast_info'][rss_url]['imageUrl'] = podcast_data['image_url']
-        elif 'imageUrl' not in data['podcast_info'][rss_url]:
-            data['podcast_info'][rss_url]['imageUrl'] = ''
-
-        # Save to Firebase
-        save_processed_podcasts(data)
-
-        logging.info(f"Successfully saved processed podcast to Firebase: {podcast_data['episode_title']}")
+        def apply(record):
+            info = dict(record.get('podcast_info') or {})
+            info['name'] = podcast_data['podcast_title']
+            if podcast_data.get('image_url'):
+                info['imageUrl'] = podcast_data['image_url']
+            elif 'imageUrl' not in info:
+                info['imageUrl'] = ''
+            if info == record.get('podcast_info'):
+                return None
+            record['podcast_info'] = info
+            return record
+
+        store.update_podcast(rss_url, apply)
+
+        logging.info(f"Successfully saved processed podcast to the metadata store: {podcast_data['episode_title']}")
+        return True
     except Exception as e:
-        logging.error(f"Error saving processed podcast to Firebase: {str(e)}")
+        logging.error(f"Error saving processed podcast to the metadata store: {str(e)}")
         logging.error(traceback.format_exc())
+        return False
 
 def is_episode_processed(rss_url, episode_title):
-    processed_podcasts = load_processed_podcasts()
-    rss_episodes = processed_podcasts['processed_podcasts'].get(rss_url, [])
-    return any(
-        episode['episode_title'] == episode_title and
-        episode.get('status') == 'completed'  # Only check for completed status
-        for episode in rss_episodes
-    )
+    episode = get_metadata_store().get_episode(rss_url, episode_title)
+    # Only check for completed status
+    return bool(episode) and episode.get('status') == 'completed'
 
 def is_episode_being_processed(rss_url, episode_title):
+    return get_processing_states(rss_url, [episode_title]).get(episode_title, False)
+
+def get_processing_states(rss_url, episode_titles):
+    """
+    Whether each of a feed's episodes is being processed, as {episode_title: bool}.
+    All the lock and status keys are read in a single pipelined round trip.
+    """
+    episode_titles = list(dict.fromkeys(episode_titles))
+    if not episode_titles:
+        return {}
     try:
         db = get_db()
 
-        # Check for active processing lock
-        lock_key = f"lock:job:{rss_url}:{episode_title}"
-        if db.exists(lock_key):
-            # Verify the lock hasn't expired
-            ttl = db.ttl(lock_key)
-            if ttl > 0:
-                return True
+        pipe = db.pipeline(transaction=False)
+        for episode_title in episode_titles:
+            # -2 if there's no processing lock, -1 if it never got its expiry
+            pipe.pttl(f"lock:job:{rss_url}:{episode_title}")
+            pipe.get(f"job_status:{rss_url}:{episode_title}")
+        replies = pipe.execute()
+
+        states = {}
+        expired_locks = []
+        for i, episode_title in enumerate(episode_titles):
+            lock_ttl, status = replies[2 * i], replies[2 * i + 1]
+            if lock_ttl > 0:
+                # Active processing lock
+                states[episode_title] = True
+            elif lock_ttl == -1:
+                # Clean up a lock that would never expire
+                expired_locks.append(f"lock:job:{rss_url}:{episode_title}")
+                states[episode_title] = False
+            elif status:
+                # Only True if the job is actually in progress
+                states[episode_title] = json.loads(status).get('status') in ['processing', 'pending']
             else:
-                # Clean up expired lock
-                db.delete(lock_key)
-                return False
-
-        # Check job status
-        status_key = f"job_status:{rss_url}:{episode_title}"
-        if db.exists(status_key):
-            status = db.get(status_key)
-            if status:
-                status = json.loads(status)
-                # Only return True if the job is actually in progress
-                return status.get('status') in ['processing', 'pending']
+                states[episode_title] = False
 
-        return False
+        if expired_locks:
+            db.delete(*expired_locks)
+        return states
     except Exception as e:
-        logging.error(f"Error checking if episode is being processed: {str(e)}")
-        return False
+        logging.error(f"Error checking if episodes are being processed: {str(e)}")
+        return {episode_title: False for episode_title in episode_titles}
 
 def get_db():
     if not hasattr(get_db, 'db'):
@@ -0,0 +1,90 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE")  # None lets whisper pick cuda when available
+# Opt-in: reload the model once the process' resident memory exceeds this many MB
+WHISPER_RECYCLE_MEMORY_MB = int(os.getenv("WHISPER_RECYCLE_MEMORY_MB", "0"))
+
+_models = {}
+_model_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(name=None):
+    """Return the loaded Whisper model, loading it on first use in this process."""
+    name = name or WHISPER_MODEL
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        model = _models.get(name)
+        if model is None:
+            logging.info(f"Loading Whisper model '{name}'...")
+            start_time = time.time()
+            import whisper
+            model = whisper.load_model(name, device=WHISPER_DEVICE)
+            _models[name] = model
+            _model_locks.setdefault(name, threading.Lock())
+            logging.info(f"Whisper model '{name}' loaded in {time.time() - start_time:.2f} seconds")
+    return model
+
+
+def get_model_lock(name=None):
+    # Whisper installs kv-cache hooks on the model while decoding, so a model
+    # must not run two transcriptions at once (e.g. with the threads pool)
+    name = name or WHISPER_MODEL
+    with _registry_lock:
+        return _model_locks.setdefault(name, threading.Lock())
+
+
+def preload(name=None):
+    try:
+        get_model(name)
+    except Exception as e:
+        # The first task will try again, so don't take the worker down
+        logging.error(f"Error preloading Whisper model: {str(e)}")
+
+
+def unload(name=None):
+    name = name or WHISPER_MODEL
+    with _registry_lock:
+        model = _models.pop(name, None)
+    if model is None:
+        return
+    del model
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    logging.info(f"Unloaded Whisper model '{name}'")
+
+
+def get_resident_memory_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def recycle_if_needed(name=None):
+    """Reload the model when this process' memory has grown past WHISPER_RECYCLE_MEMORY_MB. Returns True if it recycled."""
+    if WHISPER_RECYCLE_MEMORY_MB <= 0:
+        return False
+    resident_mb = get_resident_memory_mb()
+    if resident_mb is None or resident_mb < WHISPER_RECYCLE_MEMORY_MB:
+        return False
+    logging.info(f"Resident memory {resident_mb:.0f} MB exceeds {WHISPER_RECYCLE_MEMORY_MB} MB, recycling Whisper model")
+    with get_model_lock(name):
+        unload(name)
+        preload(name)
+    return True
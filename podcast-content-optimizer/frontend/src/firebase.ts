@@ -1,5 +1,6 @@
 import { initializeApp } from 'firebase/app';
 import { getStorage, ref, getDownloadURL } from 'firebase/storage';
+import { API_BASE_URL, fetchWithCredentials } from './api';
 
 const firebaseConfig = {
   apiKey: process.env.REACT_APP_FIREBASE_API_KEY,
@@ -50,20 +51,20 @@ export const getProcessedPodcasts = async (forceRefresh = false): Promise<{
   }
 
   try {
-    const url = await getFileUrl('db.json');
-    if (url) {
-      const response = await fetch(url);
-      const data = await response.json();
-      cachedData = {
-        processed: data.processed_podcasts || {},
-        autoProcessed: data.auto_processed_podcasts || [],
-        prompts: data.prompts || {},
-        podcastInfo: data.podcast_info || {}
-      };
-      lastFetchTime = now;
-      return cachedData;
+    // Served from the backend's metadata store; db.json is no longer written once it has been imported
+    const response = await fetchWithCredentials(`${API_BASE_URL}/api/processed_podcasts`);
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
     }
-    return { processed: {}, autoProcessed: [], prompts: {}, podcastInfo: {} };
+    const data = await response.json();
+    cachedData = {
+      processed: data.processed_podcasts || {},
+      autoProcessed: data.auto_processed_podcasts || [],
+      prompts: data.prompts || {},
+      podcastInfo: data.podcast_info || {}
+    };
+    lastFetchTime = now;
+    return cachedData;
   } catch (error) {
     console.error('Error fetching processed podcasts:', error);
     return { processed: {}, autoProcessed: [], prompts: {}, podcastInfo: {} };